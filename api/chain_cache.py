@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+class ChainCache:
+    """Async cache of the data of a read endpoint per chain
+
+    The entries are keyed by a version counter of the chain shared through
+    the cache, the writers bump it and the readers never see stale data. The
+    entries of the previous versions expire after `STACKING_CACHE_TIMEOUT`"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def version_key(self, chain_id) -> str:
+        return f"{self.name}_version_{chain_id}"
+
+    async def aversion(self, chain_id) -> int:
+        if (version := await cache.aget(self.version_key(chain_id))) is None:
+            await cache.aadd(self.version_key(chain_id), 0, timeout=None)
+            version = await cache.aget(self.version_key(chain_id), 0)
+        return version
+
+    async def aget(self, chain_id, compute, *params):
+        """Returns the cached data of a chain, computed by the `compute`
+        coroutine function on misses"""
+
+        version = await self.aversion(chain_id)
+        key = "_".join(map(str, [self.name, chain_id, version, *params]))
+        if (data := await cache.aget(key)) is None:
+            data = await compute()
+            await cache.aset(key, data, timeout=settings.STACKING_CACHE_TIMEOUT)
+        return data
+
+    async def abump(self, chain_id):
+        """Invalidates the cached data of a chain"""
+
+        await self.aversion(chain_id)
+        await cache.aincr(self.version_key(chain_id))
+
+    def bump(self, chain_id):
+        if cache.get(self.version_key(chain_id)) is None:
+            cache.add(self.version_key(chain_id), 0, timeout=None)
+        cache.incr(self.version_key(chain_id))
+
+
+stacking_fees_cache = ChainCache("stacking_fees")
+global_stacking_cache = ChainCache("global_stacking")
@@ -1,7 +1,121 @@
+import re
+import json
+import asyncio
+import logging
+from collections import deque
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from api.messages import WStypes
+import api.errors as errors
 
+logger = logging.getLogger(__name__)
 
-class WebsocketConsumer(AsyncJsonWebsocketConsumer):
+RESYNC_FRAME = json.dumps({WStypes.RESYNC: True})
+
+
+class Outbox:
+    """Bounded queue of the frames waiting to be written to a websocket client
+
+    The frames are written by a task of its own, a slow client thus never
+    holds the consumer reading its channel layer messages. Once `size` frames
+    are pending, those of each conflatable group are replaced by a single
+    resync frame, the client then reloads the snapshot of the pair. The
+    outbox is closed and `failed` awaited when a frame cannot be sent"""
+
+    def __init__(self, send, conflatable, size: int, failed):
+        self.send = send
+        self.conflatable = conflatable
+        self.size = size
+        self.failed = failed
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def put(self, group: str, text: str) -> bool:
+        """Queues a frame, `False` is returned when the client is too far behind"""
+
+        if len(self.frames) >= self.size and not self.conflate():
+            return False
+        self.frames.append((group, text))
+        self.ready.set()
+        return True
+
+    def conflate(self) -> bool:
+        """Replaces the pending frames of each conflatable group by a resync frame
+
+        Fails when no frame can be freed, or when a resync frame of one of the
+        groups is still pending: the client stopped reading"""
+
+        groups = {group for group, _ in self.frames if self.conflatable(group)}
+        frames = [(group, text) for group, text in self.frames if group not in groups]
+        if len(frames) + len(groups) >= self.size or any(
+            text == RESYNC_FRAME for group, text in self.frames if group in groups
+        ):
+            return False
+        self.frames = deque(frames + [(group, RESYNC_FRAME) for group in groups])
+        return True
+
+    async def run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                while self.frames:
+                    await self.send(*self.frames.popleft())
+                self.ready.clear()
+        except Exception:
+            logger.exception("a websocket frame could not be sent")
+            self.closed = True
+            self.frames.clear()
+            await self.failed()
+
+    def close(self):
+        self.closed = True
+        self.frames.clear()
+        self.task.cancel()
+
+
+class OutboxMixin:
+    """Writes the frames of a consumer through an `Outbox` of
+    `WEBSOCKET_QUEUE_SIZE` frames, the clients falling too far behind are
+    closed with `RESYNC_CODE`, those whose frames cannot be sent with
+    `ERROR_CODE`
+
+    The consumers define `send_frame(group, text)` and `conflatable(group)`"""
+
+    RESYNC_CODE = 4000
+    ERROR_CODE = 1011
+
+    async def websocket_connect(self, message):
+        self.outbox = Outbox(
+            self.send_frame,
+            self.conflatable,
+            settings.WEBSOCKET_QUEUE_SIZE,
+            lambda: self.close(code=self.ERROR_CODE),
+        )
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        self.outbox.close()
+        await super().websocket_disconnect(message)
+
+    async def queue(self, group: str, text: str):
+        """Queues a frame for the client, closing the hopeless ones"""
+
+        if self.outbox.closed or self.outbox.put(group, text):
+            return
+        self.outbox.close()
+        await self.close(code=self.RESYNC_CODE)
+
+    async def send_encoded(self, event):
+        """Queues a frame encoded once by its publisher"""
+
+        return await self.queue(event["group"], event["text"])
+
+
+class WebsocketConsumer(OutboxMixin, AsyncJsonWebsocketConsumer):
     groups = ["websocket"]
 
     async def websocket_connect(self, message):
@@ -9,11 +123,128 @@ class WebsocketConsumer(AsyncJsonWebsocketConsumer):
         quote = str(self.scope["url_route"]["kwargs"].get("quote", "")).lower()
         chain_id = str(self.scope["url_route"]["kwargs"].get("chain_id", "")).lower()
         await self.channel_layer.group_add(f"{chain_id}{base}{quote}", self.channel_name)  # type: ignore
-        return await super().websocket_connect(message)
+        await super().websocket_connect(message)
+        if base and quote:
+            await self.replay(f"{chain_id}{base}{quote}")
+
+    async def replay(self, key: str):
+        """Sends the deltas following the `sequence` query param of the connection,
+        or a resync message when they are not buffered anymore"""
+
+        from api.order_book import order_book
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        if not (sequence := query.get("sequence", [""])[0]).isdigit():
+            return
+
+        deltas = await sync_to_async(order_book.deltas)(key, int(sequence))
+        if deltas is None:
+            return await self.queue(key, RESYNC_FRAME)
+        for delta in deltas:
+            await self.queue(key, json.dumps(delta))
 
     async def send_json(self, content, close=False):
         return await super().send_json(content["data"], close)
 
+    async def send_frame(self, group: str, text: str):
+        return await self.send(text_data=text)
+
+    def conflatable(self, group: str) -> bool:
+        """Only the deltas of a pair can be replaced by its snapshot"""
+
+        return "quote" in self.scope["url_route"]["kwargs"]
+
+
+class MultiplexConsumer(OutboxMixin, AsyncJsonWebsocketConsumer):
+    """Websocket consumer serving several pairs and stacking channels at once
+
+    The client subscribes to the channels by sending:\n
+    ```python
+    {"action": "subscribe", "channel": "trade/31337/0xbase/0xquote", "sequence": 12}
+    {"action": "subscribe", "channel": "stacking/31337"}
+    {"action": "unsubscribe", "channel": "stacking/31337"}
+    ```
+    the optional `sequence` replays the pair deltas following it. The frames
+    are sent as `{"channel": "trade/31337/0xbase/0xquote", "data": {...}}`"""
+
+    CHANNEL_PATTERN = re.compile(r"trade/(\w+)/(\w+)/(\w+)|stacking/(\w+)")
+
+    async def websocket_connect(self, message):
+        self.subscriptions = {}
+        await super().websocket_connect(message)
+
+    async def disconnect(self, code):
+        for group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)  # type: ignore
+        self.subscriptions = {}
+
+    @classmethod
+    def group_name(cls, channel) -> str | None:
+        """Returns the group of a channel, `None` for unknown channels"""
+
+        if not isinstance(channel, str) or not (
+            match := cls.CHANNEL_PATTERN.fullmatch(channel)
+        ):
+            return None
+        if match.group(4) is not None:
+            return match.group(4).lower()
+        return "".join(part.lower() for part in match.group(1, 2, 3))
+
+    async def receive_json(self, content, **kwargs):
+        channel = content.get("channel") if isinstance(content, dict) else None
+        action = content.get("action") if isinstance(content, dict) else None
+        if action not in ["subscribe", "unsubscribe"]:
+            return await self.send_error(channel, errors.Websocket.WRONG_ACTION)
+        if (group := self.group_name(channel)) is None:
+            return await self.send_error(
+                channel, errors.Websocket.WRONG_CHANNEL.format(channel)
+            )
+
+        if action == "unsubscribe":
+            if self.subscriptions.pop(group, None) is not None:
+                await self.channel_layer.group_discard(group, self.channel_name)  # type: ignore
+            return
+
+        if group not in self.subscriptions:
+            if len(self.subscriptions) >= settings.WEBSOCKET_MAX_SUBSCRIPTIONS:
+                return await self.send_error(
+                    channel,
+                    errors.Websocket.SUBSCRIPTIONS_LIMIT.format(
+                        settings.WEBSOCKET_MAX_SUBSCRIPTIONS
+                    ),
+                )
+            self.subscriptions[group] = channel
+            await self.channel_layer.group_add(group, self.channel_name)  # type: ignore
+        if channel.startswith("trade/") and str(content.get("sequence", "")).isdigit():
+            await self.replay(group, int(content["sequence"]))
+
+    async def replay(self, group: str, sequence: int):
+        """Sends the deltas of a pair following `sequence`, or a resync message
+        when they are not buffered anymore"""
+
+        from api.order_book import order_book
+
+        deltas = await sync_to_async(order_book.deltas)(group, sequence)
+        if deltas is None:
+            return await self.queue(group, RESYNC_FRAME)
+        for delta in deltas:
+            await self.queue(group, json.dumps(delta))
+
+    async def send_error(self, channel, error: str):
+        return await super().send_json({"channel": channel, "error": [error]})
+
+    async def send_frame(self, group: str, text: str):
+        """Sends an encoded frame tagged with the channel of its group"""
+
+        if (channel := self.subscriptions.get(group)) is not None:
+            await self.send(
+                text_data=f'{{"channel": {json.dumps(channel)}, "data": {text}}}'
+            )
+
+    def conflatable(self, group: str) -> bool:
+        return self.subscriptions.get(group, "").startswith("trade/")
+
+
 class TestWebsocketConsumer(AsyncJsonWebsocketConsumer):
     groups = ["websocket"]
     chain_id = ""
@@ -30,5 +261,10 @@ class TestWebsocketConsumer(AsyncJsonWebsocketConsumer):
     async def send_json(self, content, close=False):
         return await super().send_json(content["data"], close)
 
+    async def send_encoded(self, event):
+        """Sends a frame encoded once by its publisher"""
+
+        return await self.send(text_data=event["text"])
+
     async def receive_json(self, content, **kwargs):
         return await self.channel_layer.group_send(f"{self.chain_id}{self.base}{self.quote}", content) # type: ignore
\ No newline at end of file
@@ -1,6 +1,7 @@
 # User view error messages
 class User:
     USER_TIMESTAMP_ERROR = "The submitted timestamp for account creation is too old"
+    INVALID_TOKEN = "the api token submitted is invalid or expired"
 
 
 # Signature Related Errors
@@ -47,6 +48,12 @@ class Order:
     ORDER_POSITIVE_VIOLATION = "orders cannot have numerical negative values"
     BASE_QUOTE_NEEDED = "base_token and quote_token params are needed"
     CHAIN_ID_NEEDED = "The chain_id param is needed for your request"
+    BATCH_FORMAT_ERROR = "the orders field must be a non empty list of orders"
+    BATCH_SIZE_ERROR = "a batch cannot contain more than {} orders"
+    BATCH_DUPLICATE_ORDER = "this order is submitted several times or already exists"
+    ORDER_HASHES_FORMAT_ERROR = (
+        "the orderHashes field must be a non empty list of hashes"
+    )
 
 
 # Permissions Errors
@@ -59,3 +66,19 @@ class General:
     DUPLICATE_USER = "user with this address already exists."
     TOO_OLD_TIMESTAMP = "the timestamp provided is too old for logging in"
     CHECKSUM_ADDRESS_NEEDED = "a checksum address is needed to log in"
+
+
+class Pagination:
+    WRONG_CURSOR = "the cursor submitted is ill formed"
+
+
+class Stacking:
+    BATCH_FORMAT_ERROR = "the events field must be a non empty list of events"
+    BATCH_SIZE_ERROR = "a batch cannot contain more than {} events"
+    WRONG_EVENT_TYPE = "the type of an event must be stacking, fees or withdrawal"
+
+
+class Websocket:
+    WRONG_ACTION = "the action must be subscribe or unsubscribe"
+    WRONG_CHANNEL = "the channel {} does not exist"
+    SUBSCRIPTIONS_LIMIT = "a connection cannot subscribe to more than {} channels"
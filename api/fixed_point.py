@@ -0,0 +1,65 @@
+"""Integer arithmetic for the prices, fees and amounts of the orders
+
+The amounts are integers in wei and the prices are scaled by `WAD`. Up to
+`FEES_THRESHOLD` the maker fees of a bot are thousandths of its level price,
+above it they are the quote token amount earned per base token traded. The
+results are truncated toward zero like the `ROUND_DOWN` decimal context"""
+
+WAD = 10**18
+FEES_BASE = 1000
+FEES_THRESHOLD = 2000
+
+
+def truncate(numerator: int, denominator: int) -> int:
+    """Divides two integers rounding toward zero, `denominator` is positive"""
+
+    quotient = abs(numerator) // denominator
+    return quotient if numerator >= 0 else -quotient
+
+
+def price_up(price: int, maker_fees: int) -> int:
+    """Returns the price of a bot level raised by the bot fees"""
+
+    return price * (FEES_BASE + maker_fees) // FEES_BASE
+
+
+def price_down(price: int, maker_fees: int) -> int:
+    """Returns the price of a bot level lowered by the bot fees"""
+
+    return price * FEES_BASE // (FEES_BASE + maker_fees)
+
+
+def level_trade(
+    price: int, maker_fees: int, amount: int, is_buyer: bool, reverse: bool
+) -> tuple[int, int, int]:
+    """Returns the taker price of a trade on a bot level along with the fees
+    earned by the bot as a `(numerator, denominator)` fraction
+
+    The fees are left as a fraction, they are only truncated once added to
+    the fees already earned by the bot
+
+    Arguments :\n
+    `price`      -- the price of the traded level\n
+    `maker_fees` -- the maker fees of the bot\n
+    `amount`     -- the traded base token amount\n
+    `is_buyer`   -- the side of the traded level\n
+    `reverse`    -- whether the taker trades on the same side as the level\n
+    """
+
+    if upward := is_buyer == reverse:
+        taker_price = price_up(price, maker_fees)
+    else:
+        taker_price = price_down(price, maker_fees)
+
+    if maker_fees > FEES_THRESHOLD:
+        return taker_price, maker_fees * amount, WAD
+    if not upward:
+        return taker_price, price * maker_fees * amount, (maker_fees + FEES_BASE) * WAD
+    if reverse:
+        # the refill of a buyer level keeps the historical fees formula
+        return (
+            taker_price,
+            (price * maker_fees + FEES_BASE - price * FEES_BASE) * amount,
+            FEES_BASE * WAD,
+        )
+    return taker_price, price * maker_fees * amount, FEES_BASE * WAD
@@ -0,0 +1,370 @@
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from itertools import islice
+from threading import Lock
+from asgiref.sync import sync_to_async
+from api.utils import compute_ladder_hashes
+from api.fixed_point import WAD, truncate
+
+
+def level_prices(bot) -> range:
+    """Returns the prices of the levels of a bot ladder"""
+
+    return range(int(bot.lower_bound), int(bot.upper_bound) + 1, int(bot.step))
+
+
+def split_prices(prices: range, price: int) -> tuple[range, range]:
+    """Splits the prices of a ladder into its buying and selling levels, the
+    levels priced up to the bot `price` are buying ones"""
+
+    index = bisect_right(prices, price)
+    return prices[:index], prices[index:]
+
+
+def ladder_order(bot) -> dict:
+    """Returns the replace order signed for a bot, shared by all its levels"""
+
+    return {
+        "address": bot.user.address,
+        "amount": int(bot.amount),
+        "price": int(bot.price),
+        "step": int(bot.step),
+        "maker_fees": int(bot.maker_fees),
+        "upper_bound": int(bot.upper_bound),
+        "lower_bound": int(bot.lower_bound),
+        "base_token": bot.base_token,
+        "quote_token": bot.quote_token,
+        "expiry": int(bot.expiry.timestamp()),
+        "chain_id": int(bot.chain_id),
+        "is_buyer": 0 if bot.is_buyer else 1,
+        "replace_order": True,
+    }
+
+
+def level_hash(bot, price: int) -> str:
+    """Returns the order hash of the level of a bot at `price`"""
+
+    return compute_ladder_hashes(ladder_order(bot), [int(price)])[0]
+
+
+def level_hashes(bot, prices=None) -> list:
+    """Returns the order hashes of the levels of a bot at `prices`, all its
+    levels by default"""
+
+    if prices is None:
+        prices = level_prices(bot)
+    return compute_ladder_hashes(ladder_order(bot), prices)
+
+
+def level_maker(bot, price: int, order_hash: str | None = None):
+    """Returns the unsaved maker of an untouched level of a bot"""
+
+    from api.models.orders import Maker
+
+    return Maker(
+        bot=bot,
+        base_token=bot.base_token,
+        quote_token=bot.quote_token,
+        amount=bot.amount,
+        filled=Decimal("0"),
+        price=Decimal(price),
+        is_buyer=price <= int(bot.price),
+        expiry=bot.expiry,
+        chain_id=bot.chain_id,
+        signature=bot.signature,
+        status=Maker.OPEN,
+        order_hash=order_hash or level_hash(bot, price),
+        timestamp=bot.timestamp,
+    )
+
+
+def expand(bot) -> list:
+    """Returns the makers of all the levels of a bot, the lowest price first
+
+    The stored makers of the touched levels are used when present, the
+    `orders` of the bot should be prefetched"""
+
+    touched = {int(maker.price): maker for maker in bot.orders.all()}
+    prices = [price for price in level_prices(bot) if price not in touched]
+    for price, order_hash in zip(prices, level_hashes(bot, prices)):
+        touched[price] = level_maker(bot, price, order_hash)
+    return [touched[price] for price in level_prices(bot)]
+
+
+def untouched_levels(bot, below=None, limit: int | None = None) -> list:
+    """Returns the unsaved makers of the untouched levels of a bot, the highest
+    price first, the `orders` of the bot should be prefetched
+
+    Arguments :\n
+    `below`  -- only the levels priced below are returned\n
+    `limit`  -- the maximum number of levels returned\n
+    """
+
+    touched = {int(maker.price) for maker in bot.orders.all()}
+    prices = level_prices(bot)
+    if below is not None:
+        prices = prices[: bisect_left(prices, int(below))]
+    prices = list(
+        islice((price for price in reversed(prices) if price not in touched), limit)
+    )
+    return [
+        level_maker(bot, price, order_hash)
+        for price, order_hash in zip(prices, level_hashes(bot, prices))
+    ]
+
+
+def amounts(bot) -> tuple[int, int]:
+    """Returns the base and quote token amounts still offered by a bot
+
+    The amounts of the untouched levels are summed as arithmetic series, only
+    the fills of the touched ones are walked"""
+
+    amount = int(bot.amount)
+    bids, asks = split_prices(level_prices(bot), int(bot.price))
+    base_token_amount = amount * len(asks)
+    quote_token_value = amount * len(bids) * (bids[0] + bids[-1]) // 2 if bids else 0
+    for maker in bot.orders.all():
+        if (price := int(maker.price)) <= int(bot.price):
+            quote_token_value -= int(maker.filled) * price
+        else:
+            base_token_amount -= int(maker.filled)
+    return base_token_amount, truncate(quote_token_value, WAD)
+
+
+class Ladder:
+    """The definition of a bot ladder kept by the order books
+
+    Only the touched levels of a bot are stored as orders, its untouched
+    levels are derived from the definition when the book is read
+
+    Arguments :\n
+    `bot`   -- the bot instance, its `user` should be selected\n
+    `entry` -- the public representation of one of its untouched levels\n
+    """
+
+    HASHES_CHUNK = 64
+    MAX_HASHES_CHUNK = 4096
+
+    def __init__(self, bot, entry: dict):
+        self.order = ladder_order(bot)
+        self.bids, self.asks = split_prices(level_prices(bot), int(bot.price))
+        self.amount = int(bot.amount)
+        self.entry = entry
+
+    def prices(self, is_buyer: bool, start: int | None = None):
+        """Returns the prices of the levels of one side, the best price first,
+        from the `start` price included"""
+
+        if is_buyer:
+            prices = self.bids
+            if start is not None:
+                prices = prices[: bisect_right(prices, start)]
+            return reversed(prices)
+
+        prices = self.asks
+        if start is not None:
+            prices = prices[bisect_left(prices, start) :]
+        return iter(prices)
+
+    def levels(self, is_buyer: bool, start: int | None = None, skip=()):
+        """Yields the `(price, order_hash, ladder)` of the levels of one side
+        whose price is not in `skip`, the best price first
+
+        The levels are hashed by growing chunks as the iteration goes"""
+
+        prices = (price for price in self.prices(is_buyer, start) if price not in skip)
+        size = self.HASHES_CHUNK
+        while chunk := list(islice(prices, size)):
+            for price, order_hash in zip(
+                chunk, compute_ladder_hashes(self.order, chunk)
+            ):
+                yield price, order_hash, self
+            size = min(size * 2, self.MAX_HASHES_CHUNK)
+
+    def liquidity(self, is_buyer: bool, skip=()):
+        """Yields the `(price, amount, count)` offered by the levels of one side
+        whose price is not in `skip`, the best price first"""
+
+        for price in self.prices(is_buyer):
+            if price not in skip:
+                yield price, self.amount, 1
+
+    def level(self, price: int, order_hash: str) -> dict:
+        """Returns the public representation of the untouched level at `price`"""
+
+        return {
+            **self.entry,
+            "price": str(price),
+            "is_buyer": price <= self.order["price"],
+            "order_hash": order_hash,
+        }
+
+
+class LadderIndex:
+    """Maps the order hashes of the bots levels to their bot and price
+
+    The index is kept in the process memory and completed lazily, the bots
+    created since the last lookup are indexed when a hash is missing. The
+    index is refreshed by batches of about `REFRESH_LEVELS` hashed levels
+    until the hashes looked for are found or every bot has been indexed.
+    The least recently resolved bots are evicted over `MAX_LEVELS` levels,
+    they are indexed again when a hash is missing. The deleted bots are
+    forgotten when `materialize` fails to load them"""
+
+    REFRESH_LEVELS = 100_000
+    MAX_LEVELS = 1_000_000
+
+    def __init__(self):
+        self.levels = {}
+        self.bots = {}
+        self.evicted = []
+        self.last_id = 0
+        self.lock = Lock()
+
+    def refresh(self, order_hashes, indexed: set) -> bool:
+        """Indexes a batch of new bots, the lowest ids first, or of evicted
+        ones, until `REFRESH_LEVELS` levels have been hashed or the hashes
+        looked for are found
+
+        Arguments :\n
+        `order_hashes`  -- the order hashes looked for\n
+        `indexed`       -- the ids of the bots already indexed by the lookup,
+        they are not indexed again when evicted meanwhile\n
+
+        Returns `False` when there was no bot left to index"""
+
+        from api.models.orders import Bot
+
+        bots = (
+            Bot.objects.filter(id__gt=self.last_id)
+            .select_related("user")
+            .order_by("id")
+            .iterator()
+        )
+        budget = self.REFRESH_LEVELS
+        while budget > 0 and (bot := next(bots, None)) is not None:
+            budget -= self.index(bot)
+            indexed.add(bot.id)
+            self.last_id = bot.id
+            if all(h in self.levels for h in order_hashes):
+                return True
+
+        for bot_id in [bot_id for bot_id in self.evicted if bot_id not in indexed]:
+            if budget <= 0:
+                return True
+            self.evicted.remove(bot_id)
+            indexed.add(bot_id)
+            if (
+                bot := Bot.objects.select_related("user").filter(id=bot_id).first()
+            ) is not None:
+                budget -= self.index(bot)
+            if all(h in self.levels for h in order_hashes):
+                return True
+        return budget < self.REFRESH_LEVELS
+
+    def index(self, bot) -> int:
+        """Indexes the levels of a bot, returns the number of levels hashed"""
+
+        hashes = level_hashes(bot)
+        for price, order_hash in zip(level_prices(bot), hashes):
+            self.levels[order_hash] = (bot.id, price)
+        self.bots[bot.id] = hashes
+
+        while len(self.levels) > self.MAX_LEVELS and len(self.bots) > 1:
+            bot_id = next(iter(self.bots))
+            self.forget(bot_id)
+            self.evicted.append(bot_id)
+        return len(hashes)
+
+    def forget(self, bot_id: int):
+        """Removes the levels of a bot from the index"""
+
+        for order_hash in self.bots.pop(bot_id, []):
+            if self.levels.get(order_hash, (None,))[0] == bot_id:
+                del self.levels[order_hash]
+
+    def resolve(self, order_hashes, forget=()) -> dict:
+        """Returns the `(bot_id, price)` of the known levels among `order_hashes`
+
+        Arguments :\n
+        `order_hashes`  -- the order hashes to look for\n
+        `forget`        -- the ids of the deleted bots to drop beforehand\n
+        """
+
+        with self.lock:
+            for bot_id in forget:
+                self.forget(bot_id)
+            indexed = set()
+            while any(h not in self.levels for h in order_hashes):
+                if not self.refresh(order_hashes, indexed):
+                    break
+
+            levels = {
+                order_hash: self.levels[order_hash]
+                for order_hash in order_hashes
+                if order_hash in self.levels
+            }
+            # the resolved bots are moved to the end of the eviction order
+            for bot_id, _ in levels.values():
+                if bot_id in self.bots:
+                    self.bots[bot_id] = self.bots.pop(bot_id)
+            return levels
+
+    def clear(self):
+        with self.lock:
+            self.levels.clear()
+            self.bots.clear()
+            self.evicted.clear()
+            self.last_id = 0
+
+
+ladder_index = LadderIndex()
+
+
+def materialize(order_hashes) -> list:
+    """Stores the makers of the untouched bot levels among `order_hashes`
+
+    Returns the created makers, the levels already stored are left as is"""
+
+    from api.models.orders import Maker, Bot
+
+    stored = set(
+        Maker.objects.filter(order_hash__in=order_hashes).values_list(
+            "order_hash", flat=True
+        )
+    )
+    if not (missing := [h for h in order_hashes if h not in stored]):
+        return []
+
+    levels = ladder_index.resolve(missing)
+    bots = Bot.objects.select_related("user").in_bulk(
+        {bot_id for bot_id, _ in levels.values()}
+    )
+    if deleted := {bot_id for bot_id, _ in levels.values() if bot_id not in bots}:
+        # the deleted bots are forgotten, their levels may belong to a new bot
+        levels = ladder_index.resolve(missing, forget=deleted)
+        bots = Bot.objects.select_related("user").in_bulk(
+            {bot_id for bot_id, _ in levels.values()}
+        )
+    return Maker.objects.bulk_create(
+        [
+            level_maker(bots[bot_id], price, order_hash)
+            for order_hash, (bot_id, price) in levels.items()
+            if bot_id in bots
+        ],
+        ignore_conflicts=True,
+    )
+
+
+async def amaterialize(order_hashes) -> list:
+    return await sync_to_async(materialize)(order_hashes)
+
+
+def materialize_level(bot, price):
+    """Returns the stored maker of the level of a bot at `price`, creating it if needed"""
+
+    from api.models.orders import Maker
+
+    order_hash = level_hash(bot, int(price))
+    materialize([order_hash])
+    return Maker.objects.select_related("bot", "bot__user").get(order_hash=order_hash)
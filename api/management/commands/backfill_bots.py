@@ -0,0 +1,54 @@
+"""Fills the ladder definition of the bots stored before it was kept on the bot
+
+Rollout order :\n
+1. generate the migration adding the bot columns, giving the one-off
+   placeholders "" to the tokens and the signature, 0 to the amount, False to
+   the side and the current time to the expiry\n
+2. apply it and run this command before the workers are restarted on the code
+   reading the ladders from the bots\n
+
+The bots without any maker left are reported, their placeholder expiry lets
+the expiry cron delete them
+"""
+
+from django.core.management.base import BaseCommand
+from api.models.orders import Bot
+from api.ladders import level_hash
+
+
+class Command(BaseCommand):
+    help = "Fills the ladder definition of the bots from the makers of their levels"
+
+    def handle(self, *args, **options):
+        bots = Bot.objects.filter(signature="").select_related("user")
+        for bot in bots.iterator():
+            maker = bot.orders.order_by("price").first()
+            if maker is None:
+                self.stderr.write(f"bot {bot.bot_hash} has no maker to backfill from")
+                continue
+
+            bot.base_token = maker.base_token
+            bot.quote_token = maker.quote_token
+            bot.amount = maker.amount
+            bot.expiry = maker.expiry
+            bot.signature = maker.signature
+            # the makers store the side of their level, the signed one of the
+            # bot is the one the stored order hash was computed with
+            for is_buyer in (False, True):
+                bot.is_buyer = is_buyer
+                if level_hash(bot, int(maker.price)) == maker.order_hash:
+                    break
+            else:
+                self.stderr.write(f"bot {bot.bot_hash} does not match its makers")
+                continue
+
+            bot.save(
+                update_fields=[
+                    "base_token",
+                    "quote_token",
+                    "amount",
+                    "expiry",
+                    "signature",
+                    "is_buyer",
+                ]
+            )
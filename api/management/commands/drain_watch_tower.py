@@ -0,0 +1,22 @@
+from time import sleep
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.views.watch_tower import drain_commits
+
+
+class Command(BaseCommand):
+    help = "Applies the queued watch tower commits"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="drains the queue once and exits"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = async_to_sync(drain_commits)()
+            if options["once"]:
+                return
+            if not processed:
+                sleep(settings.WATCH_TOWER_QUEUE_INTERVAL)
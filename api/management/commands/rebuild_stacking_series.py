@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from api.models.stacking import Stacking
+from api import rewards, stacking_series
+
+
+class Command(BaseCommand):
+    help = "Computes the global stacking series and the rewards again from the entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "chain_ids", nargs="*", type=int, help="defaults to all the chains"
+        )
+
+    def handle(self, *args, **options):
+        chain_ids = options["chain_ids"] or (
+            Stacking.objects.values_list("chain_id", flat=True).distinct()
+        )
+        for chain_id in chain_ids:
+            stacking_series.rebuild(chain_id)
+            rewards.rebuild(chain_id)
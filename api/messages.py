@@ -1,5 +1,9 @@
+import json
+
+
 class WStypes:
     NEW_MAKER = "new_maker"
+    NEW_MAKERS = "new_makers"
     NEW_BOT = "new_bot"
     DEL_MAKERS = "delete_makers"
     DEL_BOTS = "delete_bots"
@@ -8,3 +12,15 @@ class WStypes:
     NEW_STACKING = "new_stacking"
     NEW_FEES = "new_fees"
     NEW_FSA_WITHDRAWAL = "new_fsa_withdrawal"
+    STACKING_EVENTS = "stacking_events"
+    SEQUENCE = "sequence"
+    RESYNC = "resync"
+
+
+def frame(group: str, data: dict) -> dict:
+    """Returns the channel layer event broadcasting a websocket frame to a group
+
+    The frame is encoded once there, the consumers of the group send the
+    encoded text as is"""
+
+    return {"type": "send.encoded", "group": group, "text": json.dumps(data)}
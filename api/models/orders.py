@@ -40,6 +40,21 @@ class Maker(models.Model):
                 name="bot_or_user_must_be_set",
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["chain_id", "base_token", "quote_token", "status"],
+                name="maker_pair_status_idx",
+            ),
+            models.Index(
+                fields=["chain_id", "base_token", "quote_token"],
+                condition=models.Q(status="OP", bot__isnull=True),
+                name="maker_pair_open_idx",
+            ),
+            models.Index(
+                fields=["chain_id", "quote_token"], name="maker_chain_quote_idx"
+            ),
+            models.Index(fields=["expiry"], name="maker_expiry_idx"),
+        ]
 
     user = models.ForeignKey("User", on_delete=models.CASCADE, null=True, blank=True)
     bot = models.ForeignKey(
@@ -114,6 +129,14 @@ class Taker(models.Model):
 
     objects = AsyncManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["maker", "timestamp"], name="taker_maker_timestamp_idx"
+            ),
+            models.Index(fields=["user", "timestamp"], name="taker_user_timestamp_idx"),
+        ]
+
     constraints = [
         models.CheckConstraint(
             check=models.Q(amount__gte=Decimal("0")) & models.Q(fees__gt=Decimal("0")),
@@ -127,12 +150,14 @@ class Taker(models.Model):
         null=True,
         blank=True,
         related_name="takers",
+        db_index=False,
     )
     user = models.ForeignKey(
         "User",
         on_delete=models.CASCADE,
         null=False,
         blank=False,
+        db_index=False,
     )
     block = models.BigIntegerField(null=False, blank=False)
     amount = models.DecimalField(
@@ -155,8 +180,82 @@ class Taker(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
 
+class BlockCommit(models.Model):
+    """The ledger of the trades committed by the watch tower
+
+    Each commit is identified by the digest of its block, taker and trades,
+    a retried commit is recognized and is not applied twice"""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["digest"], name="block_commit_digest_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["timestamp"], name="block_commit_timestamp_idx"),
+        ]
+
+    digest = models.CharField(null=False, blank=False, max_length=64)
+    block = models.BigIntegerField(null=False, blank=False)
+    taker = models.CharField(
+        null=False,
+        blank=False,
+        max_length=42,
+        validators=[
+            MinLengthValidator(limit_value=42),
+        ],
+    )
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+
+class QueuedCommit(models.Model):
+    """The watch tower commits waiting to be applied
+
+    The queued commits of a block are applied at once by the queue worker,
+    a commit failing on its own is kept along with its error"""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["digest"], name="queued_commit_digest_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["block", "id"], name="queued_commit_block_idx"),
+        ]
+
+    digest = models.CharField(null=False, blank=False, max_length=64)
+    block = models.BigIntegerField(null=False, blank=False)
+    taker = models.CharField(
+        null=False,
+        blank=False,
+        max_length=42,
+        validators=[
+            MinLengthValidator(limit_value=42),
+        ],
+    )
+    trades = models.JSONField(null=False, blank=False)
+    error = models.JSONField(null=True, blank=True, default=None)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+
 class Bot(models.Model):
-    """The model used to store replace orders data, and group them to a"""
+    """The model used to store replace orders data, and group them to a
+
+    A bot is stored as the definition of its price ladder, a `Maker` order
+    only exists for the levels that have been traded"""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot_hash"], name="bot_hash_unique"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["chain_id", "base_token", "quote_token"], name="bot_pair_idx"
+            ),
+            models.Index(fields=["expiry"], name="bot_expiry_idx"),
+        ]
 
     bot_hash = models.CharField(null=False, blank=False)
     user = models.ForeignKey("User", on_delete=models.CASCADE, null=False, blank=False)
@@ -195,3 +294,38 @@ class Bot(models.Model):
     fees_earned = models.DecimalField(
         max_digits=78, decimal_places=0, default=Decimal("0")
     )
+    base_token = models.CharField(
+        null=False,
+        blank=False,
+        max_length=42,
+        validators=[
+            MinLengthValidator(limit_value=42),
+        ],
+    )
+    quote_token = models.CharField(
+        null=False,
+        blank=False,
+        max_length=42,
+        validators=[
+            MinLengthValidator(limit_value=42),
+        ],
+    )
+    amount = models.DecimalField(
+        max_digits=78,
+        decimal_places=0,
+        null=False,
+        blank=False,
+    )
+    is_buyer = models.BooleanField(null=False, blank=False)
+    expiry = models.DateTimeField(
+        null=False,
+        blank=False,
+    )
+    signature = models.CharField(
+        null=False,
+        blank=False,
+        max_length=132,
+        validators=[
+            MinLengthValidator(limit_value=132),
+        ],
+    )
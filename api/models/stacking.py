@@ -81,3 +81,66 @@ class StackingFees(models.Model):
 
     def __str__(self):
         return f"Fees received Token: {self.token}, Amount {self.amount}, at {self.slot} block, on chain_id {self.chain_id}"
+
+
+class GlobalStacking(models.Model):
+    """Model used to materialize the amount stacked by all the users per slot
+
+    Each slot holds its total along with the running total of the chain up to
+    it, the rows are kept up to date by `api.stacking_series`"""
+
+    class Meta:
+        constraints = [
+            models.constraints.UniqueConstraint(
+                fields=("chain_id", "slot"),
+                name="unique_global_stacking_chain_id_and_slot",
+            )
+        ]
+
+    chain_id = models.IntegerField(null=False, blank=False)
+    slot = models.IntegerField(null=False, blank=False)
+    amount = models.DecimalField(
+        max_digits=78, decimal_places=0, null=False, blank=False, default=Decimal("0")
+    )
+    cumulative = models.DecimalField(
+        max_digits=78, decimal_places=0, null=False, blank=False, default=Decimal("0")
+    )
+
+    def __str__(self):
+        return f"Stacked {self.amount}, {self.cumulative} in total, at {self.slot} block, on chain_id {self.chain_id}"
+
+
+class StackingReward(models.Model):
+    """Model used to track the fees accrued and withdrawn by the users per token
+
+    The fees of a slot are shared between the users pro rata of their stake
+    before the slot, the rows are kept up to date by `api.rewards`"""
+
+    class Meta:
+        constraints = [
+            models.constraints.UniqueConstraint(
+                fields=("user", "token", "chain_id"),
+                name="unique_reward_per_user_token_chain_id",
+            )
+        ]
+
+    chain_id = models.IntegerField(null=False, blank=False)
+    user = models.ForeignKey("User", on_delete=models.CASCADE, null=False, blank=False)
+    token = models.CharField(
+        null=False,
+        blank=False,
+        max_length=42,
+        validators=[
+            MinLengthValidator(limit_value=42),
+            MaxLengthValidator(limit_value=42),
+        ],
+    )
+    accrued = models.DecimalField(
+        max_digits=78, decimal_places=0, null=False, blank=False, default=Decimal("0")
+    )
+    withdrawn = models.DecimalField(
+        max_digits=78, decimal_places=0, null=False, blank=False, default=Decimal("0")
+    )
+
+    def __str__(self):
+        return f"User: {self.user.address}, Accrued {self.accrued} {self.token}, withdrawn {self.withdrawn}, on chain_id {self.chain_id}"
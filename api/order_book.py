@@ -0,0 +1,729 @@
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from heapq import merge as merge_sorted
+from itertools import dropwhile
+from threading import Lock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Q, Case, CharField, Value, When
+from channels.layers import get_channel_layer
+from api.messages import WStypes, frame
+from api.fixed_point import price_down, price_up
+
+channel_layer = get_channel_layer()
+
+_pending_pairs: ContextVar = ContextVar("order_book_pending_pairs", default=None)
+
+
+def book_key(chain_id, base_token, quote_token) -> str:
+    """Returns the key of a pair book, it matches the pair websocket group name"""
+
+    return f"{str(chain_id).lower()}{str(base_token).lower()}{str(quote_token).lower()}"
+
+
+def merge(message: dict, data: dict) -> bool:
+    """Merges a delta into a pending websocket message of the same pair
+
+    The lists of a same type are concatenated, `False` is returned when the
+    delta holds a single value of a type already present in the message"""
+
+    if any(
+        key in message and not isinstance(value, list) for key, value in data.items()
+    ):
+        return False
+    for key, value in data.items():
+        message[key] = message[key] + value if key in message else value
+    return True
+
+
+def touched(data: dict) -> set:
+    """Returns the order and bot hashes a websocket delta refers to"""
+
+    hashes = set()
+    for value in data.values():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, str):
+                hashes.add(item)
+            elif isinstance(item, dict):
+                hashes.update(
+                    item[field]
+                    for field in ("order_hash", "maker_hash", "bot_hash")
+                    if field in item
+                )
+                if isinstance(bot := item.get("bot"), dict) and "bot_hash" in bot:
+                    hashes.add(bot["bot_hash"])
+    return hashes
+
+
+def is_booked(entry: dict) -> bool:
+    """Only open orders and bot orders, whatever their status, are shown in the book"""
+
+    return entry["bot"] is not None or entry["status"] == "OPEN"
+
+
+def maker_entry(maker) -> dict:
+    """Returns the public book representation of a maker instance"""
+
+    from api.serializers.orders import MakerSerializer
+
+    if not hasattr(maker, "address"):
+        maker.address = maker.user.address if maker.user_id else maker.bot.user.address
+    maker.base_fees = Decimal("0")
+    maker.quote_fees = Decimal("0")
+    return MakerSerializer(maker).data
+
+
+def quotes(entry: dict):
+    """Yields the liquidity offered by an order as `(is_buyer, price, amount)`
+
+    The filled part of a bot order is offered back on the other side of the
+    book, at the maker price moved by the bot fees"""
+
+    price = int(entry["price"])
+    yield entry["is_buyer"], price, int(entry["amount"]) - int(entry["filled"])
+
+    if entry["bot"] is not None:
+        fees = int(entry["bot"]["maker_fees"])
+        if entry["is_buyer"]:
+            reverse_price = price_up(price, fees)
+        else:
+            reverse_price = price_down(price, fees)
+        yield not entry["is_buyer"], reverse_price, int(entry["filled"])
+
+
+class OrderBook:
+    """The resident order book of one pair
+
+    The orders are stored as their public representation, grouped by price
+    levels kept sorted on both sides of the book. The remaining amount and
+    the number of orders offered at each price are maintained alongside.
+
+    The bots are kept as the definition of their ladder, see `Ladder`, only
+    their touched levels are stored as orders. The untouched levels and
+    their liquidity are derived from the ladders when the book is read"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.orders = {}
+        self.bots = {}
+        self.levels = {True: {}, False: {}}
+        self.prices = {True: [], False: []}
+        self.liquidity = {True: {}, False: {}}
+        self.liquidity_prices = {True: [], False: []}
+        self.snapshot = None
+
+    def track(self, entry: dict, sign: int):
+        """Adds, or removes with a negative `sign`, an order from the liquidity"""
+
+        for is_buyer, price, amount in quotes(entry):
+            if amount <= 0:
+                continue
+            levels = self.liquidity[is_buyer]
+            if price not in levels:
+                levels[price] = [0, 0]
+                insort(self.liquidity_prices[is_buyer], price)
+            levels[price][0] += sign * amount
+            levels[price][1] += sign
+            if not levels[price][1]:
+                del levels[price]
+                self.liquidity_prices[is_buyer].remove(price)
+
+    def add(self, entry: dict):
+        """Adds or replaces an order of the book"""
+
+        if entry["order_hash"] in self.orders:
+            self.remove(entry["order_hash"])
+        if not is_booked(entry):
+            return
+
+        price = int(entry["price"])
+        levels = self.levels[entry["is_buyer"]]
+        if price not in levels:
+            levels[price] = {}
+            insort(self.prices[entry["is_buyer"]], price)
+        levels[price][entry["order_hash"]] = entry
+
+        if entry["bot"] is not None:
+            bot = self.bot(entry["bot"])
+            entry["bot"] = bot["bot"]
+            bot["orders"][entry["order_hash"]] = price
+
+        self.orders[entry["order_hash"]] = entry
+        self.track(entry, 1)
+        self.snapshot = None
+
+    def remove(self, *order_hashes: str):
+        """Removes orders from the book if present"""
+
+        for order_hash in order_hashes:
+            if (entry := self.orders.pop(order_hash, None)) is None:
+                continue
+            self.track(entry, -1)
+
+            price = int(entry["price"])
+            levels = self.levels[entry["is_buyer"]]
+            del levels[price][order_hash]
+            if not levels[price]:
+                del levels[price]
+                self.prices[entry["is_buyer"]].remove(price)
+
+            if entry["bot"] is not None:
+                bot = self.bots[entry["bot"]["bot_hash"]]
+                del bot["orders"][order_hash]
+                if not bot["orders"] and bot["ladder"] is None:
+                    del self.bots[entry["bot"]["bot_hash"]]
+            self.snapshot = None
+
+    def bot(self, data: dict) -> dict:
+        """Returns the record of a bot, `{"bot", "orders", "ladder"}`, creating it
+        if needed, the representation of the bot is shared by all its orders"""
+
+        if (bot := self.bots.get(data["bot_hash"])) is None:
+            bot = self.bots[data["bot_hash"]] = {
+                "bot": data,
+                "orders": {},
+                "ladder": None,
+            }
+        elif bot["bot"] is not data:
+            bot["bot"].update(data)
+        return bot
+
+    def add_ladder(self, ladder):
+        """Adds or replaces the ladder of a bot, its untouched levels are then
+        shown into the book"""
+
+        bot = self.bot(ladder.entry["bot"])
+        ladder.entry["bot"] = bot["bot"]
+        bot["ladder"] = ladder
+        self.snapshot = None
+
+    def cancel(self, *order_hashes: str):
+        """Cancels booked orders, the bot ones stay into the book with their
+        status as when cancelled through the ORM"""
+
+        for order_hash in order_hashes:
+            if (entry := self.orders.get(order_hash)) is None:
+                continue
+            if entry["bot"] is not None:
+                self.update(order_hash, status="CANCELLED")
+            else:
+                self.remove(order_hash)
+
+    def remove_bot(self, bot_hash: str):
+        """Removes the ladder and all the orders of a bot from the book"""
+
+        if (bot := self.bots.get(bot_hash)) is not None:
+            self.remove(*bot["orders"])
+            self.bots.pop(bot_hash, None)
+            self.snapshot = None
+
+    def update(self, order_hash: str, **fields):
+        """Updates the fields of a booked order, orders leaving the book are removed"""
+
+        if (previous := self.orders.get(order_hash)) is None:
+            return
+        entry = {**previous, **fields}
+        if not is_booked(entry):
+            self.remove(order_hash)
+        else:
+            self.track(previous, -1)
+            self.track(entry, 1)
+            self.levels[entry["is_buyer"]][int(entry["price"])][order_hash] = entry
+            self.orders[order_hash] = entry
+            self.snapshot = None
+
+    def update_bot(self, bot_hash: str, **fields):
+        """Updates the fields shared by all the orders of a bot"""
+
+        if (bot := self.bots.get(bot_hash)) is None:
+            return
+        bot["bot"].update(fields)
+        self.snapshot = None
+
+    def update_makers(self, makers: list):
+        """Applies the fills of the makers representations sent on trades
+
+        The first fill of an untouched bot level stores it into the book"""
+
+        for maker in makers:
+            if (
+                maker["order_hash"] not in self.orders
+                and maker["bot"] is not None
+                and maker["bot"]["bot_hash"] in self.bots
+            ):
+                self.add({**maker, "base_fees": "0", "quote_fees": "0"})
+            else:
+                self.update(
+                    maker["order_hash"], filled=maker["filled"], status=maker["status"]
+                )
+            if maker["bot"] is not None:
+                self.update_bot(
+                    maker["bot"]["bot_hash"], fees_earned=maker["bot"]["fees_earned"]
+                )
+
+    def side(self, is_buyer: bool):
+        """Yields the price levels of one side, the best price first"""
+
+        prices = self.prices[is_buyer]
+        for price in reversed(prices) if is_buyer else prices:
+            yield price, self.levels[is_buyer][price]
+
+    def ladders(self):
+        """Yields the ladders of the bots along with the prices of their touched levels"""
+
+        for bot in self.bots.values():
+            if bot["ladder"] is not None:
+                yield bot["ladder"], set(bot["orders"].values())
+
+    def stream(self, is_buyer: bool, start: int | None = None):
+        """Yields the `(price, order_hash, ladder)` of the orders of one side,
+        sorted by best price then order hash, from the `start` price included
+
+        The `ladder` is `None` for the stored orders, the untouched levels of
+        the bots are derived from their ladder as the iteration goes"""
+
+        def stored():
+            prices = self.prices[is_buyer]
+            if is_buyer:
+                if start is not None:
+                    prices = prices[: bisect_right(prices, start)]
+                prices = reversed(prices)
+            elif start is not None:
+                prices = prices[bisect_left(prices, start) :]
+            for price in prices:
+                for order_hash in sorted(self.levels[is_buyer][price]):
+                    yield price, order_hash, None
+
+        return merge_sorted(
+            stored(),
+            *[
+                ladder.levels(is_buyer, start, touched)
+                for ladder, touched in self.ladders()
+            ],
+            key=lambda level: (-level[0] if is_buyer else level[0], level[1]),
+        )
+
+    def entry(self, price: int, order_hash: str, ladder=None) -> dict:
+        """Returns the public representation of an order yielded by `stream`"""
+
+        if ladder is None:
+            return self.orders[order_hash]
+        return ladder.level(price, order_hash)
+
+    def depth(self, is_buyer: bool, limit: int, tick: int = 1) -> list:
+        """Returns the `limit` best liquidity levels of one side
+
+        Prices are grouped by multiples of `tick`, rounded down for the bids
+        and up for the asks so that grouped levels never cross. The liquidity
+        of the untouched bot levels is derived from their ladder"""
+
+        prices = self.liquidity_prices[is_buyer]
+        stored = (
+            (price, *self.liquidity[is_buyer][price])
+            for price in (reversed(prices) if is_buyer else prices)
+        )
+        levels = []
+        for price, amount, count in merge_sorted(
+            stored,
+            *[
+                ladder.liquidity(is_buyer, touched)
+                for ladder, touched in self.ladders()
+            ],
+            key=lambda level: -level[0] if is_buyer else level[0],
+        ):
+            price = price // tick * tick if is_buyer else -(-price // tick) * tick
+            if levels and levels[-1][0] == price:
+                levels[-1][1] += amount
+                levels[-1][2] += count
+            elif len(levels) == limit:
+                break
+            else:
+                levels.append([price, amount, count])
+        return [
+            {"price": str(price), "amount": str(amount), "count": count}
+            for price, amount, count in levels
+        ]
+
+    def page(self, after: list | None, limit: int) -> list:
+        """Returns up to `limit` orders following the `after` cursor
+
+        The orders are sorted by side, asks first, then best price and order
+        hash, a cursor holds the `[is_buyer, price, order_hash]` of the last
+        order of the previous page"""
+
+        if after is not None:
+            after = [bool(after[0]), int(after[1]), str(after[2])]
+        orders = []
+        for is_buyer in (False, True):
+            if after is not None and after[0] and not is_buyer:
+                continue
+            if after is not None and after[0] == is_buyer:
+                levels = dropwhile(
+                    lambda level: level[0] == after[1] and level[1] <= after[2],
+                    self.stream(is_buyer, after[1]),
+                )
+            else:
+                levels = self.stream(is_buyer)
+
+            for level in levels:
+                if len(orders) == limit:
+                    return orders
+                orders.append(self.entry(*level))
+        return orders
+
+    def to_list(self) -> list:
+        """Returns the book orders, asks then bids, best prices then order
+        hashes first"""
+
+        if self.snapshot is None:
+            self.snapshot = [
+                self.entry(*level)
+                for is_buyer in (False, True)
+                for level in self.stream(is_buyer)
+            ]
+        return self.snapshot
+
+
+class OrderBookEngine:
+    """Keeps the order books of the pairs in memory for the running worker
+
+    The books are lazily loaded from the database and updated in place by
+    the views writing the orders. A version counter per pair is shared
+    through the cache, a book whose version lags behind the shared one
+    has been modified by another process and is loaded again.
+
+    The websocket deltas of a pair are numbered by a second counter, the
+    last `DELTAS_BUFFER_SIZE` ones are kept in a ring buffer of the cache
+    so reconnecting clients can resume from their last sequence.
+
+    The deltas broadcast during `WEBSOCKET_COALESCING_WINDOW` seconds are
+    merged, a pair then receives one message per window during bursts. A
+    delta on an order already in the pending message starts a new one."""
+
+    DELTAS_BUFFER_SIZE = 1024
+
+    def __init__(self):
+        self.books = {}
+        self.messages = {}
+        self.flushes = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def version_key(key: str) -> str:
+        return f"order_book_version_{key}"
+
+    def get_version(self, key: str) -> int:
+        if (version := cache.get(self.version_key(key))) is None:
+            cache.add(self.version_key(key), 0, timeout=None)
+            version = cache.get(self.version_key(key), 0)
+        return version
+
+    @staticmethod
+    def sequence_key(key: str) -> str:
+        return f"order_book_sequence_{key}"
+
+    def delta_key(self, key: str, sequence: int) -> str:
+        return f"order_book_delta_{key}_{sequence % self.DELTAS_BUFFER_SIZE}"
+
+    def get_sequence(self, key: str) -> int:
+        if (sequence := cache.get(self.sequence_key(key))) is None:
+            cache.add(self.sequence_key(key), 0, timeout=None)
+            sequence = cache.get(self.sequence_key(key), 0)
+        return sequence
+
+    def record(self, key: str, data: dict) -> int:
+        """Numbers a delta of a pair and stores it into the ring buffer"""
+
+        self.get_sequence(key)
+        sequence = cache.incr(self.sequence_key(key))
+        cache.set(self.delta_key(key, sequence), (sequence, data), timeout=None)
+        return sequence
+
+    def deltas(self, key: str, after: int) -> list | None:
+        """Returns the deltas of a pair following the `after` sequence
+
+        `None` is returned when some of them are not buffered anymore, the
+        client then has to load a new snapshot"""
+
+        current = self.get_sequence(key)
+        if after > current or current - after > self.DELTAS_BUFFER_SIZE:
+            return None
+        sequences = range(after + 1, current + 1)
+        buffered = cache.get_many([self.delta_key(key, seq) for seq in sequences])
+        deltas = []
+        for sequence in sequences:
+            entry = buffered.get(self.delta_key(key, sequence))
+            if entry is None or entry[0] != sequence:
+                return None
+            deltas.append({**entry[1], WStypes.SEQUENCE: sequence})
+        return deltas
+
+    async def asend(self, key: str, data: dict):
+        """Sends a numbered delta to the websocket group of a pair"""
+
+        sequence = await sync_to_async(self.record, thread_sensitive=False)(key, data)
+        await channel_layer.group_send(  # type: ignore
+            key, frame(key, {**data, WStypes.SEQUENCE: sequence})
+        )
+
+    async def abroadcast(self, key: str, data: dict):
+        """Queues a delta for the websocket group of a pair
+
+        The deltas queued until the end of the coalescing window of the pair
+        are merged and sent together"""
+
+        if not (window := settings.WEBSOCKET_COALESCING_WINDOW):
+            return await self.asend(key, data)
+
+        hashes = touched(data)
+        with self.lock:
+            messages = self.messages.setdefault(key, [])
+            # the types of a message are applied in no given order, a delta
+            # on an order of the pending message is thus sent after it
+            if (
+                messages
+                and messages[-1][1].isdisjoint(hashes)
+                and merge(messages[-1][0], data)
+            ):
+                messages[-1][1].update(hashes)
+            else:
+                messages.append((dict(data), hashes))
+            if key in self.flushes:
+                return
+            self.flushes[key] = asyncio.get_running_loop().create_task(
+                self.aflush(key, window)
+            )
+
+    async def aflush(self, key: str, window: float = 0):
+        """Sends the messages queued for a pair once `window` seconds elapsed
+
+        The messages are still sent when the task is cancelled, on the
+        shutdown of its event loop"""
+
+        try:
+            await asyncio.sleep(window)
+        finally:
+            with self.lock:
+                messages = self.messages.pop(key, [])
+                self.flushes.pop(key, None)
+            for data, _ in messages:
+                await self.asend(key, data)
+
+    async def asnapshot(self, chain_id, base_token, quote_token) -> dict:
+        """Returns the orders of a pair book with the sequence it is at least up to
+
+        The sequence is read before the book, deltas replayed over the snapshot
+        may thus already be applied, they only set absolute values"""
+
+        key = book_key(chain_id, base_token, quote_token)
+        sequence = await sync_to_async(self.get_sequence)(key)
+        return {
+            WStypes.SEQUENCE: sequence,
+            "orders": await self.aget(chain_id, base_token, quote_token),
+        }
+
+    @staticmethod
+    def serialize(queryset) -> list:
+        """Returns the public representation of the makers of a queryset"""
+
+        from api.serializers.orders import MakerSerializer
+
+        queryset = queryset.select_related("user", "bot", "bot__user").annotate(
+            address=Case(
+                When(user__isnull=False, then=F("user__address")),
+                When(bot__isnull=False, then=F("bot__user__address")),
+                output_field=CharField(),
+            ),
+            base_fees=Value("0"),
+            quote_fees=Value("0"),
+        )
+        return MakerSerializer(queryset, many=True).data
+
+    @staticmethod
+    def serialize_ladders(queryset) -> list:
+        """Returns the ladders of the bots of a queryset, one of their levels
+        is serialized as the template of the others"""
+
+        from api.ladders import Ladder, level_maker
+        from api.serializers.orders import MakerSerializer
+
+        bots = list(queryset.select_related("user"))
+        levels = []
+        for bot in bots:
+            maker = level_maker(bot, int(bot.lower_bound))
+            maker.address = bot.user.address
+            maker.base_fees = Decimal("0")
+            maker.quote_fees = Decimal("0")
+            levels.append(maker)
+        return [
+            Ladder(bot, entry)
+            for bot, entry in zip(bots, MakerSerializer(levels, many=True).data)
+        ]
+
+    def load(self, chain_id, base_token, quote_token) -> OrderBook:
+        """Loads the book of a pair from the database"""
+
+        from api.models.orders import Maker, Bot
+
+        key = book_key(chain_id, base_token, quote_token)
+        book = OrderBook(self.get_version(key))
+        pair = {
+            "base_token": base_token,
+            "quote_token": quote_token,
+            "chain_id": chain_id,
+        }
+        queryset = Maker.objects.filter(
+            Q(status=Maker.OPEN, bot__isnull=True) | Q(bot__isnull=False), **pair
+        )
+        for entry in self.serialize(queryset):
+            book.add(entry)
+        for ladder in self.serialize_ladders(Bot.objects.filter(**pair)):
+            book.add_ladder(ladder)
+
+        with self.lock:
+            self.books[key] = book
+        return book
+
+    def get_book(self, chain_id, base_token, quote_token) -> OrderBook:
+        """Returns the up to date book of a pair, loading it when needed"""
+
+        key = book_key(chain_id, base_token, quote_token)
+        version = self.get_version(key)
+        if (book := self.books.get(key)) is None or book.version != version:
+            book = self.load(chain_id, base_token, quote_token)
+        return book
+
+    async def aget_book(self, chain_id, base_token, quote_token) -> OrderBook:
+        key = book_key(chain_id, base_token, quote_token)
+        book = self.books.get(key)
+        if book is not None and book.version == await cache.aget(self.version_key(key)):
+            return book
+        return await sync_to_async(self.get_book)(chain_id, base_token, quote_token)
+
+    async def aget(self, chain_id, base_token, quote_token) -> list:
+        """Returns the orders of a pair book"""
+
+        book = await self.aget_book(chain_id, base_token, quote_token)
+        with self.lock:
+            return book.to_list()
+
+    async def apage(
+        self, chain_id, base_token, quote_token, after: list | None, limit: int
+    ) -> list:
+        """Returns a page of the orders of a pair book, see `OrderBook.page`"""
+
+        book = await self.aget_book(chain_id, base_token, quote_token)
+        with self.lock:
+            return book.page(after, limit)
+
+    async def adepth(self, chain_id, base_token, quote_token, limit, tick=1) -> dict:
+        """Returns the best aggregated levels of both sides of a pair book"""
+
+        book = await self.aget_book(chain_id, base_token, quote_token)
+        with self.lock:
+            return {
+                "bids": book.depth(True, limit, tick),
+                "asks": book.depth(False, limit, tick),
+            }
+
+    def apply(self, key: str, mutation=None):
+        """Applies a mutation to a loaded book and publishes the new version
+
+        Arguments :\n
+        `key`       -- the book key of the pair\n
+        `mutation`  -- callable receiving the `OrderBook`, `None` drops the book\n
+
+        Inside a transaction the book is dropped and the version published on commit."""
+
+        in_transaction = connection.in_atomic_block
+        with self.lock:
+            if mutation is None or in_transaction:
+                self.books.pop(key, None)
+            elif (book := self.books.get(key)) is not None:
+                mutation(book)
+
+        if (pending := _pending_pairs.get()) is not None:
+            pending.add(key)
+        elif in_transaction:
+            transaction.on_commit(lambda: self.apply(key))
+        else:
+            self.publish(key)
+
+    async def aapply(self, key: str, mutation=None):
+        await sync_to_async(self.apply)(key, mutation)
+
+    def add_makers(self, key: str, queryset):
+        """Adds the makers of a queryset created without signals to a book"""
+
+        entries = self.serialize(queryset) if key in self.books else []
+
+        def add(book: OrderBook):
+            for entry in entries:
+                book.add(entry)
+
+        self.apply(key, add)
+
+    async def aadd_makers(self, key: str, queryset):
+        await sync_to_async(self.add_makers)(key, queryset)
+
+    def add_bots(self, key: str, queryset):
+        """Adds the ladders of the bots of a queryset to a book"""
+
+        ladders = self.serialize_ladders(queryset) if key in self.books else []
+
+        def add(book: OrderBook):
+            for ladder in ladders:
+                book.add_ladder(ladder)
+
+        self.apply(key, add)
+
+    async def aadd_bots(self, key: str, queryset):
+        await sync_to_async(self.add_bots)(key, queryset)
+
+    def publish(self, key: str):
+        """Bumps the shared version of a book after a local change"""
+
+        self.get_version(key)
+        version = cache.incr(self.version_key(key))
+        with self.lock:
+            if (book := self.books.get(key)) is None:
+                return
+            if book.version + 1 == version:
+                book.version = version
+            else:
+                del self.books[key]
+
+    def flush(self, keys):
+        """Publishes the versions of books modified under `batch`"""
+
+        for key in keys:
+            if connection.in_atomic_block:
+                transaction.on_commit(lambda key=key: self.apply(key))
+            else:
+                self.publish(key)
+
+    @asynccontextmanager
+    async def batch(self):
+        """Publishes the version of each book modified in the block only once
+
+        Used around ORM operations sending a signal per order, like bot deletions"""
+
+        token = _pending_pairs.set(set())
+        try:
+            yield
+        finally:
+            pending = _pending_pairs.get()
+            _pending_pairs.reset(token)
+            await sync_to_async(self.flush)(pending)
+
+    def clear(self):
+        with self.lock:
+            self.books.clear()
+
+
+order_book = OrderBookEngine()
@@ -0,0 +1,124 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+import api.errors as errors
+from api.utils import validate_positive_integer
+
+
+def encode_cursor(values: list) -> str:
+    """Returns the opaque cursor pointing after the given ordering values"""
+
+    return urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """Returns the ordering values held by a cursor, raises on malformed cursors"""
+
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (BinasciiError, ValueError):
+        raise ValidationError({"cursor": [errors.Pagination.WRONG_CURSOR]})
+    if not isinstance(values, list) or len(values) != length:
+        raise ValidationError({"cursor": [errors.Pagination.WRONG_CURSOR]})
+    return values
+
+
+class KeysetPagination:
+    """Cursor pagination over a stable ordering, the last field must be unique
+
+    The pages are selected with a `WHERE` on the ordering fields instead of
+    an `OFFSET`, so deep pages cost the same as the first one. Pagination is
+    enabled by the `limit` or `cursor` query params, the response is then
+    `{"results": [...], "next": cursor}` with `next` set to `None` on the last page.
+
+    Arguments :\n
+    `ordering`  -- the ordering fields, prefixed by `-` for descending ones\n
+    """
+
+    DEFAULT_LIMIT = 100
+    MAX_LIMIT = 500
+
+    def __init__(self, request: Request, ordering: tuple):
+        self.ordering = ordering
+        self.next = None
+        self.enabled = (
+            "limit" in request.query_params or "cursor" in request.query_params
+        )
+        if not self.enabled:
+            return
+
+        try:
+            limit = validate_positive_integer(
+                request.query_params.get("limit", str(self.DEFAULT_LIMIT)), "limit"
+            )
+        except ValidationError as e:
+            raise ValidationError({"limit": e.detail})
+        self.limit = min(limit, self.MAX_LIMIT)
+
+        self.after = None
+        if (cursor := request.query_params.get("cursor", None)) is not None:
+            self.after = decode_cursor(cursor, len(ordering))
+
+    def keyset_filter(self) -> Q:
+        """Returns the condition selecting the rows ordered after the cursor"""
+
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            field = self.ordering[index].lstrip("-")
+            lookup = "lt" if self.ordering[index].startswith("-") else "gt"
+            after = Q(**{f"{field}__{lookup}": self.after[index]})
+            if index < len(self.ordering) - 1:
+                after |= Q(**{field: self.after[index]}) & condition
+            condition = after
+        return condition
+
+    def values(self, row) -> list:
+        """Returns the ordering values of a model instance"""
+
+        return [getattr(row, field.lstrip("-")) for field in self.ordering]
+
+    def following(self, queryset) -> list:
+        """Returns up to `limit + 1` rows following the cursor, in order
+
+        Must be called from a sync context as the rows are evaluated"""
+
+        queryset = queryset.order_by(*self.ordering)
+        if self.after is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter())
+            except (DjangoValidationError, TypeError, ValueError):
+                raise ValidationError({"cursor": [errors.Pagination.WRONG_CURSOR]})
+        return list(queryset[: self.limit + 1])
+
+    def paginate_queryset(self, queryset):
+        """Returns the rows of the requested page, the queryset when disabled
+
+        Must be called from a sync context as the page is evaluated"""
+
+        if not self.enabled:
+            return queryset
+        return self.paginate_list(self.following(queryset), self.values)
+
+    def paginate_list(self, rows: list, key) -> list:
+        """Trims rows fetched with one extra element and sets the next cursor
+
+        Arguments :\n
+        `rows`  -- up to `limit + 1` rows following the cursor\n
+        `key`   -- callable returning the ordering values of a row\n
+        """
+
+        if len(rows) > self.limit:
+            rows = rows[: self.limit]
+            self.next = encode_cursor(key(rows[-1]))
+        return rows
+
+    def get_paginated_data(self, data):
+        """Wraps the serialized page with the cursor of the next one"""
+
+        if not self.enabled:
+            return data
+        return {"results": data, "next": self.next}
@@ -0,0 +1,140 @@
+"""The fees accrued by the stacking users per token
+
+The fees of a slot are shared between the users pro rata of their stake at
+the end of the previous slot, given by the `GlobalStacking` series. A fees
+withdrawal of a user claims its share of the fees of the token up to the
+withdrawal slot.
+
+The watch tower publishes the events in order, the fees entries are thus
+accrued to the current stakes and the stacking entries left as is. A
+stacking entry preceding fees already accrued computes the chain again"""
+
+from decimal import Decimal
+from django.db import connection, transaction
+from api.models.stacking import (
+    GlobalStacking,
+    Stacking,
+    StackingFees,
+    StackingFeesWithdrawal,
+    StackingReward,
+)
+from api.stacking_series import lock
+
+TABLES = {
+    "rewards": StackingReward._meta.db_table,
+    "series": GlobalStacking._meta.db_table,
+    "stacking": Stacking._meta.db_table,
+    "fees": StackingFees._meta.db_table,
+    "withdrawals": StackingFeesWithdrawal._meta.db_table,
+}
+
+ACCRUE = """
+INSERT INTO {rewards} (chain_id, user_id, token, accrued, withdrawn)
+SELECT %(chain_id)s, stakes.user_id, %(token)s, stakes.share,
+    CASE WHEN EXISTS (
+        SELECT 1 FROM {withdrawals} w
+        WHERE w.chain_id = %(chain_id)s AND w.user_id = stakes.user_id
+        AND w.token = %(token)s AND w.slot >= %(slot)s
+    ) THEN stakes.share ELSE 0 END
+FROM (
+    SELECT s.user_id,
+        div(SUM(s.amount) * %(amount)s, t.total)
+        - div(SUM(s.amount) * %(previous)s, t.total) AS share
+    FROM {stacking} s, (
+        SELECT cumulative AS total FROM {series}
+        WHERE chain_id = %(chain_id)s AND slot < %(slot)s
+        ORDER BY slot DESC LIMIT 1
+    ) t
+    WHERE s.chain_id = %(chain_id)s AND s.slot < %(slot)s AND t.total > 0
+    GROUP BY s.user_id, t.total
+    HAVING SUM(s.amount) > 0
+) stakes
+ON CONFLICT (user_id, token, chain_id) DO UPDATE SET
+    accrued = {rewards}.accrued + EXCLUDED.accrued,
+    withdrawn = {rewards}.withdrawn + EXCLUDED.withdrawn
+""".format(**TABLES)
+
+DELETE = """
+DELETE FROM {rewards} WHERE chain_id = %(chain_id)s
+AND (%(user_id)s IS NULL OR user_id = %(user_id)s)
+AND (%(token)s IS NULL OR token = %(token)s)
+""".format(**TABLES)
+
+REBUILD = """
+INSERT INTO {rewards} (chain_id, user_id, token, accrued, withdrawn)
+SELECT %(chain_id)s, shares.user_id, shares.token, SUM(shares.share),
+    SUM(CASE WHEN shares.slot <= last.slot THEN shares.share ELSE 0 END)
+FROM (
+    SELECT s.user_id, f.token, f.slot, div(SUM(s.amount) * f.amount, f.total) AS share
+    FROM (
+        SELECT f.token, f.slot, f.amount, (
+            SELECT g.cumulative FROM {series} g
+            WHERE g.chain_id = f.chain_id AND g.slot < f.slot
+            ORDER BY g.slot DESC LIMIT 1
+        ) AS total
+        FROM {fees} f
+        WHERE f.chain_id = %(chain_id)s AND (%(token)s IS NULL OR f.token = %(token)s)
+    ) f
+    JOIN {stacking} s ON s.chain_id = %(chain_id)s AND s.slot < f.slot
+        AND (%(user_id)s IS NULL OR s.user_id = %(user_id)s)
+    WHERE f.total > 0
+    GROUP BY s.user_id, f.token, f.slot, f.amount, f.total
+    HAVING SUM(s.amount) > 0
+) shares
+LEFT JOIN (
+    SELECT user_id, token, MAX(slot) AS slot FROM {withdrawals}
+    WHERE chain_id = %(chain_id)s
+    GROUP BY user_id, token
+) last ON last.user_id = shares.user_id AND last.token = shares.token
+GROUP BY shares.user_id, shares.token
+""".format(**TABLES)
+
+
+def accrue(chain_id: int, token: str, slot: int, previous: Decimal, amount: Decimal):
+    """Shares the fees received for a token at a slot between the stackers
+
+    Arguments :\n
+    `chain_id` -- the chain of the fees entry\n
+    `token`    -- the token of the fees entry\n
+    `slot`     -- the slot of the fees entry\n
+    `previous` -- the amount of the fees entry before the update\n
+    `amount`   -- the amount of the fees entry after the update\n
+    """
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock(cursor, chain_id)
+        cursor.execute(
+            ACCRUE,
+            {
+                "chain_id": chain_id,
+                "token": token,
+                "slot": slot,
+                "previous": previous,
+                "amount": amount,
+            },
+        )
+
+
+def stake(chain_id: int, slot: int):
+    """Accounts for a stacking entry, the fees of the following slots are
+    shared again when already accrued"""
+
+    if StackingFees.objects.filter(chain_id=chain_id, slot__gt=slot).exists():
+        rebuild(chain_id)
+
+
+def withdraw(chain_id: int, user_id: int, token: str):
+    """Accounts for a fees withdrawal of a user"""
+
+    rebuild(chain_id, user_id, token)
+
+
+def rebuild(chain_id: int, user_id: int | None = None, token: str | None = None):
+    """Computes the rewards of a chain again, optionally only those of a user
+    or of a token"""
+
+    params = {"chain_id": chain_id, "user_id": user_id, "token": token}
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock(cursor, chain_id)
+        cursor.execute(DELETE, params)
+        cursor.execute(REBUILD, params)
@@ -4,11 +4,12 @@ from django.db.models import F, DecimalField, ExpressionWrapper, Sum
 from web3 import Web3
 from eth_abi.packed import encode_packed
 from rest_framework import serializers
-from rest_framework.validators import ValidationError
+from rest_framework.validators import ValidationError, UniqueValidator
 from api.models import User
 from api.models.orders import Maker, Taker, Bot
 from api.models.types import BotTypedDict, KeccakHash, Signature, Address
 import api.errors as errors
+from api.fixed_point import price_down, price_up
 from api.utils import (
     validate_eth_signed_message,
     validate_decimal_integer,
@@ -18,6 +19,23 @@ from api.utils import (
 )
 
 
+def check_signature(serializer, message: bytes, signature: str, address: str):
+    """Checks the signature of an order, when the serializer context holds a
+    `signatures` list the check is queued there for the view to run it"""
+
+    if (signatures := serializer.context.get("signatures", None)) is not None:
+        signatures.append((message, signature, address))
+    elif (
+        validate_eth_signed_message(
+            message=message,
+            signature=signature,
+            address=address,
+        )
+        == False
+    ):
+        raise ValidationError(errors.Signature.SIGNATURE_MISMATCH_ERROR)
+
+
 class TimestampField(serializers.Field):
     """Class used to change from timestamp to datetime"""
 
@@ -94,59 +112,12 @@ class BotSerializer(serializers.ModelSerializer):
         }
 
     async def create(self, validated_data):
-        """Used to create the orders for the created bot"""
+        """Used to create the bot, its orders are derived from its ladder"""
 
         user = (await User.objects.aget_or_create(address=validated_data["address"]))[0]
         validated_data.update({"user": user})
         del validated_data["address"]
-        amount = validated_data.pop("amount")
-        base_token = validated_data.pop("base_token")
-        quote_token = validated_data.pop("quote_token")
-        signature = validated_data.pop("signature")
-        expiry = validated_data.pop("expiry")
-        is_buyer = validated_data.pop("is_buyer")
-
-        bot = await Bot.objects.acreate(**validated_data)
-        orders = [
-            Maker(
-                bot=bot,
-                base_token=base_token,
-                quote_token=quote_token,
-                amount=amount,
-                price=str(price),
-                is_buyer=price <= int(validated_data["price"]),
-                expiry=expiry,
-                chain_id=int(validated_data["chain_id"]),
-                signature=signature,
-            )
-            for price in range(
-                int(validated_data["lower_bound"]),
-                (int(validated_data["upper_bound"])) + 1,
-                int(validated_data["step"]),
-            )
-        ]
-
-        for order in orders:
-            _, order.order_hash = compute_order_hash(
-                {
-                    "address": user.address,
-                    "amount": int(order.amount),
-                    "price": int(validated_data.get("price")),
-                    "step": int(validated_data["step"]),
-                    "maker_fees": int(validated_data["maker_fees"]),
-                    "upper_bound": int(validated_data["upper_bound"]),
-                    "lower_bound": int(validated_data["lower_bound"]),
-                    "base_token": order.base_token,
-                    "quote_token": order.quote_token,
-                    "expiry": int(order.expiry.timestamp()),
-                    "chain_id": int(order.chain_id),
-                    "is_buyer": 0 if is_buyer else 1,
-                    "replace_order": True,
-                    "maker_price": int(order.price),
-                }
-            )
-        await Maker.objects.abulk_create(orders)
-        return bot
+        return await Bot.objects.acreate(**validated_data)
 
     def validate_is_buyer(self, value):
         if value is None:
@@ -223,16 +194,7 @@ class BotSerializer(serializers.ModelSerializer):
             }
         )
         data["bot_hash"] = str(Web3.to_hex(Web3.keccak(encoded_order)))
-
-        if (
-            validate_eth_signed_message(
-                message=encoded_order,
-                signature=data["signature"],
-                address=data["address"],
-            )
-            == False
-        ):
-            raise ValidationError(errors.Signature.SIGNATURE_MISMATCH_ERROR)
+        check_signature(self, encoded_order, data["signature"], data["address"])
 
         return super().validate(data)
 
@@ -244,10 +206,10 @@ class BotSerializer(serializers.ModelSerializer):
 
         data.update(
             {
-                "base_token": instance.orders.all()[0].base_token,
-                "quote_token": instance.orders.all()[0].quote_token,
-                "expiry": int(instance.orders.all()[0].expiry.timestamp()),
-                "amount": "{0:f}".format(instance.orders.all()[0].amount),
+                "base_token": instance.base_token,
+                "quote_token": instance.quote_token,
+                "expiry": int(instance.expiry.timestamp()),
+                "amount": "{0:f}".format(instance.amount),
             }
         )
         return data
@@ -256,9 +218,25 @@ class BotSerializer(serializers.ModelSerializer):
 class MakerListSerializer(serializers.ListSerializer):
     """Used for multiple operation on orders, especially creation, and update"""
 
-    def create(self, validated_data):
-        makers = [Maker(**data) for data in validated_data]
-        return Maker.objects.abulk_create(makers)
+    async def create(self, validated_data):
+        """Creates the makers in one statement, the missing users are created first"""
+
+        addresses = {data["address"] for data in validated_data}
+        await User.objects.abulk_create(
+            [User(address=address) for address in addresses], ignore_conflicts=True
+        )
+        users = {
+            user.address: user
+            async for user in User.objects.filter(address__in=addresses)
+        }
+        makers = [
+            Maker(
+                user=users[data["address"]],
+                **{key: value for key, value in data.items() if key != "address"},
+            )
+            for data in validated_data
+        ]
+        return await Maker.objects.abulk_create(makers)
 
     def update(self, validated_data):
         return Maker.objects.abulk_update(  # type: ignore
@@ -314,6 +292,17 @@ class MakerSerializer(serializers.ModelSerializer):
         }
         list_serializer_class = MakerListSerializer
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get("batch", None):
+            # the batches look for the stored orders at once
+            fields["order_hash"].validators = [
+                validator
+                for validator in fields["order_hash"].validators
+                if not isinstance(validator, UniqueValidator)
+            ]
+        return fields
+
     async def create(self, validated_data):
         validated_data.update(
             {
@@ -386,15 +375,7 @@ class MakerSerializer(serializers.ModelSerializer):
             }
         )
 
-        if (
-            validate_eth_signed_message(
-                message=encoded_order,
-                signature=data["signature"],
-                address=data["address"],
-            )
-            == False
-        ):
-            raise ValidationError(errors.Signature.SIGNATURE_MISMATCH_ERROR)
+        check_signature(self, encoded_order, data["signature"], data["address"])
 
         if order_hash != data["order_hash"]:
             raise ValidationError(errors.KeccakHash.MISMATCH_HASH_ERROR)
@@ -445,20 +426,10 @@ class TakerSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         if instance.maker.bot is not None:
-            if not instance.is_buyer:
-                data["price"] = "{0:f}".format(
-                    Decimal(
-                        (instance.maker.price)
-                        / Decimal((1000 + instance.maker.bot.maker_fees) / 1000)
-                    ).quantize(Decimal("1."))
-                )
-            else:
-                data["price"] = "{0:f}".format(
-                    Decimal(
-                        (instance.maker.price)
-                        * Decimal((1000 + instance.maker.bot.maker_fees) / 1000)
-                    ).quantize(Decimal("1."))
-                )
+            move = price_up if instance.is_buyer else price_down
+            data["price"] = str(
+                move(int(instance.maker.price), int(instance.maker.bot.maker_fees))
+            )
         else:
             data["price"] = "{0:f}".format(instance.maker.price)
         return data
@@ -1,21 +1,72 @@
-from rest_framework.serializers import ModelSerializer, CharField, BooleanField
+from rest_framework.serializers import (
+    ModelSerializer,
+    CharField,
+    BooleanField,
+    SerializerMethodField,
+)
 from rest_framework.validators import ValidationError
+from django.db import connection
 from api.errors import General
-from api.models.stacking import Stacking, StackingFees, StackingFeesWithdrawal
+from api.models.stacking import (
+    Stacking,
+    StackingFees,
+    StackingFeesWithdrawal,
+    StackingReward,
+)
 from api.utils import validate_address, validate_decimal_integer
 
 
+def upsert(model, values: dict, conflict: list, increment: str | None = None):
+    """Inserts a row in a single statement returning the row stored
+
+    On a conflict of the `conflict` columns, the `increment` column of the
+    row is added to the stored one, the stored row is left as is without it
+
+    Arguments :\n
+    `model`     -- the model of the row\n
+    `values`    -- the values of the row by column\n
+    `conflict`  -- the columns of the unique constraint of the row\n
+    `increment` -- the column to add on conflict\n
+    """
+
+    table = model._meta.db_table
+    column = increment or conflict[0]
+    update = (
+        f"{table}.{column} + EXCLUDED.{column}" if increment else f"EXCLUDED.{column}"
+    )
+    fields = model._meta.concrete_fields
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(values)}) "
+            f"VALUES ({', '.join(['%s'] * len(values))}) "
+            f"ON CONFLICT ({', '.join(conflict)}) DO UPDATE SET {column} = {update} "
+            f"RETURNING {', '.join(field.column for field in fields)}",
+            list(values.values()),
+        )
+        row = cursor.fetchone()
+    return model.from_db(connection.alias, [field.attname for field in fields], row)
+
+
 class StackingSerializer(ModelSerializer):
     """Class used to serialize user stacking entries"""
 
     address = CharField(required=True, allow_blank=False, write_only=True)
     withdraw = BooleanField(allow_null=True, default=None, write_only=True)  # type: ignore
 
-    async def create(self, validated_data):
-        del validated_data["amount"]
-        del validated_data["address"]
-        del validated_data["withdraw"]
-        return (await Stacking.objects.aget_or_create(**validated_data))[0]
+    def create(self, validated_data):
+        """Adds the signed amount of the entry to the stored one"""
+
+        return upsert(
+            Stacking,
+            {
+                "user_id": validated_data["user"].id,
+                "slot": validated_data["slot"],
+                "chain_id": validated_data["chain_id"],
+                "amount": validated_data["amount"],
+            },
+            ["user_id", "slot", "chain_id"],
+            "amount",
+        )
 
     class Meta:
         model = Stacking
@@ -39,9 +90,20 @@ class StackingSerializer(ModelSerializer):
 class StackingFeesSerializer(ModelSerializer):
     """Class for serializing stacking fees entries"""
 
-    async def create(self, validated_data):
-        del validated_data["amount"]
-        return (await StackingFees.objects.aget_or_create(**validated_data))[0]
+    def create(self, validated_data):
+        """Adds the amount of the entry to the stored one"""
+
+        return upsert(
+            StackingFees,
+            {
+                "token": validated_data["token"],
+                "slot": validated_data["slot"],
+                "chain_id": validated_data["chain_id"],
+                "amount": validated_data["amount"],
+            },
+            ["token", "slot", "chain_id"],
+            "amount",
+        )
 
     class Meta:
         model = StackingFees
@@ -56,11 +118,17 @@ class StackingFeesWithdrawalSerializer(ModelSerializer):
 
     address = CharField(required=True, allow_blank=False, write_only=True)
 
-    async def create(self, validated_data):
-        del validated_data["address"]
-        return (await StackingFeesWithdrawal.objects.aget_or_create(**validated_data))[
-            0
-        ]
+    def create(self, validated_data):
+        return upsert(
+            StackingFeesWithdrawal,
+            {
+                "user_id": validated_data["user"].id,
+                "slot": validated_data["slot"],
+                "token": validated_data["token"],
+                "chain_id": validated_data["chain_id"],
+            },
+            ["user_id", "slot", "token", "chain_id"],
+        )
 
     class Meta:
         model = StackingFeesWithdrawal
@@ -74,3 +142,16 @@ class StackingFeesWithdrawalSerializer(ModelSerializer):
 
     def validate_address(self, value):
         return validate_address(value, "")
+
+
+class StackingRewardSerializer(ModelSerializer):
+    """Class for serializing the fees accrued by a user per token"""
+
+    claimable = SerializerMethodField()
+
+    class Meta:
+        model = StackingReward
+        fields = ["token", "accrued", "withdrawn", "claimable"]
+
+    def get_claimable(self, reward: StackingReward) -> str:
+        return "{0:f}".format(reward.accrued - reward.withdrawn)
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.models.orders import Maker, Bot
+from api.order_book import order_book, book_key, maker_entry
+
+
+@receiver(post_save, sender=Maker)
+def maker_saved(sender, instance: Maker, **kwargs):
+    """Reflects the maker saved through the ORM into the order book"""
+
+    key = book_key(instance.chain_id, instance.base_token, instance.quote_token)
+    if key not in order_book.books:
+        return order_book.apply(key)
+    entry = maker_entry(instance)
+    order_book.apply(key, lambda book: book.add(entry))
+
+
+@receiver(post_delete, sender=Maker)
+def maker_deleted(sender, instance: Maker, **kwargs):
+    """Removes the maker deleted through the ORM from the order book"""
+
+    key = book_key(instance.chain_id, instance.base_token, instance.quote_token)
+    order_book.apply(key, lambda book: book.remove(instance.order_hash))
+
+
+@receiver(post_delete, sender=Bot)
+def bot_deleted(sender, instance: Bot, **kwargs):
+    """Removes the untouched levels of the deleted bot from the order book"""
+
+    key = book_key(instance.chain_id, instance.base_token, instance.quote_token)
+    order_book.apply(key, lambda book: book.remove_bot(instance.bot_hash))
@@ -0,0 +1,87 @@
+from multiprocessing import get_context
+from os import cpu_count
+from asyncio import gather, get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from eth_account import Account, messages
+
+
+def recover_batch(batch: list) -> list:
+    """Checks a batch of `(message, signature, address)` signed messages
+
+    Runs into the worker processes, it thus only depends on `eth_account`"""
+
+    results = []
+    for message, signature, address in batch:
+        try:
+            signer = Account.recover_message(
+                messages.encode_defunct(message), signature=signature
+            )
+        except Exception:
+            results.append(False)
+        else:
+            results.append(signer.lower() == str(address).lower())
+    return results
+
+
+class SignatureVerifier:
+    """Verifies the signatures of the submitted orders into a process pool
+
+    The public key recovery is pure python and holds the GIL, running it into
+    separate processes keeps the other requests of the worker going. The
+    batches are split between the processes of the pool, a pool of `0`
+    process checks the signatures into the calling thread"""
+
+    def __init__(self, workers: int | None = None):
+        self.workers = (cpu_count() or 1) if workers is None else workers
+        self.executor = None
+        self.lock = Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                # forking would copy the locks held by the other threads of the worker
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context("forkserver")
+                )
+            return self.executor
+
+    async def averify(self, batch: list) -> list:
+        """Returns whether each `(message, signature, address)` of the batch
+        has been signed by its address
+
+        Arguments :\n
+        `batch` -- list of `(message, signature, address)` tuples\n
+        """
+
+        if not batch:
+            return []
+        if self.workers == 0:
+            return await sync_to_async(recover_batch)(batch)
+
+        executor = self.get_executor()
+        # the started workers do not load the django apps, only plain values are sent
+        batch = [
+            (message, str(signature), str(address))
+            for message, signature, address in batch
+        ]
+        size = -(-len(batch) // self.workers)
+        chunks = [batch[i : i + size] for i in range(0, len(batch), size)]
+        loop = get_running_loop()
+        results = await gather(
+            *(loop.run_in_executor(executor, recover_batch, chunk) for chunk in chunks)
+        )
+        return [result for chunk in results for result in chunk]
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+signature_verifier = SignatureVerifier(
+    getattr(settings, "SIGNATURE_VERIFICATION_WORKERS", None)
+)
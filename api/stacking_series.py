@@ -0,0 +1,63 @@
+"""The per slot totals of the stacking amounts of a chain
+
+The totals of the `GlobalStacking` rows are updated along with the
+`Stacking` entries, the writers of a chain are serialized by an advisory
+lock of the transaction. The watch tower publishes the slots in order, an
+update thus only touches the running total of the last slots"""
+
+from decimal import Decimal
+from django.db import connection, transaction
+from api.models.stacking import GlobalStacking, Stacking
+from api.chain_cache import global_stacking_cache
+
+# first key of the advisory locks of the chains series
+LOCK_KEY = 0x57AC
+
+
+def lock(cursor, chain_id: int):
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [LOCK_KEY, chain_id])
+
+
+def record(chain_id: int, slot: int, amount: Decimal):
+    """Adds a stacked, or withdrawn when negative, amount to the series of a chain
+
+    Arguments :\n
+    `chain_id` -- the chain of the stacking entry\n
+    `slot`     -- the slot of the stacking entry\n
+    `amount`   -- the signed amount added to the entry\n
+    """
+
+    table = GlobalStacking._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock(cursor, chain_id)
+        cursor.execute(
+            f"INSERT INTO {table} (chain_id, slot, amount, cumulative) "
+            f"VALUES (%s, %s, 0, COALESCE((SELECT cumulative FROM {table} "
+            "WHERE chain_id = %s AND slot < %s ORDER BY slot DESC LIMIT 1), 0)) "
+            "ON CONFLICT (chain_id, slot) DO NOTHING",
+            [chain_id, slot, chain_id, slot],
+        )
+        cursor.execute(
+            f"UPDATE {table} SET cumulative = cumulative + %s, "
+            "amount = amount + CASE WHEN slot = %s THEN %s ELSE 0 END "
+            "WHERE chain_id = %s AND slot >= %s",
+            [amount, slot, amount, chain_id, slot],
+        )
+        transaction.on_commit(lambda: global_stacking_cache.bump(chain_id))
+
+
+def rebuild(chain_id: int):
+    """Computes the series of a chain again from its stacking entries"""
+
+    table = GlobalStacking._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock(cursor, chain_id)
+        GlobalStacking.objects.filter(chain_id=chain_id).delete()
+        cursor.execute(
+            f"INSERT INTO {table} (chain_id, slot, amount, cumulative) "
+            "SELECT chain_id, slot, SUM(amount), SUM(SUM(amount)) OVER (ORDER BY slot) "
+            f"FROM {Stacking._meta.db_table} WHERE chain_id = %s "
+            "GROUP BY chain_id, slot",
+            [chain_id],
+        )
+        transaction.on_commit(lambda: global_stacking_cache.bump(chain_id))
@@ -0,0 +1,105 @@
+from decimal import Decimal, ROUND_DOWN, localcontext
+from hypothesis import given, settings, strategies as st
+from hypothesis.extra.django import SimpleTestCase
+from api.fixed_point import level_trade, price_down, price_up, truncate
+
+prices = st.integers(min_value=1, max_value=10**30)
+amounts = st.integers(min_value=0, max_value=10**30)
+fees = st.integers(min_value=0, max_value=10**20)
+earned = st.integers(min_value=-(10**30), max_value=10**30)
+
+
+def decimal_trade(price, maker_fees, amount, is_buyer, reverse):
+    """The decimal computation of the taker price and the bot fees it replaces"""
+
+    price, maker_fees, amount = Decimal(price), Decimal(maker_fees), Decimal(amount)
+    if reverse == is_buyer:
+        taker_price = Decimal(price * (maker_fees + 1000) / 1000).quantize(
+            Decimal("1.")
+        )
+    else:
+        taker_price = Decimal(price * 1000 / (maker_fees + 1000)).quantize(
+            Decimal("1.")
+        )
+
+    if maker_fees > Decimal("2000"):
+        fees = maker_fees * amount / Decimal("1e18")
+    elif reverse and is_buyer:
+        fees = (
+            ((price * maker_fees + Decimal("1000")) / (Decimal("1000")) - price)
+            * amount
+            / Decimal("1e18")
+        )
+    elif reverse == is_buyer:
+        fees = (
+            ((price * (maker_fees + Decimal("1000"))) / (Decimal("1000")) - price)
+            * amount
+            / Decimal("1e18")
+        )
+    else:
+        fees = (
+            (price - (price * Decimal("1000")) / (maker_fees + Decimal("1000")))
+            * amount
+            / Decimal("1e18")
+        )
+    return taker_price, fees
+
+
+class FixedPointTestCase(SimpleTestCase):
+    """Checks the integer computations match the decimal ones of the settings context"""
+
+    def setUp(self):
+        self.context = localcontext(prec=200, rounding=ROUND_DOWN)
+        self.context.__enter__()
+
+    def tearDown(self):
+        self.context.__exit__(None, None, None)
+
+    @settings(max_examples=300, deadline=None)
+    @given(prices, fees, amounts, earned, st.booleans(), st.booleans())
+    def test_level_trade(
+        self, price, maker_fees, amount, fees_earned, is_buyer, reverse
+    ):
+        """The taker price and the fees earned should match the decimal ones"""
+
+        taker_price, numerator, denominator = level_trade(
+            price, maker_fees, amount, is_buyer, reverse
+        )
+        decimal_price, decimal_fees = decimal_trade(
+            price, maker_fees, amount, is_buyer, reverse
+        )
+        self.assertEqual(taker_price, decimal_price)
+        self.assertEqual(
+            truncate(numerator, denominator), decimal_fees.quantize(Decimal("1."))
+        )
+        self.assertEqual(
+            truncate(fees_earned * denominator + numerator, denominator),
+            (Decimal(fees_earned) + decimal_fees).quantize(Decimal("1.")),
+        )
+
+    @settings(max_examples=300, deadline=None)
+    @given(prices, fees)
+    def test_taker_prices(self, price, maker_fees):
+        """The bot prices moved by the fees should match the taker serializer ones"""
+
+        self.assertEqual(
+            price_up(price, maker_fees),
+            Decimal(
+                Decimal(price) * Decimal((1000 + Decimal(maker_fees)) / 1000)
+            ).quantize(Decimal("1.")),
+        )
+        self.assertEqual(
+            price_down(price, maker_fees),
+            Decimal(
+                Decimal(price) / Decimal((1000 + Decimal(maker_fees)) / 1000)
+            ).quantize(Decimal("1.")),
+        )
+
+    @given(earned, st.integers(min_value=1, max_value=10**24))
+    def test_truncate(self, numerator, denominator):
+        """The division should be truncated toward zero"""
+
+        self.assertEqual(
+            truncate(numerator, denominator),
+            (Decimal(numerator) / Decimal(denominator)).quantize(Decimal("1.")),
+        )
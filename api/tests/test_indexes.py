@@ -0,0 +1,154 @@
+from datetime import datetime
+from unittest import skipUnless
+from django.db import connection
+from django.db.models import Q
+from rest_framework.test import APITestCase
+from api.models import User
+from api.models.orders import Maker, Taker, Bot
+
+
+def address(index: int) -> str:
+    return f"0x{index:040x}"
+
+
+@skipUnless(connection.vendor == "postgresql", "the query plans are postgres ones")
+class QueryPlanTestCase(APITestCase):
+    """Checks the hot queries are planned on the dedicated indexes
+
+    The tables are filled with a history of mostly closed orders and analyzed,
+    sequential scans are disabled as they stay cheaper on such small tables"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            [User(address=address(index)) for index in range(10)]
+        )
+        Bot.objects.bulk_create(
+            [
+                Bot(
+                    bot_hash=f"0x{index:x}",
+                    user=cls.users[index % 10],
+                    chain_id=31337 + index % 2,
+                    step=1,
+                    price=1,
+                    maker_fees=50,
+                    upper_bound=1,
+                    lower_bound=1,
+                    amount=1,
+                    is_buyer=True,
+                    expiry=datetime.fromtimestamp(2114380801 - index),
+                    base_token=address(1000 + index % 5),
+                    quote_token=address(2000 + index % 7),
+                    signature="0x",
+                )
+                for index in range(500)
+            ]
+        )
+        cls.bot = Bot.objects.get(bot_hash="0x0")
+        cls.makers = Maker.objects.bulk_create(
+            [
+                Maker(
+                    user=cls.users[index % 10],
+                    bot=cls.bot if index % 100 == 0 else None,
+                    amount=1,
+                    price=1,
+                    is_buyer=bool(index % 2),
+                    expiry=datetime.fromtimestamp(2114380801 - index),
+                    chain_id=31337 + index % 2,
+                    base_token=address(1000 + index % 5),
+                    quote_token=address(2000 + index % 7),
+                    order_hash=f"0x{index:064x}",
+                    signature="0x",
+                    status=Maker.OPEN if index % 50 == 1 else Maker.FILLED,
+                )
+                for index in range(2000)
+            ]
+        )
+        Taker.objects.bulk_create(
+            [
+                Taker(
+                    maker=cls.makers[index % 2000],
+                    user=cls.users[index % 10],
+                    block=index,
+                    amount=1,
+                    base_fees=True,
+                    fees=1,
+                    is_buyer=True,
+                )
+                for index in range(4000)
+            ]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index: str):
+        plan = queryset.explain()
+        self.assertIn(index, plan, f"the query should use {index}:\n{plan}")
+
+    def test_order_book_load(self):
+        """The book of a pair is loaded from the open orders and the bots indexes"""
+
+        pair = {
+            "chain_id": 31337,
+            "base_token": address(1000),
+            "quote_token": address(2000),
+        }
+        self.assertUsesIndex(
+            Maker.objects.filter(status=Maker.OPEN, bot__isnull=True, **pair),
+            "maker_pair_open_idx",
+        )
+        self.assertUsesIndex(
+            Maker.objects.filter(
+                Q(status=Maker.OPEN, bot__isnull=True) | Q(bot__isnull=False), **pair
+            ),
+            "maker_pair_open_idx",
+        )
+        self.assertUsesIndex(Bot.objects.filter(**pair), "bot_pair_idx")
+
+    def test_expired_orders_deletion(self):
+        """The expiry cron selects the orders through the expiry index"""
+
+        self.assertUsesIndex(
+            Maker.objects.filter(expiry__lte=datetime.fromtimestamp(2114380801 - 1990)),
+            "maker_expiry_idx",
+        )
+        self.assertUsesIndex(
+            Bot.objects.filter(expiry__lte=datetime.fromtimestamp(2114380801 - 490)),
+            "bot_expiry_idx",
+        )
+
+    def test_verification_token_lookup(self):
+        """Both sides of the watch tower verification lookup are indexed"""
+
+        queryset = Maker.objects.filter(
+            Q(base_token=address(1000)) | Q(quote_token=address(1000)),
+            chain_id=31337,
+        )
+        self.assertUsesIndex(queryset, "maker_pair_status_idx")
+        self.assertUsesIndex(queryset, "maker_chain_quote_idx")
+        queryset = Bot.objects.filter(
+            Q(base_token=address(1000)) | Q(quote_token=address(1000)),
+            chain_id=31337,
+        )
+        self.assertUsesIndex(queryset, "bot_pair_idx")
+
+    def test_bot_hash_lookup(self):
+        """Bots are retrieved by hash on cancellation"""
+
+        self.assertUsesIndex(Bot.objects.filter(bot_hash="0x1"), "bot_hash_unique")
+
+    def test_takers_listing(self):
+        """The takers of a user or a maker are listed the newest first"""
+
+        self.assertUsesIndex(
+            Taker.objects.filter(user=self.users[0]).order_by("-timestamp")[:100],
+            "taker_user_timestamp_idx",
+        )
+        self.assertUsesIndex(
+            Taker.objects.filter(maker=self.makers[0]).order_by("-timestamp"),
+            "taker_maker_timestamp_idx",
+        )
@@ -0,0 +1,386 @@
+from decimal import Decimal
+from datetime import datetime
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework.status import HTTP_200_OK
+from api.models.orders import Maker, Bot, Taker, BlockCommit
+from api.ladders import (
+    amounts,
+    ladder_order,
+    level_hash,
+    level_hashes,
+    level_prices,
+    ladder_index,
+    materialize,
+    materialize_level,
+)
+from api.utils import compute_order_hash
+from api.order_book import order_book
+from backend.cron import deleting_expired_orders
+
+
+class BotMixin:
+    """Creates a bot of eleven levels through the api"""
+
+    def setUp(self):
+        cache.clear()
+        order_book.clear()
+        ladder_index.clear()
+        self.data = {
+            "address": "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+            "chain_id": 31337,
+            "expiry": 2114380800,
+            "signature": "0x0e4b8968194fe008b2766a7c2920dc5784cc23f2ec785fb605c51d48f18295121ee57d4f0c33250554b2ac1980ea4c9067ef1680b08195a768b2a1239cff6b851b",
+            "is_buyer": False,
+            "step": "{0:f}".format(Decimal("1e17")),
+            "price": "{0:f}".format(Decimal("1e18")),
+            "maker_fees": "{0:f}".format(Decimal("50")),
+            "upper_bound": "{0:f}".format(Decimal("15e17")),
+            "lower_bound": "{0:f}".format(Decimal("5e17")),
+            "amount": "{0:f}".format(Decimal("2e18")),
+            "base_token": "0xF25186B5081Ff5cE73482AD761DB0eB0d25abfBF",
+            "quote_token": "0x345CA3e014Aaf5dcA488057592ee47305D9B3e10",
+        }
+        self.pair = {
+            "chain_id": self.data["chain_id"],
+            "base_token": self.data["base_token"],
+            "quote_token": self.data["quote_token"],
+        }
+        response = self.client.post(reverse("api:bot"), data=self.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.bot = Bot.objects.select_related("user").get()
+
+    def tearDown(self):
+        order_book.clear()
+
+    def trade(self, order_hash: str):
+        """Posts a watch tower commit selling on a level of the bot"""
+
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            return self.client.post(
+                reverse("api:wt"),
+                format="json",
+                data={
+                    "taker": "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef",
+                    "block": 12,
+                    "trades": {
+                        order_hash: {
+                            "amount": "{0:f}".format(Decimal("73e16")),
+                            "base_fees": True,
+                            "fees": "{0:f}".format(Decimal("365e15")),
+                            "is_buyer": True,
+                        }
+                    },
+                },
+            )
+
+
+class BotLadderTestCase(BotMixin, APITestCase):
+    """Checks the bots levels are only stored once traded"""
+
+    def test_level_hashes_match_the_order_hashes(self):
+        """The hashes derived from the shared prefix should be the signed ones"""
+
+        hashes = [
+            compute_order_hash({**ladder_order(self.bot), "maker_price": price})[1]
+            for price in level_prices(self.bot)
+        ]
+        self.assertListEqual(level_hashes(self.bot), hashes)
+        self.assertEqual(level_hash(self.bot, int(Decimal("7e17"))), hashes[2])
+
+    def test_bot_creation_stores_no_maker(self):
+        """The bot levels should be shown into the book without being stored"""
+
+        self.assertEqual(Maker.objects.count(), 0, "no maker should be stored")
+
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertListEqual(
+            sorted(order["order_hash"] for order in response.json()),
+            sorted(level_hash(self.bot, price) for price in level_prices(self.bot)),
+            "all the bot levels should be into the book",
+        )
+
+    def test_trade_on_an_untouched_level(self):
+        """The watch tower trades should store the traded levels only"""
+
+        order_hash = level_hash(self.bot, int(Decimal("11e17")))
+        ladder_index.clear()
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            response = self.client.post(
+                reverse("api:wt"),
+                format="json",
+                data={
+                    "taker": "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef",
+                    "block": 12,
+                    "trades": {
+                        order_hash: {
+                            "amount": "{0:f}".format(Decimal("73e16")),
+                            "base_fees": True,
+                            "fees": "{0:f}".format(Decimal("365e15")),
+                            "is_buyer": True,
+                        }
+                    },
+                },
+            )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        maker = Maker.objects.get()
+        self.assertEqual(maker.order_hash, order_hash)
+        self.assertEqual(maker.bot, self.bot)
+        self.assertEqual(maker.filled, Decimal("73e16"))
+        self.assertEqual(Taker.objects.get().maker, maker)
+
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertEqual(
+            len(response.json()),
+            len(level_prices(self.bot)),
+            "the traded level should replace its virtual level into the book",
+        )
+
+    def test_user_makers_list_the_bot_levels(self):
+        """The user orders should contain the stored and the untouched levels"""
+
+        materialize_level(self.bot, Decimal("9e17"))
+        self.client.force_authenticate(user=self.bot.user)  # type: ignore
+        response = self.client.get(reverse("api:order"), data=self.pair)
+        self.assertEqual(len(response.json()), len(level_prices(self.bot)))
+
+    def test_user_makers_pages_match_the_full_listing(self):
+        """The paginated user orders should list the same rows as the full listing"""
+
+        materialize_level(self.bot, Decimal("9e17"))
+        Maker(
+            user=self.bot.user,
+            amount=Decimal("1e18"),
+            expiry=datetime.fromtimestamp(2114380801),
+            price=Decimal("3e18"),
+            signature="0x" + "0" * 130,
+            order_hash="0x" + "1" * 64,
+            is_buyer=False,
+            chain_id=self.bot.chain_id,
+            base_token=self.bot.base_token,
+            quote_token=self.bot.quote_token,
+        ).save()
+        self.client.force_authenticate(user=self.bot.user)  # type: ignore
+        listing = [
+            maker["order_hash"]
+            for maker in self.client.get(reverse("api:order"), data=self.pair).json()
+        ]
+        self.assertEqual(len(listing), len(level_prices(self.bot)) + 1)
+
+        pages = []
+        params = {**self.pair, "limit": 3}
+        while True:
+            response = self.client.get(reverse("api:order"), data=params)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            pages += [maker["order_hash"] for maker in response.json()["results"]]
+            if response.json()["next"] is None:
+                break
+            params["cursor"] = response.json()["next"]
+        self.assertListEqual(pages, listing)
+
+    def test_book_pages_match_the_full_book(self):
+        """The book pages and depth should contain the untouched bot levels"""
+
+        materialize_level(self.bot, Decimal("9e17"))
+        book = self.client.get(reverse("api:orders"), data=self.pair).json()
+        self.assertEqual(len(book), len(level_prices(self.bot)))
+
+        pages = []
+        params = {**self.pair, "limit": 4}
+        while True:
+            response = self.client.get(reverse("api:orders"), data=params)
+            pages += response.json()["results"]
+            if response.json()["next"] is None:
+                break
+            params["cursor"] = response.json()["next"]
+        self.assertListEqual(pages, book)
+
+        response = self.client.get(reverse("api:depth"), data=self.pair)
+        self.assertListEqual(
+            [level["price"] for level in response.json()["bids"]],
+            [str(price) for price in reversed(level_prices(self.bot)[:6])],
+        )
+        self.assertEqual(sum(level["count"] for level in response.json()["asks"]), 5)
+
+    def test_bot_levels_are_not_expanded(self):
+        """The bot creation and the book loading should only keep its ladder"""
+
+        Bot.objects.all().delete()
+        with patch("api.ladders.level_hashes", side_effect=AssertionError):
+            response = self.client.post(reverse("api:bot"), data=self.data)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.client.get(reverse("api:orders"), data=self.pair)
+        (book,) = order_book.books.values()
+        self.assertDictEqual(book.orders, {}, "no level should be stored")
+        self.assertEqual(len(book.bots), 1)
+        self.assertEqual(len(book.to_list()), len(level_prices(self.bot)))
+
+    def test_amounts_of_a_traded_bot(self):
+        """The amounts should match the sum of the remaining amount of each level"""
+
+        for price, filled in [("7e17", "5e17"), ("12e17", "2e18")]:
+            maker = materialize_level(self.bot, Decimal(price))
+            maker.filled = Decimal(filled)
+            maker.save()
+
+        bot = Bot.objects.prefetch_related("orders").get()
+        filled = {int(maker.price): int(maker.filled) for maker in bot.orders.all()}
+        base_token_amount, quote_token_value = 0, 0
+        for price in level_prices(bot):
+            remaining = int(bot.amount) - filled.get(price, 0)
+            if price <= int(bot.price):
+                quote_token_value += remaining * price
+            else:
+                base_token_amount += remaining
+        self.assertTupleEqual(
+            amounts(bot), (base_token_amount, quote_token_value // 10**18)
+        )
+
+    def copy_bot(self, index: int, price: str):
+        """Stores a copy of the bot with another price"""
+
+        bot = Bot.objects.select_related("user").get(id=self.bot.id)
+        bot.pk = None
+        bot.price = Decimal(price)
+        bot.bot_hash = "0x" + f"{index:064x}"
+        bot.save()
+        return bot
+
+    def test_index_refresh_is_incremental_and_batched(self):
+        """A miss should index the new bots by batches until the hash is found"""
+
+        ladder_index.clear()
+        ladder_index.resolve([level_hash(self.bot, int(Decimal("5e17")))])
+        self.assertEqual(ladder_index.last_id, self.bot.id)
+
+        bots = [self.copy_bot(0, "8e17"), self.copy_bot(1, "9e17")]
+        order_hash = level_hash(bots[1], int(Decimal("5e17")))
+        with patch.object(ladder_index, "REFRESH_LEVELS", 1), patch.object(
+            ladder_index, "refresh", wraps=ladder_index.refresh
+        ) as refresh:
+            self.assertDictEqual(
+                ladder_index.resolve([order_hash]),
+                {order_hash: (bots[1].id, int(Decimal("5e17")))},
+            )
+        self.assertEqual(refresh.call_count, 2, "one batch per new bot")
+        self.assertEqual(ladder_index.last_id, bots[1].id)
+
+        ladder_index.clear()
+        with patch.object(ladder_index, "MAX_LEVELS", len(level_prices(self.bot))):
+            ladder_index.resolve([order_hash])
+            self.assertListEqual(list(ladder_index.bots), [bots[1].id])
+            self.assertDictEqual(
+                ladder_index.resolve([level_hash(self.bot, int(Decimal("5e17")))]),
+                {
+                    level_hash(self.bot, int(Decimal("5e17"))): (
+                        self.bot.id,
+                        int(Decimal("5e17")),
+                    )
+                },
+                "the evicted bots should be indexed again",
+            )
+            self.assertListEqual(list(ladder_index.bots), [self.bot.id])
+
+        bots[1].delete()
+        self.assertListEqual(materialize([order_hash]), [])
+        self.assertNotIn(bots[1].id, ladder_index.bots)
+
+    def test_trades_are_applied_once_all_their_makers_are_found(self):
+        """A commit should be applied whole, or rejected without being recorded"""
+
+        bot = self.copy_bot(0, "8e17")
+        order_hash = level_hash(bot, int(Decimal("5e17")))
+        trade = {
+            "amount": "{0:f}".format(Decimal("1e17")),
+            "base_fees": True,
+            "fees": "{0:f}".format(Decimal("1e15")),
+            "is_buyer": False,
+        }
+        data = {
+            "taker": "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef",
+            "block": 12,
+            "trades": {order_hash: trade, "0x" + "1" * 64: trade},
+        }
+        ladder_index.clear()
+        with patch(
+            "api.views.watch_tower.WatchTowerView.permission_classes", []
+        ), patch.object(ladder_index, "REFRESH_LEVELS", 5):
+            response = self.client.post(reverse("api:wt"), format="json", data=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(BlockCommit.objects.exists())
+            self.assertFalse(Taker.objects.exists())
+
+            del data["trades"]["0x" + "1" * 64]
+            response = self.client.post(reverse("api:wt"), format="json", data=data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(Taker.objects.get().maker.order_hash, order_hash)
+
+    def test_expired_bots_are_deleted(self):
+        """The cron should delete the expired bots along with their levels"""
+
+        materialize_level(self.bot, Decimal("9e17"))
+        self.client.get(reverse("api:orders"), data=self.pair)
+        Bot.objects.update(expiry=datetime.fromtimestamp(0))
+        Maker.objects.update(expiry=datetime.fromtimestamp(0))
+
+        deleting_expired_orders()
+        self.assertFalse(Bot.objects.exists())
+        self.assertFalse(Maker.objects.exists())
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertListEqual(response.json(), [])
+
+    def test_backfill_of_the_bots_stored_as_makers(self):
+        """The ladder of a bot stored with the placeholders should be filled
+        from the makers of its levels"""
+
+        materialize_level(self.bot, Decimal("7e17"))
+        expected = Bot.objects.values().get()
+        Bot.objects.update(
+            base_token="",
+            quote_token="",
+            amount=Decimal("0"),
+            is_buyer=True,
+            expiry=datetime.fromtimestamp(0),
+            signature="",
+        )
+
+        call_command("backfill_bots")
+        self.assertDictEqual(Bot.objects.values().get(), expected)
+
+
+class BotLadderBookTestCase(BotMixin, APITransactionTestCase):
+    """Checks the loaded books follow the bot levels without being reloaded"""
+
+    def book(self) -> list:
+        return self.client.get(reverse("api:orders"), data=self.pair).json()
+
+    def test_traded_then_cancelled_level(self):
+        """The filled then cancelled levels should match a reloaded book"""
+
+        order_hash = level_hash(self.bot, int(Decimal("11e17")))
+        self.book()
+        with patch.object(order_book, "load", side_effect=AssertionError):
+            self.assertEqual(self.trade(order_hash).status_code, HTTP_200_OK)
+            (level,) = [
+                order for order in self.book() if order["order_hash"] == order_hash
+            ]
+            self.assertEqual(level["filled"], "{0:f}".format(Decimal("73e16")))
+            self.assertEqual(len(self.book()), len(level_prices(self.bot)))
+
+            with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+                response = self.client.delete(
+                    reverse("api:wt"), format="json", data={"orderHashes": [order_hash]}
+                )
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            resident = self.book()
+        (level,) = [order for order in resident if order["order_hash"] == order_hash]
+        self.assertEqual(level["status"], "CANCELLED")
+
+        order_book.clear()
+        self.assertListEqual(
+            resident, self.book(), "a reload should show the same book"
+        )
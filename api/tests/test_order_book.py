@@ -0,0 +1,344 @@
+from decimal import Decimal
+from datetime import datetime
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from api.models import User
+from api.models.orders import Maker
+from api.models.types import Address
+from api.order_book import OrderBook, order_book
+
+BOT = {"bot_hash": "0xb", "fees_earned": "0", "maker_fees": "50"}
+
+
+def entry(order_hash, price, is_buyer, status="OPEN", bot=None, filled="0"):
+    return {
+        "order_hash": order_hash,
+        "price": "{0:f}".format(Decimal(price)),
+        "is_buyer": is_buyer,
+        "status": status,
+        "bot": bot,
+        "amount": "{0:f}".format(Decimal("1e18")),
+        "filled": filled,
+    }
+
+
+class OrderBookTestCase(APITestCase):
+    """Checks the in memory book structure of a pair"""
+
+    def test_book_levels_are_sorted_best_price_first(self):
+        """Asks are returned from the lowest price and bids from the highest"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "3e18", False))
+        book.add(entry("0x2", "1e18", True))
+        book.add(entry("0x3", "2e18", False))
+        book.add(entry("0x4", "5e17", True))
+        book.add(entry("0x5", "2e18", False))
+
+        self.assertListEqual(
+            [price for price, _ in book.side(False)],
+            [int(Decimal("2e18")), int(Decimal("3e18"))],
+            "the asks should be sorted from the lowest price",
+        )
+        self.assertListEqual(
+            [price for price, _ in book.side(True)],
+            [int(Decimal("1e18")), int(Decimal("5e17"))],
+            "the bids should be sorted from the highest price",
+        )
+        self.assertListEqual(
+            [order["order_hash"] for order in book.to_list()],
+            ["0x3", "0x5", "0x1", "0x2", "0x4"],
+            "the book should list the asks then the bids, best prices first",
+        )
+
+    def test_removing_the_last_order_removes_the_level(self):
+        """Empty price levels should not stay in the book"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "3e18", False))
+        book.add(entry("0x2", "3e18", False))
+        book.remove("0x1")
+        self.assertEqual(len(book.prices[False]), 1)
+        book.remove("0x2", "0x3")
+        self.assertListEqual(book.prices[False], [])
+        self.assertListEqual(book.to_list(), [])
+
+    def test_filled_and_cancelled_makers_leave_the_book(self):
+        """Regular makers are removed once they are not open anymore"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "3e18", False))
+        book.add(entry("0x2", "3e18", False))
+        book.update("0x1", filled="1000000000000000000", status="FILLED")
+        book.add(entry("0x2", "3e18", False, status="CANCELLED"))
+
+        self.assertListEqual(book.to_list(), [])
+
+    def test_bot_orders_share_their_bot(self):
+        """The bot fees update should be visible on all the bot orders"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "1e18", True, bot={**BOT}))
+        book.add(entry("0x2", "2e18", False, bot={**BOT}))
+        book.update("0x2", filled="1000000000000000000", status="FILLED")
+        book.update_bot("0xb", fees_earned="12")
+
+        self.assertEqual(
+            len(book.to_list()), 2, "the filled bot orders should stay into the book"
+        )
+        self.assertListEqual(
+            [order["bot"]["fees_earned"] for order in book.to_list()], ["12", "12"]
+        )
+
+        book.remove_bot("0xb")
+        self.assertListEqual(book.to_list(), [])
+        self.assertDictEqual(book.bots, {})
+
+    def test_depth_aggregates_the_levels(self):
+        """The depth levels should sum the remaining amounts of each price"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "3e18", False))
+        book.add(entry("0x2", "2e18", False, filled="400000000000000000"))
+        book.add(entry("0x3", "2e18", False))
+        book.add(entry("0x4", "1e18", True))
+
+        self.assertListEqual(
+            book.depth(False, 10),
+            [
+                {
+                    "price": "2000000000000000000",
+                    "amount": "1600000000000000000",
+                    "count": 2,
+                },
+                {
+                    "price": "3000000000000000000",
+                    "amount": "1000000000000000000",
+                    "count": 1,
+                },
+            ],
+        )
+        self.assertListEqual(
+            book.depth(False, 1),
+            [
+                {
+                    "price": "2000000000000000000",
+                    "amount": "1600000000000000000",
+                    "count": 2,
+                }
+            ],
+            "the depth should be limited to the best levels",
+        )
+
+        book.update("0x3", filled="1000000000000000000", status="FILLED")
+        book.remove("0x4")
+        self.assertDictEqual(
+            book.depth(False, 10)[0],
+            {
+                "price": "2000000000000000000",
+                "amount": "600000000000000000",
+                "count": 1,
+            },
+        )
+        self.assertListEqual(book.depth(True, 10), [])
+        self.assertDictEqual(book.liquidity[True], {})
+
+    def test_depth_tick_grouping(self):
+        """Bids are grouped down and asks up to the tick, best levels first"""
+
+        book = OrderBook(0)
+        for order_hash, price, is_buyer in [
+            ("0x1", "105", False),
+            ("0x2", "110", False),
+            ("0x3", "121", False),
+            ("0x4", "99", True),
+            ("0x5", "90", True),
+            ("0x6", "81", True),
+        ]:
+            book.add(entry(order_hash, price, is_buyer))
+
+        self.assertListEqual(
+            [(level["price"], level["count"]) for level in book.depth(False, 10, 10)],
+            [("110", 2), ("130", 1)],
+        )
+        self.assertListEqual(
+            [(level["price"], level["count"]) for level in book.depth(True, 10, 10)],
+            [("90", 2), ("80", 1)],
+        )
+        self.assertEqual(len(book.depth(True, 1, 10)), 1)
+
+    def test_depth_includes_the_bots_reverse_orders(self):
+        """The filled part of a bot order is offered back on the other side"""
+
+        book = OrderBook(0)
+        book.add(entry("0x1", "1e18", True, bot={**BOT}, filled="250000000000000000"))
+        book.add(entry("0x2", "2e18", False, bot={**BOT}, filled="1000000000000000000"))
+
+        self.assertListEqual(
+            book.depth(False, 10),
+            [
+                {
+                    "price": "1050000000000000000",
+                    "amount": "250000000000000000",
+                    "count": 1,
+                }
+            ],
+        )
+        self.assertListEqual(
+            book.depth(True, 10),
+            [
+                {
+                    "price": "1904761904761904761",
+                    "amount": "1000000000000000000",
+                    "count": 1,
+                },
+                {
+                    "price": "1000000000000000000",
+                    "amount": "750000000000000000",
+                    "count": 1,
+                },
+            ],
+        )
+
+
+class OrderBookEngineTestCase(APITransactionTestCase):
+    """Checks the loaded books are updated in place outside of transactions"""
+
+    def setUp(self):
+        order_book.clear()
+        self.user = async_to_sync(User.objects.create_user)(
+            address=Address("0x70997970C51812dc3A010C7d01b50e0d17dc79C8")
+        )
+        self.pair = {
+            "chain_id": 31337,
+            "base_token": Address("0xF25186B5081Ff5cE73482AD761DB0eB0d25abfBF"),
+            "quote_token": Address("0x345CA3e014Aaf5dcA488057592ee47305D9B3e10"),
+        }
+        self.data = {
+            "address": Address("0x70997970C51812dc3A010C7d01b50e0d17dc79C8"),
+            "amount": "{0:f}".format(Decimal("10e18")),
+            "expiry": 2114380801,
+            "price": "{0:f}".format(Decimal("1e18")),
+            "signature": "0x20ac5d31e978ea2f5d1dc16b08789d61bd58fcdf0ef6475db340354b1e3dab0c6f48576498037d4455e9c99695c22a02fa203ade35bb8b81e4e123a0e819a0041c",
+            "order_hash": "0xa6a16391a147c1af24904cd5d0bfda49786a85e6359ecb34cef2113a2b5550f8",
+            "is_buyer": False,
+            **self.pair,
+        }
+
+    def tearDown(self):
+        order_book.clear()
+
+    def test_book_is_updated_without_reloading(self):
+        """Creating and cancelling a maker should update the loaded book in place"""
+
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertListEqual(response.json(), [], "the book should be empty at first")
+
+        with patch.object(order_book, "load", side_effect=AssertionError):
+            response = self.client.post(reverse("api:order"), data=self.data)
+            self.assertEqual(
+                response.status_code, HTTP_200_OK, "The order creation should work"
+            )
+            maker = response.json()
+
+            response = self.client.get(reverse("api:orders"), data=self.pair)
+            self.assertListEqual(
+                response.json(),
+                [maker],
+                "the created maker should be added to the loaded book",
+            )
+
+            with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+                response = self.client.delete(
+                    reverse("api:wt"),
+                    format="json",
+                    data={
+                        "baseToken": self.pair["base_token"],
+                        "quoteToken": self.pair["quote_token"],
+                        "orderHash": self.data["order_hash"],
+                    },
+                )
+            self.assertEqual(
+                response.status_code, HTTP_200_OK, "The cancellation should work"
+            )
+
+            response = self.client.get(reverse("api:orders"), data=self.pair)
+            self.assertListEqual(
+                response.json(),
+                [],
+                "the cancelled maker should be removed from the loaded book",
+            )
+
+    def test_depth_endpoint(self):
+        """The depth endpoint should aggregate the book levels"""
+
+        response = self.client.post(reverse("api:order"), data=self.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        response = self.client.get(
+            reverse("api:depth"), data={**self.pair, "depth": 10, "tick": "1e17"}
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertDictEqual(
+            response.json(),
+            {
+                "bids": [],
+                "asks": [
+                    {
+                        "price": self.data["price"],
+                        "amount": self.data["amount"],
+                        "count": 1,
+                    }
+                ],
+            },
+        )
+
+        for params in [{"depth": "1.5"}, {"depth": "-1"}, {"tick": "-1"}]:
+            response = self.client.get(
+                reverse("api:depth"), data={**self.pair, **params}
+            )
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+            self.assertListEqual(list(response.json()), list(params))
+
+    def test_deltas_ring_buffer(self):
+        """Only the last deltas are kept, older sequences need a new snapshot"""
+
+        key = "test_deltas_ring_buffer"
+        with patch.object(order_book, "DELTAS_BUFFER_SIZE", 2):
+            for index in range(3):
+                order_book.record(key, {"delta": index})
+
+            self.assertIsNone(order_book.deltas(key, 0))
+            self.assertIsNone(order_book.deltas(key, 4))
+            self.assertListEqual(
+                order_book.deltas(key, 1),
+                [{"delta": 1, "sequence": 2}, {"delta": 2, "sequence": 3}],
+            )
+            self.assertListEqual(order_book.deltas(key, 3), [])
+
+    def test_book_is_reloaded_on_foreign_update(self):
+        """A version bump from another process should reload the book"""
+
+        self.client.get(reverse("api:orders"), data=self.pair)
+
+        with patch.object(order_book, "books", {}):
+            async_to_sync(Maker.objects.create)(
+                user=self.user,
+                amount=self.data["amount"],
+                expiry=datetime.fromtimestamp(self.data["expiry"]),
+                price=self.data["price"],
+                base_token=self.pair["base_token"],
+                quote_token=self.pair["quote_token"],
+                signature=self.data["signature"],
+                order_hash=self.data["order_hash"],
+                chain_id=self.pair["chain_id"],
+                is_buyer=self.data["is_buyer"],
+            )
+
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertEqual(
+            len(response.json()), 1, "the book should be reloaded from the database"
+        )
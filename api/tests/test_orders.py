@@ -14,7 +14,10 @@ from rest_framework import serializers
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
 from api.models import User
 import api.errors as errors
-from api.models.orders import Maker, Taker
+from api.models.orders import Maker, Taker, Bot
+from api.ladders import materialize_level
+from api.messages import WStypes
+from api.order_book import order_book, book_key
 from api.models.types import Address
 from rest_framework.test import APITestCase
 
@@ -2391,7 +2394,7 @@ class MakerOrderRetrievingTestCase(APITestCase):
             is_buyer=False,
         )
 
-        bot_maker = Maker.objects.get(bot__isnull=False)
+        bot_maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         bot_maker.status = Maker.FILLED
         bot_maker.filled = bot_maker.amount
         bot_maker.save()
@@ -3172,7 +3175,7 @@ class TakerRetrievalTestCase(APITestCase):
             "quote_token": "0x345CA3e014Aaf5dcA488057592ee47305D9B3e10",
         }
         self.client.post(reverse("api:bot"), data=self.bot_data)
-        self.bot_maker = Maker.objects.filter(user__isnull=True, bot__isnull=False).first()
+        self.bot_maker = materialize_level(Bot.objects.get(), Decimal("5e17"))
 
     def test_anon_users_can_see_takers_orders(self):
         """The anonymous users should be able to see taker orders"""
@@ -3666,3 +3669,129 @@ class TakerRetrievalTestCase(APITestCase):
             self.taker_details["is_buyer"],
             "The returned and created taker order is_buyer should be the same ",
         )
+
+
+class BatchMakerOrderTestCase(APITestCase):
+    """Test case for the creation of maker orders in batches"""
+
+    def setUp(self):
+        order_book.clear()
+        self.order_1 = {
+            "address": "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+            "amount": "{0:f}".format(Decimal("173e16")),
+            "expiry": 2114380800,
+            "price": "{0:f}".format(Decimal("2e20")),
+            "base_token": "0x4bbeEB066eD09B7AEd07bF39EEe0460DFa261520",
+            "quote_token": "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+            "chain_id": 31337,
+            "signature": "0x68343d2c50955f78107a1c17d3607ef839738d5a6d627f77f869c3f2cff1ec2b5ff6507cb20ec34434c5f1eebd9e4f21ef492deff30c0e916f61c352e6b24c031c",
+            "order_hash": "0x91f4f7ac26bc9ddeafe32ec4b83dd8e0eeea87285ee818d1427c7145bf3e7c56",
+            "is_buyer": False,
+        }
+        self.order_2 = {
+            "address": "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+            "amount": "{0:f}".format(Decimal("10e18")),
+            "expiry": 2114380801,
+            "price": "{0:f}".format(Decimal("1e18")),
+            "base_token": "0xF25186B5081Ff5cE73482AD761DB0eB0d25abfBF",
+            "quote_token": "0x345CA3e014Aaf5dcA488057592ee47305D9B3e10",
+            "chain_id": 31337,
+            "signature": "0x20ac5d31e978ea2f5d1dc16b08789d61bd58fcdf0ef6475db340354b1e3dab0c6f48576498037d4455e9c99695c22a02fa203ade35bb8b81e4e123a0e819a0041c",
+            "order_hash": "0xa6a16391a147c1af24904cd5d0bfda49786a85e6359ecb34cef2113a2b5550f8",
+            "is_buyer": False,
+        }
+
+    def tearDown(self):
+        order_book.clear()
+
+    def test_creating_a_batch_of_makers_works(self):
+        """The valid orders should be created, the others reported by index"""
+
+        key = book_key(
+            self.order_2["chain_id"],
+            self.order_2["base_token"],
+            self.order_2["quote_token"],
+        )
+        sequence = order_book.get_sequence(key)
+        orders = [
+            self.order_1,
+            {**self.order_1, "signature": self.order_2["signature"]},
+            self.order_2,
+            self.order_1,
+            {**self.order_2, "amount": "1.5"},
+        ]
+        response = self.client.post(
+            reverse("api:order-batch"), data={"orders": orders}, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        self.assertListEqual(
+            [maker["order_hash"] for maker in response.json()["makers"]],
+            [self.order_1["order_hash"], self.order_2["order_hash"]],
+        )
+        self.assertEqual(Maker.objects.count(), 2, "two makers should be created")
+        batch_errors = response.json()["errors"]
+        self.assertListEqual(
+            [bool(error) for error in batch_errors], [False, True, False, True, True]
+        )
+        self.assertDictEqual(
+            batch_errors[1], {"error": [errors.Signature.SIGNATURE_MISMATCH_ERROR]}
+        )
+        self.assertDictEqual(
+            batch_errors[3], {"error": [errors.Order.BATCH_DUPLICATE_ORDER]}
+        )
+        self.assertIn("amount", batch_errors[4])
+
+        response = self.client.get(
+            reverse("api:orders"),
+            data={
+                "chain_id": self.order_2["chain_id"],
+                "base_token": self.order_2["base_token"],
+                "quote_token": self.order_2["quote_token"],
+            },
+        )
+        self.assertListEqual(
+            [maker["order_hash"] for maker in response.json()],
+            [self.order_2["order_hash"]],
+        )
+        deltas = order_book.deltas(key, sequence)
+        self.assertEqual(len(deltas), 1, "one message should be sent per pair")  # type: ignore
+        self.assertListEqual(
+            [maker["order_hash"] for maker in deltas[0][WStypes.NEW_MAKERS]],  # type: ignore
+            [self.order_2["order_hash"]],
+        )
+
+    def test_batch_with_an_existing_order(self):
+        """The orders already stored should be reported, the others created"""
+
+        response = self.client.post(
+            reverse("api:order-batch"), data={"orders": [self.order_1]}, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        response = self.client.post(
+            reverse("api:order-batch"),
+            data={"orders": [self.order_1, self.order_2]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertListEqual(
+            [maker["order_hash"] for maker in response.json()["makers"]],
+            [self.order_2["order_hash"]],
+        )
+        self.assertListEqual(
+            response.json()["errors"],
+            [{"error": [errors.Order.BATCH_DUPLICATE_ORDER]}, {}],
+        )
+        self.assertEqual(Maker.objects.count(), 2)
+
+    def test_malformed_batches_fail(self):
+        """Empty, non list and oversized batches should be rejected"""
+
+        for orders in [[], {}, "orders", [self.order_1] * 501]:
+            response = self.client.post(
+                reverse("api:order-batch"), data={"orders": orders}, format="json"
+            )
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+            self.assertIn("orders", response.json())
+        self.assertFalse(Maker.objects.exists())
@@ -0,0 +1,152 @@
+from decimal import Decimal
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+import api.errors as errors
+from api.models import User
+from api.models.orders import Maker, Taker
+from api.models.types import Address
+from api.order_book import order_book
+from api.pagination import encode_cursor
+
+
+class KeysetPaginationTestCase(APITestCase):
+    """Checks the cursor pagination of the orders listings"""
+
+    def setUp(self):
+        order_book.clear()
+        self.user = async_to_sync(User.objects.create_user)(
+            address=Address("0x70997970C51812dc3A010C7d01b50e0d17dc79C8")
+        )
+        self.pair = {
+            "chain_id": 31337,
+            "base_token": Address("0xF25186B5081Ff5cE73482AD761DB0eB0d25abfBF"),
+            "quote_token": Address("0x345CA3e014Aaf5dcA488057592ee47305D9B3e10"),
+        }
+        self.makers = [
+            async_to_sync(Maker.objects.create)(
+                user=self.user,
+                amount=Decimal("1e18"),
+                expiry=datetime.fromtimestamp(2114380801),
+                price=Decimal(price),
+                signature="0x" + "0" * 130,
+                order_hash="0x" + f"{index:064x}",
+                is_buyer=is_buyer,
+                **self.pair,
+            )
+            for index, (price, is_buyer) in enumerate(
+                [
+                    ("2e18", False),
+                    ("1e18", True),
+                    ("2e18", False),
+                    ("3e18", False),
+                    ("5e17", True),
+                ]
+            )
+        ]
+        for maker in self.makers:
+            async_to_sync(Taker.objects.create)(
+                amount=Decimal("1e17"),
+                maker=maker,
+                user=self.user,
+                block=18,
+                base_fees=False,
+                fees=Decimal("1e15"),
+                is_buyer=not maker.is_buyer,
+            )
+
+    def tearDown(self):
+        order_book.clear()
+
+    def walk(self, url: str, data: dict, key: str) -> list:
+        """Returns the `key` of all the listed items, following the cursors"""
+
+        items = []
+        cursor = None
+        while True:
+            params = {**data, "limit": 2}
+            if cursor is not None:
+                params["cursor"] = cursor
+            response = self.client.get(url, data=params)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertLessEqual(len(response.json()["results"]), 2)
+            items += [item[key] for item in response.json()["results"]]
+            if (cursor := response.json()["next"]) is None:
+                return items
+
+    def test_maker_pages_cover_all_the_orders(self):
+        """The user makers should be listed once each, the newest first"""
+
+        self.client.force_authenticate(user=self.user)  # type: ignore
+        self.assertListEqual(
+            self.walk(
+                reverse("api:order"), {"chain_id": 31337, "all": 1}, "order_hash"
+            ),
+            [maker.order_hash for maker in reversed(self.makers)],
+        )
+
+    def test_taker_pages_cover_all_the_trades(self):
+        """The takers should be listed once each, the newest first"""
+
+        self.assertEqual(
+            len(self.walk(reverse("api:taker"), self.pair, "timestamp")),
+            len(self.makers),
+        )
+
+    def test_order_book_pages_follow_the_book_order(self):
+        """The book pages should list the asks then the bids, best prices first"""
+
+        self.assertListEqual(
+            self.walk(reverse("api:orders"), self.pair, "order_hash"),
+            [
+                self.makers[0].order_hash,
+                self.makers[2].order_hash,
+                self.makers[3].order_hash,
+                self.makers[1].order_hash,
+                self.makers[4].order_hash,
+            ],
+        )
+
+    def test_listing_without_pagination_params_is_unchanged(self):
+        """Requests without limit nor cursor get the full list"""
+
+        response = self.client.get(reverse("api:orders"), data=self.pair)
+        self.assertEqual(len(response.json()), len(self.makers))
+
+    def test_malformed_cursor(self):
+        """Malformed cursors should be rejected"""
+
+        self.client.force_authenticate(user=self.user)  # type: ignore
+        for url, data in [
+            (reverse("api:orders"), self.pair),
+            (reverse("api:order"), {"chain_id": 31337, "all": 1}),
+            (reverse("api:taker"), self.pair),
+        ]:
+            for cursor in ["not a cursor", encode_cursor(["a", "b", "c"])]:
+                response = self.client.get(url, data={**data, "cursor": cursor})
+                self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+                self.assertDictEqual(
+                    response.json(), {"cursor": [errors.Pagination.WRONG_CURSOR]}
+                )
+
+    def test_negative_limit(self):
+        """Negative page sizes should be rejected"""
+
+        response = self.client.get(
+            reverse("api:orders"), data={**self.pair, "limit": -1}
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(
+            response.json(), {"limit": [errors.Order.ORDER_POSITIVE_VIOLATION]}
+        )
+
+    def test_limit_is_capped(self):
+        """The page size cannot go over the maximum limit"""
+
+        response = self.client.get(
+            reverse("api:orders"), data={**self.pair, "limit": 10**6}
+        )
+        self.assertEqual(len(response.json()["results"]), len(self.makers))
+        self.assertIsNone(response.json()["next"])
@@ -10,6 +10,7 @@ from rest_framework.exceptions import NotAuthenticated
 from web3 import Web3
 from api.models import User
 from api.models.orders import Maker, Bot
+from api.ladders import materialize_level
 from api.models.types import Address
 import api.errors as errors
 from api.utils import encode_order
@@ -1994,19 +1995,8 @@ class BotRetrievalTestCase(APITestCase):
         are returned with the right balances
         """
         bot = Bot.objects.get(user=self.user)
-        buyer: Maker = Maker.objects.filter(
-            bot=bot,
-            is_buyer=True,
-            base_token=Address(self.data.get("base_token", "")),
-            quote_token=Address(self.data.get("quote_token", "")),
-        ).first()  # type: ignore
-
-        seller: Maker = Maker.objects.filter(
-            bot=bot,
-            is_buyer=False,
-            base_token=Address(self.data.get("base_token", "")),
-            quote_token=Address(self.data.get("quote_token", "")),
-        ).first()  # type: ignore
+        buyer: Maker = materialize_level(bot, Decimal("5e17"))
+        seller: Maker = materialize_level(bot, Decimal("11e17"))
 
         buyer.filled = F("amount") / 2
         seller.filled = F("amount") / 2
@@ -0,0 +1,48 @@
+from asgiref.sync import async_to_sync
+from rest_framework.test import APITestCase
+from api.signatures import SignatureVerifier
+from api.utils import encode_order
+
+ORDER = {
+    "address": "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+    "amount": 10**19,
+    "price": 10**18,
+    "step": 0,
+    "maker_fees": 0,
+    "upper_bound": 0,
+    "lower_bound": 0,
+    "base_token": "0xF25186B5081Ff5cE73482AD761DB0eB0d25abfBF",
+    "quote_token": "0x345CA3e014Aaf5dcA488057592ee47305D9B3e10",
+    "expiry": 2114380801,
+    "chain_id": 31337,
+    "is_buyer": 1,
+    "replace_order": False,
+}
+SIGNATURE = "0x20ac5d31e978ea2f5d1dc16b08789d61bd58fcdf0ef6475db340354b1e3dab0c6f48576498037d4455e9c99695c22a02fa203ade35bb8b81e4e123a0e819a0041c"
+
+
+class SignatureVerifierTestCase(APITestCase):
+    """Checks the batches of signatures are verified in the worker processes"""
+
+    def test_batch_verification(self):
+        """Each signature of a batch should get its own result, in order"""
+
+        message = encode_order(ORDER)
+        batch = [
+            (message, SIGNATURE, ORDER["address"]),
+            (message, SIGNATURE, "0xf17f52151EbEF6C7334FAD080c5704D77216b732"),
+            (message, "0x" + "0" * 130, ORDER["address"]),
+        ] * 3
+        expected = [True, False, False] * 3
+
+        for workers in (0, 2):
+            verifier = SignatureVerifier(workers)
+            try:
+                self.assertListEqual(
+                    async_to_sync(verifier.averify)(batch),
+                    expected,
+                    f"the batch should be verified with {workers} workers",
+                )
+                self.assertListEqual(async_to_sync(verifier.averify)([]), [])
+            finally:
+                verifier.shutdown()
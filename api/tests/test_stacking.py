@@ -5,11 +5,19 @@ from decimal import Decimal
 from asgiref.sync import async_to_sync
 from django.urls import reverse
 from django.conf import settings
+from django.core.cache import cache
 from web3 import Web3
 from rest_framework import exceptions, serializers
 from rest_framework.test import APITestCase
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
-from api.models.stacking import Stacking, StackingFees, StackingFeesWithdrawal
+from api.models.stacking import (
+    Stacking,
+    StackingFees,
+    StackingFeesWithdrawal,
+    StackingReward,
+)
+from api.stacking_series import rebuild
+from api import rewards
 from rest_framework.serializers import BooleanField
 from api.models.types import Address
 from api.models import User
@@ -1022,6 +1030,7 @@ class StackingFeesRetrievalTestCase(APITestCase):
     """Class used to test the retrieval of stacking fees behaviour"""
 
     def setUp(self):
+        cache.clear()
         self.address_1 = Address("0x4BBeEB066eD09B7AEd07bF39EEe0460DFa261520")
         self.address_2 = Address("0xC02aaA39b223fe8D0A0e5C4F27eAD9083C756Cc2")
         self.chain_id = 31337
@@ -1110,6 +1119,7 @@ class StackingFeesRetrievalTestCase(APITestCase):
     def test_stacking_fees_retrieval_works_with_cache(self):
         """Checks stacking fees caching works"""
 
+        self.client.get(reverse("api:stacking-fees"), {"chain_id": self.chain_id})
         StackingFees.objects.create(
             amount=Decimal("21e18"),
             slot=210,
@@ -1169,6 +1179,45 @@ class StackingFeesRetrievalTestCase(APITestCase):
             "The stacking fees entries should match the one cached",
         )
 
+    def test_stacking_fees_retrieval_invalidated_by_new_entries(self):
+        """Checks the cached stacking fees are invalidated by the watch tower entries"""
+
+        self.client.get(reverse("api:stacking-fees"), {"chain_id": self.chain_id})
+
+        data = {
+            "token": self.address_1,
+            "amount": "{0:f}".format(Decimal("2e18")),
+            "slot": "21",
+            "chain_id": str(self.chain_id),
+            "timestamp": str(int(time()) * 1000),
+        }
+        data["signature"] = hmac.new(
+            key=settings.WATCH_TOWER_KEY.encode(),
+            msg=dumps(data).encode(),
+            digestmod="sha256",
+        ).hexdigest()
+        response = self.client.post(reverse("api:stacking-fees"), data=data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        response = self.client.get(
+            reverse("api:stacking-fees"), {"chain_id": self.chain_id}
+        )
+        self.assertIn(
+            {
+                "token": self.address_1,
+                "amount": "{0:f}".format(Decimal("23e18")),
+                "slot": 21,
+                "chain_id": self.chain_id,
+            },
+            response.json(),
+            "The new stacking fees should be returned",
+        )
+
+        response = self.client.get(
+            reverse("api:stacking-fees"), {"chain_id": self.chain_id + 1}
+        )
+        self.assertListEqual(response.json(), [], "The other chains are unaffected")
+
     def test_stacking_fees_retrieval_fails_without_chain_id(self):
         """Checks the request to get the stacking fees needs the chain_id parameter"""
 
@@ -1603,6 +1652,7 @@ class GlobalStackingRetrievalTestCase(APITestCase):
     """Test case used to retrieve the aggregation of all the stacking entries for the users"""
 
     def setUp(self) -> None:
+        cache.clear()
         self.chain_id = 31337
         self.user = async_to_sync(User.objects.create_user)(
             address=Address("0xC5fdF4076b8F3A5357c5E395ab970B5B54098Fef")
@@ -1634,6 +1684,7 @@ class GlobalStackingRetrievalTestCase(APITestCase):
         self.stacking_3_2 = Stacking.objects.create(
             amount=Decimal("29e18"), slot=21, user=self.user_2, chain_id=self.chain_id
         )
+        rebuild(self.chain_id)
 
     def test_global_stacking_retrieval_works(self):
         """Checks the global stacking retrieval works properly"""
@@ -1665,38 +1716,67 @@ class GlobalStackingRetrievalTestCase(APITestCase):
             ],
         )
 
-    def test_global_stacking_retrieval_works_with_cache(self):
-        """Checks the caching mecanism for the staking retrieval works"""
-
-        stacking = Stacking.objects.create(
-            amount=-Decimal("218e18"), slot=28, user=self.user, chain_id=self.chain_id
-        )
+    def test_global_stacking_retrieval_works_after_new_entries(self):
+        """Checks the new stacking entries are reflected by the global stacking"""
+
+        for slot, amount, withdraw in [(28, "5e18", 1), (21, "2e18", 0)]:
+            data = {
+                "address": self.user_2.address,
+                "amount": "{0:f}".format(Decimal(amount)),
+                "slot": str(slot),
+                "withdraw": str(withdraw),
+                "chain_id": str(self.chain_id),
+                "timestamp": str(int(time()) * 1000),
+            }
+            data["signature"] = hmac.new(
+                key=settings.WATCH_TOWER_KEY.encode(),
+                msg=dumps(data).encode(),
+                digestmod="sha256",
+            ).hexdigest()
+            data["withdraw"] = withdraw  # type: ignore
+            response = self.client.post(reverse("api:stacking"), data=data)
+            self.assertEqual(response.status_code, HTTP_200_OK)
 
         response = self.client.get(
             reverse("api:global-stacking"), {"chain_id": self.chain_id}
         )
-        data = response.json()
-
         self.assertEqual(
             response.status_code, HTTP_200_OK, "The response should be successfull"
         )
+        self.assertListEqual(
+            response.json(),
+            [
+                [12, Decimal("147e17")],
+                [21, Decimal("10e18")],
+                [23, -Decimal("23e18")],
+                [28, -Decimal("5e18")],
+            ],
+            "The global stacking should include the new entries",
+        )
 
+        response = self.client.get(
+            reverse("api:global-stacking"),
+            {"chain_id": self.chain_id, "cumulative": "1"},
+        )
         self.assertListEqual(
-            data,
+            response.json(),
             [
-                [
-                    self.stacking_2_1.slot,
-                    self.stacking_2_1.amount + self.stacking_2_2.amount,
-                ],
-                [
-                    self.stacking_3_1.slot,
-                    self.stacking_3_1.amount + self.stacking_3_2.amount,
-                ],
-                [
-                    self.stacking_1_1.slot,
-                    self.stacking_1_1.amount + self.stacking_1_2.amount,
-                ],
+                [12, Decimal("147e17")],
+                [21, Decimal("247e17")],
+                [23, Decimal("17e17")],
+                [28, -Decimal("33e17")],
             ],
+            "The running totals should include the new entries",
+        )
+
+        rebuild(self.chain_id)
+        self.assertListEqual(
+            self.client.get(
+                reverse("api:global-stacking"),
+                {"chain_id": self.chain_id, "cumulative": "1"},
+            ).json(),
+            response.json(),
+            "The incremental series should match the rebuilt one",
         )
 
     def test_global_stacking_retrieval_fails_without_chain_id(self):
@@ -1716,3 +1796,244 @@ class GlobalStackingRetrievalTestCase(APITestCase):
         )
 
         self.assertDictEqual(data, {"chain_id": errors.General.MISSING_FIELD})
+
+
+class StackingRewardsTestCase(APITestCase):
+    """Test case used to check the fees accrued by the stackers"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.chain_id = 31337
+        self.token = Address("0xC1FDf4076b8F3A5357c5E395ab970B5B54098Fef")
+        self.user = async_to_sync(User.objects.create_user)(
+            address=Address("0xC5fdF4076b8F3A5357c5E395ab970B5B54098Fef")
+        )
+        self.user_2 = async_to_sync(User.objects.create_user)(
+            address=Address("0xA5fdf4076b8F3A5357C5E395ab970B5B54098Fef")
+        )
+
+    def post(self, name: str, **data):
+        """Publishes an entry as the watch tower"""
+
+        data = {key: str(value) for key, value in data.items()}
+        data["chain_id"] = str(self.chain_id)
+        data["timestamp"] = str(int(time()) * 1000)
+        data["signature"] = hmac.new(
+            key=settings.WATCH_TOWER_KEY.encode(),
+            msg=dumps(data).encode(),
+            digestmod="sha256",
+        ).hexdigest()
+        if "withdraw" in data:
+            data["withdraw"] = int(data["withdraw"])  # type: ignore
+        response = self.client.post(reverse(f"api:{name}"), data=data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def stake(self, user, slot: int, amount: str):
+        self.post(
+            "stacking", address=user.address, amount=amount, slot=slot, withdraw=0
+        )
+
+    def rewards(self) -> list:
+        return list(
+            StackingReward.objects.filter(chain_id=self.chain_id)
+            .order_by("user_id")
+            .values_list("user_id", "token", "accrued", "withdrawn")
+        )
+
+    def test_stacking_rewards_accrued_and_withdrawn(self):
+        """Checks the fees are shared pro rata of the stakes and withdrawn"""
+
+        self.stake(self.user, 10, "3000000000000000000")
+        self.stake(self.user_2, 10, "1000000000000000000")
+        self.post(
+            "stacking-fees", token=self.token, amount="4000000000000000000", slot=11
+        )
+        self.post(
+            "stacking-fees", token=self.token, amount="1000000000000000000", slot=11
+        )
+        self.post(
+            "fees-withdrawal", token=self.token, address=self.user.address, slot=11
+        )
+        self.post(
+            "stacking-fees", token=self.token, amount="2000000000000000000", slot=12
+        )
+
+        self.client.force_authenticate(user=self.user)  # type: ignore
+        response = self.client.get(
+            reverse("api:stacking-rewards"), {"chain_id": self.chain_id}
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertListEqual(
+            response.json(),
+            [
+                {
+                    "token": self.token,
+                    "accrued": "5250000000000000000",
+                    "withdrawn": "3750000000000000000",
+                    "claimable": "1500000000000000000",
+                }
+            ],
+            "The user should be able to claim its share of the fees since its withdrawal",
+        )
+
+        self.assertListEqual(
+            self.rewards(),
+            [
+                (self.user.id, self.token, Decimal("525e16"), Decimal("375e16")),
+                (self.user_2.id, self.token, Decimal("175e16"), Decimal("0")),
+            ],
+        )
+        accrued = self.rewards()
+        rewards.rebuild(self.chain_id)
+        self.assertListEqual(
+            self.rewards(), accrued, "The accrued fees should match the rebuilt ones"
+        )
+
+    def test_stacking_rewards_late_stacking_entry(self):
+        """Checks a stacking entry preceding accrued fees shares them again"""
+
+        self.stake(self.user, 10, "3000000000000000000")
+        self.post(
+            "stacking-fees", token=self.token, amount="2000000000000000000", slot=12
+        )
+        self.assertListEqual(
+            self.rewards(),
+            [(self.user.id, self.token, Decimal("2e18"), Decimal("0"))],
+        )
+
+        self.stake(self.user_2, 11, "3000000000000000000")
+        self.assertListEqual(
+            self.rewards(),
+            [
+                (self.user.id, self.token, Decimal("1e18"), Decimal("0")),
+                (self.user_2.id, self.token, Decimal("1e18"), Decimal("0")),
+            ],
+            "The fees following the late entry should be shared again",
+        )
+
+    def test_stacking_rewards_fail_if_anon(self):
+        """Checks the anonymous users cannot retrieve rewards"""
+
+        response = self.client.get(
+            reverse("api:stacking-rewards"), {"chain_id": self.chain_id}
+        )
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
+
+
+class StackingBatchTestCase(APITestCase):
+    """Test case used to check the batch publication of the stacking events"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.chain_id = 31337
+        self.token = Address("0xC1FDf4076b8F3A5357c5E395ab970B5B54098Fef")
+        self.address = Address("0xC5fdF4076b8F3A5357c5E395ab970B5B54098Fef")
+        self.address_2 = Address("0xA5fdf4076b8F3A5357C5E395ab970B5B54098Fef")
+
+    def post(self, events: list):
+        data = {"events": events, "timestamp": int(time()) * 1000}
+        data["signature"] = hmac.new(
+            key=settings.WATCH_TOWER_KEY.encode(),
+            msg=dumps(data).encode(),
+            digestmod="sha256",
+        ).hexdigest()
+        return self.client.post(reverse("api:stacking-batch"), data=data, format="json")
+
+    def test_stacking_batch_works(self):
+        """Checks the events of a batch are applied in order"""
+
+        stake = {"type": "stacking", "slot": 10, "chain_id": self.chain_id}
+        fees = {"type": "fees", "token": self.token, "chain_id": self.chain_id}
+        response = self.post(
+            [
+                {**stake, "address": self.address, "amount": "3e18", "withdraw": 0},
+                {**stake, "address": self.address_2, "amount": "1e18", "withdraw": 0},
+                {**fees, "amount": "4000000000000000000", "slot": 11},
+                {**fees, "amount": "1000000000000000000", "slot": 11},
+                {
+                    "type": "withdrawal",
+                    "token": self.token,
+                    "address": self.address,
+                    "slot": 11,
+                    "chain_id": self.chain_id,
+                },
+                {
+                    **stake,
+                    "address": self.address_2,
+                    "amount": "1e18",
+                    "withdraw": 1,
+                    "slot": 11,
+                },
+            ]
+        )
+
+        self.assertEqual(response.status_code, HTTP_200_OK, response.json())
+        self.assertDictEqual(
+            {
+                (address, slot): amount
+                for address, slot, amount in Stacking.objects.values_list(
+                    "user__address", "slot", "amount"
+                )
+            },
+            {
+                (self.address, 10): Decimal("3e18"),
+                (self.address_2, 10): Decimal("1e18"),
+                (self.address_2, 11): -Decimal("1e18"),
+            },
+        )
+        self.assertEqual(
+            StackingFees.objects.get(token=self.token, slot=11).amount,
+            Decimal("5e18"),
+        )
+        self.assertDictEqual(
+            {
+                address: (accrued, withdrawn)
+                for address, accrued, withdrawn in StackingReward.objects.values_list(
+                    "user__address", "accrued", "withdrawn"
+                )
+            },
+            {
+                self.address: (Decimal("375e16"), Decimal("375e16")),
+                self.address_2: (Decimal("125e16"), Decimal("0")),
+            },
+        )
+
+    def test_stacking_batch_fails_with_wrong_events(self):
+        """Checks no event of a batch with a wrong one is applied"""
+
+        response = self.post(
+            [
+                {
+                    "type": "stacking",
+                    "address": self.address,
+                    "amount": "3e18",
+                    "withdraw": 0,
+                    "slot": 10,
+                    "chain_id": self.chain_id,
+                },
+                {"type": "unknown"},
+                {"type": "fees", "token": self.token, "slot": 11},
+            ]
+        )
+
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(
+            response.json(),
+            {
+                "events": [
+                    {},
+                    {"type": [errors.Stacking.WRONG_EVENT_TYPE]},
+                    {"chain_id": [errors.General.MISSING_FIELD]},
+                ]
+            },
+        )
+        self.assertFalse(Stacking.objects.exists(), "No event should be applied")
+
+    def test_stacking_batch_fails_without_events(self):
+        """Checks a batch needs a non empty list of events"""
+
+        response = self.post([])
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(
+            response.json(), {"events": [errors.Stacking.BATCH_FORMAT_ERROR]}
+        )
@@ -1,4 +1,6 @@
+from time import time
 from asgiref.sync import async_to_sync
+from eth_account import Account, messages
 from django.urls import reverse
 from unittest.mock import patch
 from django.conf import settings
@@ -759,3 +761,89 @@ class UserLogInTestCase(APITestCase):
         self.assertDictEqual(
             response.json(), {"signature": [errors.Signature.SIGNATURE_MISMATCH_ERROR]}
         )
+
+
+class UserTokenTestCase(APITestCase):
+    """Test case for the api tokens issuance and authentication"""
+
+    # the second hardhat development account
+    private_key = "0x59c6995e998f97a5a0044966f0945389dc9e86dae88c7a8412f4603b6b78690d"
+    address = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+
+    def get_token(self) -> str:
+        timestamp = int(time())
+        message = settings.API_TOKEN_MESSAGE.format(
+            address=self.address, timestamp=timestamp
+        )
+        signature = (
+            "0x"
+            + bytes(
+                Account.sign_message(
+                    messages.encode_defunct(message.encode()),
+                    private_key=self.private_key,
+                ).signature
+            ).hex()
+        )
+        response = self.client.post(
+            reverse("api:token"),
+            data={
+                "address": self.address,
+                "timestamp": timestamp,
+                "signature": signature,
+            },
+        )
+        self.assertEqual(
+            response.status_code, HTTP_200_OK, "The token should be issued"
+        )
+        self.assertGreater(response.json()["expiry"], timestamp)
+        return response.json()["token"]
+
+    def test_token_authentication_works(self):
+        """Requests with a token should be authenticated without signature check"""
+
+        token = self.get_token()
+        user = User.objects.get(address=self.address)
+
+        # the makers and the bots of the user, the user itself is not fetched
+        with patch(
+            "api.utils.validate_eth_signed_message", side_effect=AssertionError
+        ), self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("api:order"),
+                data={"chain_id": 31337, "all": 1, "limit": 10},
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertDictEqual(response.json(), {"results": [], "next": None})
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(user.address, self.address)
+
+    def test_forged_or_expired_token_fails(self):
+        """Tampered, malformed and expired tokens should be rejected"""
+
+        token = self.get_token()
+        payload, mac = token.split(".")
+        for forged in [
+            f"{payload}.{mac[:-1]}0" if mac[-1] != "0" else f"{payload}.{mac[:-1]}1",
+            "not a token",
+            payload,
+            # a non-ASCII mac, the headers are read as latin-1 bytes
+            f"{payload}.{mac[:-1]}" + "\u00e9".encode().decode("latin-1"),
+        ]:
+            response = self.client.get(
+                reverse("api:order"),
+                data={"chain_id": 31337, "all": 1},
+                HTTP_AUTHORIZATION=f"Bearer {forged}",
+            )
+            self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
+            self.assertDictEqual(response.json(), {"detail": errors.User.INVALID_TOKEN})
+
+        with patch(
+            "api.tokens.time", return_value=time() + 2 * settings.API_TOKEN_LIFETIME
+        ):
+            response = self.client.get(
+                reverse("api:order"),
+                data={"chain_id": 31337, "all": 1},
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
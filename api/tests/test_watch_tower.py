@@ -4,11 +4,16 @@ from datetime import datetime
 from decimal import Decimal
 from web3 import Web3
 from django.urls import reverse
+from django.core.cache import cache
 from rest_framework.test import APITestCase
-from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from rest_framework.status import HTTP_200_OK, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST
 from api.models import User
 import api.errors as errors
-from api.models.orders import Maker, Bot, Taker
+from api.models.orders import Maker, Bot, Taker, BlockCommit, QueuedCommit
+from api.ladders import materialize_level
+from api.messages import WStypes
+from api.order_book import order_book, book_key
+from api.views.watch_tower import WatchTowerView, drain_commits
 from api.models.types import Address
 
 
@@ -17,6 +22,7 @@ class MakerCommitTestCase(APITestCase):
 
     def setUp(self):
         """Create maker orders to match orders againts"""
+        cache.clear()
         self.user = async_to_sync(User.objects.create_user)(
             address=Address("0xf17f52151EbEF6C7334FAD080c5704D77216b732")
         )
@@ -138,6 +144,80 @@ class MakerCommitTestCase(APITestCase):
             "the user address of the taker object should match the one sent",
         )
 
+    def test_retried_matching_is_not_applied_twice(self):
+        """Checks a retried commit of the watch tower is only applied once"""
+
+        taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        block = 12
+        trades = {
+            self.data["order_hash"]: {
+                "amount": "{0:f}".format(Decimal("73e16")),
+                "base_fees": True,
+                "fees": "{0:f}".format(Decimal("365e15")),
+                "is_buyer": True,
+            }
+        }
+
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            for clear in [False, False, True]:
+                if clear:
+                    cache.clear()
+                response = self.client.post(
+                    reverse("api:wt"),
+                    format="json",
+                    data={
+                        "taker": taker_address,
+                        "block": block,
+                        "trades": trades,
+                    },
+                )
+                self.assertEqual(
+                    response.status_code, HTTP_200_OK, "the retries should succeed"
+                )
+                self.assertDictEqual(response.json(), {})
+
+        maker = Maker.objects.get(order_hash=self.data["order_hash"])
+        self.assertEqual(
+            maker.filled,
+            Decimal(trades[self.data["order_hash"]]["amount"]),
+            "The filled amount should only be increased once",
+        )
+        self.assertEqual(Taker.objects.count(), 1, "only one taker should be stored")
+
+    def test_matching_of_another_block_is_applied(self):
+        """Checks the same trades committed on another block are applied"""
+
+        taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        trades = {
+            self.data["order_hash"]: {
+                "amount": "{0:f}".format(Decimal("73e16")),
+                "base_fees": True,
+                "fees": "{0:f}".format(Decimal("365e15")),
+                "is_buyer": True,
+            }
+        }
+
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            for block in [12, 13]:
+                response = self.client.post(
+                    reverse("api:wt"),
+                    format="json",
+                    data={
+                        "taker": taker_address,
+                        "block": block,
+                        "trades": trades,
+                    },
+                )
+                self.assertEqual(response.status_code, HTTP_200_OK)
+
+        maker = Maker.objects.get(order_hash=self.data["order_hash"])
+        self.assertEqual(
+            maker.filled,
+            Decimal(trades[self.data["order_hash"]]["amount"]) * 2,
+            "The filled amount should be increased by both commits",
+        )
+        self.assertEqual(Taker.objects.count(), 2, "both takers should be stored")
+
     def test_user_creation_on_matching_works(self):
         """Checks a taker trade creation also creates a user if the user
         does not already exist
@@ -513,12 +593,8 @@ class MakerCommitTestCase(APITestCase):
         )
 
         taker_address = Address("0xf17f52151EbEF6C7334FAD080c5704D77216b733")
-        buy_maker = Maker.objects.select_related("bot").get(
-            price=Decimal("9e17"), bot__isnull=False
-        )
-        sell_maker = Maker.objects.select_related("bot").get(
-            price=Decimal("11e17"), bot__isnull=False
-        )
+        buy_maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
+        sell_maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         block = 19
         chain_id = 31337
 
@@ -799,6 +875,40 @@ class MakerCommitTestCase(APITestCase):
 
         self.assertEqual(response.json(), {"error": [errors.Order.TRADE_DATA_ERROR]})
 
+    def test_matching_with_missing_trade_keys_fails(self):
+        """Checks a trade missing one of its fields is rejected"""
+
+        taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        trade = {
+            "amount": "{0:f}".format(Decimal("73e16")),
+            "base_fees": True,
+            "fees": "{0:f}".format(Decimal("365e15")),
+            "is_buyer": True,
+        }
+
+        for key in trade:
+            trades = {
+                self.data["order_hash"]: {
+                    field: value for field, value in trade.items() if field != key
+                }
+            }
+            with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+                response = self.client.post(
+                    reverse("api:wt"),
+                    format="json",
+                    data={"taker": taker_address, "block": 12, "trades": trades},
+                )
+
+            self.assertEqual(
+                response.status_code,
+                HTTP_400_BAD_REQUEST,
+                f"the trade without {key} should be rejected",
+            )
+            self.assertEqual(
+                response.json(), {"error": [errors.Order.TRADE_DATA_ERROR]}
+            )
+        self.assertFalse(Taker.objects.exists(), "no taker should be created")
+
     def test_matching_without_maker_found_fails(self):
         """Checks trying to match without makers found fails"""
 
@@ -880,6 +990,12 @@ class MakerCancellationTestCase(APITestCase):
             maker_fees=Decimal("1"),
             upper_bound=Decimal("15"),
             lower_bound=Decimal("1"),
+            amount=self.data["amount"],
+            is_buyer=False,
+            expiry=datetime.fromtimestamp(self.data["expiry"]),
+            base_token=Address(self.data["base_token"]),
+            quote_token=Address(self.data["quote_token"]),
+            signature=self.data["signature"],
         )
 
     def test_maker_cancellation_works(self):
@@ -1079,10 +1195,64 @@ class MakerCancellationTestCase(APITestCase):
         )
 
 
+    def test_batch_cancellation_works(self):
+        """Checks makers and bots can be cancelled at once with one frame per pair"""
+
+        key = book_key(
+            self.data["chain_id"], self.data["base_token"], self.data["quote_token"]
+        )
+        sequence = order_book.get_sequence(key)
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            response = self.client.delete(
+                reverse("api:wt"),
+                format="json",
+                data={
+                    "orderHashes": [
+                        self.data["order_hash"],
+                        self.bot_hash,
+                        "0x" + "0" * 64,
+                    ]
+                },
+            )
+
+        self.assertEqual(
+            response.status_code, HTTP_200_OK, "The batch cancellation should work"
+        )
+        self.maker.refresh_from_db()
+        self.assertEqual(self.maker.status, Maker.CANCELLED)
+        self.assertFalse(Bot.objects.exists(), "The bot should be deleted")
+        self.assertListEqual(
+            order_book.deltas(key, sequence),  # type: ignore
+            [
+                {
+                    WStypes.DEL_MAKERS: [self.data["order_hash"]],
+                    WStypes.DEL_BOTS: [self.bot_hash],
+                    WStypes.SEQUENCE: sequence + 1,
+                }
+            ],
+        )
+
+    def test_batch_cancellation_with_wrong_hashes_fails(self):
+        """Checks the batch cancellation with malformed or unknown hashes fails"""
+
+        for order_hashes, error in [
+            ([], {"orderHashes": [errors.Order.ORDER_HASHES_FORMAT_ERROR]}),
+            ("0x1", {"orderHashes": [errors.Order.ORDER_HASHES_FORMAT_ERROR]}),
+            (["0x" + "0" * 64], {"order_hash": [errors.Order.NO_MAKER_FOUND]}),
+        ]:
+            with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+                response = self.client.delete(
+                    reverse("api:wt"), format="json", data={"orderHashes": order_hashes}
+                )
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+            self.assertDictEqual(response.json(), error)
+
+
 class MakerBotCommitTestCase(APITestCase):
     """Class used to check the behaviour of bot replacement orders"""
 
     def setUp(self):
+        cache.clear()
         self.user = async_to_sync(User.objects.create_user)(
             address=Address("0xf17f52151EbEF6C7334FAD080c5704D77216b732")
         )
@@ -1112,7 +1282,7 @@ class MakerBotCommitTestCase(APITestCase):
         block = 12
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         trades = {
             maker.order_hash: {
                 "amount": amount,
@@ -1183,7 +1353,7 @@ class MakerBotCommitTestCase(APITestCase):
         block = 12
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         maker.filled = amount
         maker.save(update_fields=["filled"])
 
@@ -1254,8 +1424,8 @@ class MakerBotCommitTestCase(APITestCase):
         taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
         block = 12
 
-        maker = Maker.objects.get(price=Decimal("11e17"))
-        maker2 = Maker.objects.get(price=Decimal("12e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
+        maker2 = materialize_level(Bot.objects.get(), Decimal("12e17"))
 
         trades = {
             maker.order_hash: {
@@ -1368,7 +1538,7 @@ class MakerBotCommitTestCase(APITestCase):
         taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
         block = 12
 
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         trades = {
             maker.order_hash: {
                 "amount": "{0:f}".format(Decimal("73e16")),
@@ -1437,7 +1607,7 @@ class MakerBotCommitTestCase(APITestCase):
         taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
         block = 12
 
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         trades = {
             maker.order_hash: {
                 "amount": "{0:f}".format(Decimal("73e16")),
@@ -1469,12 +1639,16 @@ class MakerBotCommitTestCase(APITestCase):
             {"error": [errors.Order.ORDER_POSITIVE_VIOLATION]},
             "with no previous trades an order violation should be raised",
         )
+        self.assertFalse(
+            Taker.objects.exists(), "the takers of the block should be rolled back"
+        )
 
 
 class MakerBotFeesTestCase(APITestCase):
     """Checks the maker fees for replacement orders are handled well"""
 
     def setUp(self):
+        cache.clear()
         self.user = async_to_sync(User.objects.create_user)(
             address=Address("0xf17f52151EbEF6C7334FAD080c5704D77216b732")
         )
@@ -1504,7 +1678,7 @@ class MakerBotFeesTestCase(APITestCase):
         block = 12
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         trades = {
             maker.order_hash: {
                 "amount": amount,
@@ -1551,7 +1725,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         maker.bot.maker_fees = Decimal("5e14")
         maker.bot.save(update_fields=["maker_fees"])
 
@@ -1596,7 +1770,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         maker.filled = Decimal(amount)
         maker.save(update_fields=["filled"])
 
@@ -1648,7 +1822,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("11e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("11e17"))
         maker.filled = Decimal(amount)
         maker.bot.maker_fees = Decimal("5e14")
         maker.bot.save(update_fields=["maker_fees"])
@@ -1695,7 +1869,7 @@ class MakerBotFeesTestCase(APITestCase):
         block = 12
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         trades = {
             maker.order_hash: {
                 "amount": amount,
@@ -1744,7 +1918,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         maker.bot.maker_fees = Decimal("77e14")
         maker.bot.save(update_fields=["maker_fees"])
 
@@ -1789,7 +1963,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         maker.filled = Decimal(amount)
         maker.save(update_fields=["filled"])
 
@@ -1841,7 +2015,7 @@ class MakerBotFeesTestCase(APITestCase):
         amount = "{0:f}".format(Decimal("73e16"))
         fees = "{0:f}".format(Decimal("365e15"))
 
-        maker = Maker.objects.get(price=Decimal("9e17"))
+        maker = materialize_level(Bot.objects.get(), Decimal("9e17"))
         maker.filled = Decimal(amount)
         maker.bot.maker_fees = Decimal("71e14")
         maker.bot.save(update_fields=["maker_fees"])
@@ -1879,6 +2053,57 @@ class MakerBotFeesTestCase(APITestCase):
             "The negative fees generated should be updated to the bot ",
         )
 
+    def test_several_levels_of_a_bot_fees(self):
+        """Checks the fees of several levels of a bot traded at once are all earned"""
+
+        taker_address = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        block = 12
+        amount = "{0:f}".format(Decimal("73e16"))
+        fees = "{0:f}".format(Decimal("365e15"))
+        bot = Bot.objects.get()
+        makers = [
+            materialize_level(bot, Decimal("11e17")),
+            materialize_level(bot, Decimal("12e17")),
+        ]
+        trades = {
+            maker.order_hash: {
+                "amount": amount,
+                "base_fees": True,
+                "fees": fees,
+                "is_buyer": True,
+            }
+            for maker in makers
+        }
+
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            response = self.client.post(
+                reverse("api:wt"),
+                format="json",
+                data={
+                    "taker": taker_address,
+                    "block": block,
+                    "trades": trades,
+                },
+            )
+        bot.refresh_from_db()
+        fees = sum(
+            (
+                (
+                    maker.price * (bot.maker_fees + Decimal("1000")) / Decimal("1000")
+                    - maker.price
+                )
+                * Decimal(amount)
+                / Decimal("1e18")
+            ).quantize(Decimal("1."))
+            for maker in makers
+        )
+
+        self.assertEqual(response.status_code, HTTP_200_OK, "The request should work")
+        self.assertEqual(
+            bot.fees_earned,
+            fees,
+            "The fees of both levels should be added to the bot",
+        )
 
 class OrderVerificationTestCase(APITestCase):
     """Class used to check the order verification works properly"""
@@ -2188,3 +2413,120 @@ class OrderVerificationTestCase(APITestCase):
             Maker.OPEN,
             "The maker should still be open if the request fails",
         )
+
+
+class WatchTowerQueueTestCase(APITestCase):
+    """Checks the queued commits of the watch tower are applied by block"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = async_to_sync(User.objects.create_user)(
+            address=Address("0xf17f52151EbEF6C7334FAD080c5704D77216b732")
+        )
+        self.maker = async_to_sync(Maker.objects.create)(
+            user=self.user,
+            chain_id=31337,
+            amount="{0:f}".format(Decimal("173e16")),
+            expiry=datetime.fromtimestamp(2114380800),
+            price="{0:f}".format(Decimal("2e20")),
+            base_token=Address("0x4bbeEB066eD09B7AEd07bF39EEe0460DFa261520"),
+            quote_token=Address("0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"),
+            signature="0xe4609ca8bec52beb499af0ac6e1934798c786b53e6f545f5af28f6117bb675a4500ebbfaa427533d8902e163767d14874ec1d67fcba8c42045ba96f482efc47d1b",
+            order_hash="0x44eba4e68fb71ce7c24129b2c31165df0a59f0802c90fa44040e7858e94c12e5",
+            is_buyer=False,
+        )
+        self.trade = {
+            "amount": "{0:f}".format(Decimal("73e16")),
+            "base_fees": True,
+            "fees": "{0:f}".format(Decimal("365e15")),
+            "is_buyer": True,
+        }
+
+    def queue(self, taker, trades, block=12):
+        with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
+            return self.client.post(
+                reverse("api:wt-queue"),
+                format="json",
+                data={"taker": taker, "block": block, "trades": trades},
+            )
+
+    def test_queued_commits_of_a_block_are_merged(self):
+        """Checks the commits of several takers on a block are applied at once"""
+
+        for taker in [
+            "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef",
+            "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+        ]:
+            response = self.queue(taker, {self.maker.order_hash: self.trade})
+            self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+
+        self.assertFalse(Taker.objects.exists(), "the commits should only be queued")
+        with patch(
+            "api.views.watch_tower.WatchTowerView.apply_trades",
+            side_effect=WatchTowerView.apply_trades,
+        ) as apply_trades:
+            self.assertEqual(async_to_sync(drain_commits)(), 2)
+        self.assertEqual(apply_trades.call_count, 1, "the block should be applied once")
+
+        self.maker.refresh_from_db()
+        self.assertEqual(self.maker.filled, Decimal("146e16"))
+        self.assertEqual(Taker.objects.count(), 2)
+        self.assertFalse(QueuedCommit.objects.exists(), "the queue should be drained")
+        self.assertEqual(BlockCommit.objects.count(), 2)
+
+    def test_failing_queued_commit_is_kept(self):
+        """Checks a failing commit does not prevent the others of its block"""
+
+        self.queue(
+            "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef",
+            {self.maker.order_hash: self.trade},
+        )
+        self.queue(
+            "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
+            {self.maker.order_hash: {**self.trade, "fees": "abc"}},
+        )
+        async_to_sync(drain_commits)()
+
+        self.maker.refresh_from_db()
+        self.assertEqual(self.maker.filled, Decimal("73e16"))
+        self.assertEqual(Taker.objects.count(), 1)
+        failed = QueuedCommit.objects.get()
+        self.assertEqual(failed.taker, "0x70997970C51812dc3A010C7d01b50e0d17dc79C8")
+        self.assertDictEqual(failed.error, {"error": [errors.Order.TRADE_DATA_ERROR]})
+
+    def test_retried_queued_commit_is_queued_once(self):
+        """Checks a retried commit is neither queued nor applied twice"""
+
+        taker = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        trades = {self.maker.order_hash: self.trade}
+        self.queue(taker, trades)
+        self.queue(taker, trades)
+        self.assertEqual(QueuedCommit.objects.count(), 1)
+
+        async_to_sync(drain_commits)()
+        response = self.queue(taker, trades)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertFalse(QueuedCommit.objects.exists())
+        self.assertEqual(Taker.objects.count(), 1)
+
+    def test_concurrently_applied_batch_caches_the_recorded_commits(self):
+        """Checks only the commits recorded by a concurrent request are cached"""
+
+        taker = "0xC5fdf4076b8F3A5357c5E395ab970B5B54098Fef"
+        trades = {self.maker.order_hash: self.trade}
+        BlockCommit.objects.create(digest="a" * 64, block=12, taker=taker)
+        view = WatchTowerView()
+        response = async_to_sync(view.commit)(
+            [
+                (BlockCommit(digest=digest, block=12, taker=taker), self.user, trades)
+                for digest in ["a" * 64, "b" * 64]
+            ]
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        self.assertTrue(async_to_sync(view.committed)("a" * 64))
+        self.assertFalse(
+            async_to_sync(view.committed)("b" * 64),
+            "the commit rejected with the batch should be retried",
+        )
+        self.assertFalse(Taker.objects.exists())
@@ -1,7 +1,7 @@
 import hmac
 from decimal import Decimal
-from asyncio import TimeoutError
-from asgiref.sync import async_to_sync
+from asyncio import Event, TimeoutError, sleep
+from asgiref.sync import async_to_sync, sync_to_async
 from datetime import datetime
 from unittest.mock import patch
 from json import loads, dumps
@@ -13,17 +13,25 @@ from rest_framework.test import APITestCase
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 from channels.testing import WebsocketCommunicator
 from django.conf import settings
+from django.core.cache import cache
 from backend.asgi import ws_asgi_app
+from api.consumers.websocket import MultiplexConsumer, WebsocketConsumer
 from api.messages import WStypes
 from api.models import User
 from api.models.orders import Maker, Bot
+from api.models.stacking import StackingFees
+from api.ladders import expand, materialize_level
 from api.models.types import Address
+from api.order_book import order_book, book_key, channel_layer
+from api.messages import frame
+import api.errors as errors
 
 
 class WebsocketFramesTestCase(APITestCase):
     """Class used to verify the frames sent by the websocket"""
 
     def setUp(self):
+        cache.clear()
         self.user = async_to_sync(User.objects.create_user)(
             address=Address("0x70997970C51812dc3A010C7d01b50e0d17dc79C8")
         )
@@ -115,7 +123,7 @@ class WebsocketFramesTestCase(APITestCase):
         message = await communicator.receive_from()
         self.assertDictEqual(
             loads(message),
-            {WStypes.NEW_MAKER: response.json()},
+            {WStypes.NEW_MAKER: response.json(), WStypes.SEQUENCE: 2},
             "The websocket message should contain the maker just created",
         )
 
@@ -194,10 +202,71 @@ class WebsocketFramesTestCase(APITestCase):
         message = await communicator.receive_from()
         self.assertDictEqual(
             loads(message),
-            {WStypes.NEW_BOT: response.json()},
+            {WStypes.NEW_BOT: response.json(), WStypes.SEQUENCE: 2},
             "The websocket message should contain the bot just created",
         )
 
+    async def test_websocket_replay_from_sequence(self):
+        """Checks the deltas following the sequence of a snapshot are replayed on connection"""
+
+        chain_id = 31337
+        base_token = self.bot["base_token"]
+        quote_token = self.bot["quote_token"]
+
+        response = await self.async_client.get(  # type: ignore
+            reverse("api:snapshot"),
+            data={
+                "chain_id": chain_id,
+                "base_token": base_token,
+                "quote_token": quote_token,
+            },
+        )
+        snapshot = response.json()
+        self.assertEqual(snapshot[WStypes.SEQUENCE], 1)
+        self.assertEqual(
+            len(snapshot["orders"]),
+            len(range(int(Decimal("5e17")), int(Decimal("15e17")) + 1, int(1e17))),
+            "The snapshot should contain the bot orders",
+        )
+
+        communicator = WebsocketCommunicator(
+            ws_asgi_app,
+            f"/ws/trade/{chain_id}/{base_token}/{quote_token}?sequence=0",
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        message = loads(await communicator.receive_from())
+        self.assertEqual(message[WStypes.SEQUENCE], 1)
+        self.assertEqual(
+            message[WStypes.NEW_BOT]["bot_hash"],
+            self.bot_instance.bot_hash,
+            "The missed bot creation should be replayed",
+        )
+
+        communicator = WebsocketCommunicator(
+            ws_asgi_app,
+            f"/ws/trade/{chain_id}/{base_token}/{quote_token}?sequence=1",
+        )
+        connected, _ = await communicator.connect()
+        with self.assertRaises(TimeoutError):
+            await communicator.receive_from()
+
+    async def test_websocket_replay_resync(self):
+        """Checks a resync frame is sent when the deltas are not buffered anymore"""
+
+        chain_id = 31337
+        communicator = WebsocketCommunicator(
+            ws_asgi_app,
+            f"/ws/trade/{chain_id}/{self.bot['base_token']}/{self.bot['quote_token']}?sequence=5",
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        self.assertDictEqual(
+            loads(await communicator.receive_from()), {WStypes.RESYNC: True}
+        )
+
     async def test_websocket_frame_stacking_deposit_creation(self):
         """Checks a websocket frame is sent on stacking deposit"""
 
@@ -311,6 +380,93 @@ class WebsocketFramesTestCase(APITestCase):
             "The websocket message should contain the stacking fees just created",
         )
 
+    async def test_websocket_frame_stacking_fees_update(self):
+        """Checks the stacking fees frame holds the total stored on update"""
+
+        chain_id = "31337"
+        communicator = WebsocketCommunicator(ws_asgi_app, f"/ws/stacking/{chain_id}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        token = Address("0xC5fdF4076b8F3A5357c5E395ab970B5B54098Fef")
+        await StackingFees.objects.acreate(
+            token=token, amount=Decimal("1e18"), slot=23, chain_id=int(chain_id)
+        )
+        data = {
+            "token": token,
+            "amount": "{0:f}".format(Decimal("173e16")),
+            "slot": "23",
+            "chain_id": chain_id,
+        }
+        data["timestamp"] = str(int(time()) * 1000)
+        data["signature"] = hmac.new(
+            key=settings.WATCH_TOWER_KEY.encode(),
+            msg=dumps(data).encode(),
+            digestmod="sha256",
+        ).hexdigest()
+
+        await self.async_client.post(reverse("api:stacking-fees"), data=data)  # type: ignore
+        message = loads(await communicator.receive_from())
+
+        self.assertEqual(
+            message[WStypes.NEW_FEES]["amount"],
+            "{0:f}".format(Decimal("273e16")),
+            "The websocket message should contain the total of the stacking fees",
+        )
+
+    async def test_websocket_frame_stacking_batch(self):
+        """Checks a stacking batch is broadcast as one message per chain"""
+
+        communicators = {}
+        for chain_id in ["31337", "31338"]:
+            communicators[chain_id] = WebsocketCommunicator(
+                ws_asgi_app, f"/ws/stacking/{chain_id}"
+            )
+            connected, _ = await communicators[chain_id].connect()
+            self.assertTrue(connected, "The websocket should be connected")
+
+        token = Address("0xC5fdF4076b8F3A5357c5E395ab970B5B54098Fef")
+        fees = {"type": "fees", "token": token, "slot": 23, "amount": "1000"}
+        data = {
+            "events": [
+                {**fees, "chain_id": 31337},
+                {**fees, "chain_id": 31338},
+                {**fees, "chain_id": 31337},
+            ],
+            "timestamp": int(time()) * 1000,
+        }
+        data["signature"] = hmac.new(
+            key=settings.WATCH_TOWER_KEY.encode(),
+            msg=dumps(data).encode(),
+            digestmod="sha256",
+        ).hexdigest()
+
+        response = await self.async_client.post(  # type: ignore
+            reverse("api:stacking-batch"), data=data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        message = {"token": token, "slot": 23, "chain_id": 31337}
+        self.assertDictEqual(
+            loads(await communicators["31337"].receive_from()),
+            {
+                WStypes.STACKING_EVENTS: [
+                    {WStypes.NEW_FEES: {**message, "amount": "1000"}},
+                    {WStypes.NEW_FEES: {**message, "amount": "2000"}},
+                ]
+            },
+            "The events of a chain should be sent in a single message",
+        )
+        self.assertDictEqual(
+            loads(await communicators["31338"].receive_from()),
+            {
+                WStypes.STACKING_EVENTS: [
+                    {WStypes.NEW_FEES: {**message, "chain_id": 31338, "amount": "1000"}}
+                ]
+            },
+        )
+        self.assertTrue(await communicators["31337"].receive_nothing())
+
     async def test_websocket_frame_stacking_fees_withdrawal_creation(self):
         """Checks a websocket frame is sent on stacking fees withdrawal creation"""
 
@@ -373,7 +529,7 @@ class WebsocketFramesTestCase(APITestCase):
         message = await communicator.receive_from()
         self.assertDictEqual(
             loads(message),
-            {WStypes.DEL_MAKERS: [self.data.get("order_hash")]},
+            {WStypes.DEL_MAKERS: [self.data.get("order_hash")], WStypes.SEQUENCE: 1},
             "The websocket message should contain the deleted order hash",
         )
 
@@ -403,15 +559,301 @@ class WebsocketFramesTestCase(APITestCase):
         message = await communicator.receive_from()
         self.assertDictEqual(
             loads(message),
-            {WStypes.DEL_BOTS: [bot.bot_hash]},
+            {WStypes.DEL_BOTS: [bot.bot_hash], WStypes.SEQUENCE: 1},
             "The websocket message should contain the deleted order hash",
         )
 
+    async def test_websocket_frames_coalescing(self):
+        """Checks the deltas broadcast during the coalescing window are merged"""
+
+        chain_id = 31337
+        key = book_key(chain_id, self.data["base_token"], self.data["quote_token"])
+        communicator = WebsocketCommunicator(
+            ws_asgi_app,
+            f"ws/trade/{chain_id}/{self.data['base_token']}/{self.data['quote_token']}",
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        await order_book.abroadcast(key, {WStypes.DEL_MAKERS: ["0xhash1"]})
+        await order_book.abroadcast(key, {WStypes.DEL_BOTS: ["0xbot1"]})
+        await order_book.abroadcast(key, {WStypes.DEL_MAKERS: ["0xhash2"]})
+        await order_book.abroadcast(key, {WStypes.NEW_BOT: {"bot_hash": "0xbot2"}})
+        await order_book.abroadcast(key, {WStypes.NEW_BOT: {"bot_hash": "0xbot3"}})
+
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {
+                WStypes.DEL_MAKERS: ["0xhash1", "0xhash2"],
+                WStypes.DEL_BOTS: ["0xbot1"],
+                WStypes.NEW_BOT: {"bot_hash": "0xbot2"},
+                WStypes.SEQUENCE: 1,
+            },
+            "The deltas of the window should be merged into one message",
+        )
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {WStypes.NEW_BOT: {"bot_hash": "0xbot3"}, WStypes.SEQUENCE: 2},
+            "A second bot creation should be sent in its own message",
+        )
+        with self.assertRaises(TimeoutError):
+            await communicator.receive_from(timeout=0.1)
+
+    async def test_websocket_frames_coalescing_keeps_the_order_of_an_order(self):
+        """Checks a delta on an order of the pending message is sent after it"""
+
+        chain_id = 31337
+        key = book_key(chain_id, self.data["base_token"], self.data["quote_token"])
+        communicator = WebsocketCommunicator(
+            ws_asgi_app,
+            f"ws/trade/{chain_id}/{self.data['base_token']}/{self.data['quote_token']}",
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        await order_book.abroadcast(
+            key, {WStypes.NEW_MAKERS: [{"order_hash": "0xhash1"}]}
+        )
+        await order_book.abroadcast(key, {WStypes.DEL_MAKERS: ["0xhash2"]})
+        await order_book.abroadcast(key, {WStypes.DEL_MAKERS: ["0xhash1"]})
+
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {
+                WStypes.NEW_MAKERS: [{"order_hash": "0xhash1"}],
+                WStypes.DEL_MAKERS: ["0xhash2"],
+                WStypes.SEQUENCE: 1,
+            },
+            "The deltas on different orders should be merged",
+        )
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {WStypes.DEL_MAKERS: ["0xhash1"], WStypes.SEQUENCE: 2},
+            "The deletion of the created order should be sent after its creation",
+        )
+
+    async def test_websocket_frames_encoded_once(self):
+        """Checks the frames are encoded by their publisher and not by each consumer"""
+
+        chain_id = 31337
+        key = book_key(chain_id, self.data["base_token"], self.data["quote_token"])
+        communicators = [
+            WebsocketCommunicator(
+                ws_asgi_app,
+                f"ws/trade/{chain_id}/{self.data['base_token']}/{self.data['quote_token']}",
+            )
+            for _ in range(2)
+        ]
+        for communicator in communicators:
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected, "The websocket should be connected")
+
+        with patch(
+            "channels.generic.websocket.AsyncJsonWebsocketConsumer.encode_json"
+        ) as encode_json:
+            await order_book.asend(key, {WStypes.DEL_MAKERS: ["0xhash1"]})
+            messages = [
+                await communicator.receive_from() for communicator in communicators
+            ]
+
+        encode_json.assert_not_called()
+        self.assertEqual(messages[0], messages[1])
+        self.assertDictEqual(
+            loads(messages[0]), {WStypes.DEL_MAKERS: ["0xhash1"], WStypes.SEQUENCE: 1}
+        )
+
+    async def test_websocket_slow_client_conflation(self):
+        """Checks the pending deltas of a slow client are conflated into a resync frame"""
+
+        chain_id = 31337
+        key = book_key(chain_id, self.data["base_token"], self.data["quote_token"])
+        released = Event()
+
+        async def send_frame(consumer, group, text):
+            await released.wait()
+            await consumer.send(text_data=text)
+
+        with self.settings(WEBSOCKET_QUEUE_SIZE=4), patch.object(
+            WebsocketConsumer, "send_frame", autospec=True, side_effect=send_frame
+        ):
+            communicator = WebsocketCommunicator(
+                ws_asgi_app,
+                f"ws/trade/{chain_id}/{self.data['base_token']}/{self.data['quote_token']}",
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected, "The websocket should be connected")
+
+            await order_book.asend(key, {WStypes.DEL_MAKERS: ["0xhash0"]})
+            await sleep(0.05)
+            for i in range(1, 6):
+                await order_book.asend(key, {WStypes.DEL_MAKERS: [f"0xhash{i}"]})
+            await sleep(0.05)
+            released.set()
+
+            messages = [loads(await communicator.receive_from()) for _ in range(3)]
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        self.assertListEqual(
+            messages,
+            [
+                {WStypes.DEL_MAKERS: ["0xhash0"], WStypes.SEQUENCE: 1},
+                {WStypes.RESYNC: True},
+                {WStypes.DEL_MAKERS: ["0xhash5"], WStypes.SEQUENCE: 6},
+            ],
+            "The deltas pending on a full queue should be replaced by a resync frame",
+        )
+
+    async def test_websocket_hopeless_client_closed(self):
+        """Checks a slow client whose frames can't be conflated is closed"""
+
+        async def send_frame(consumer, group, text):
+            await Event().wait()
+
+        with self.settings(WEBSOCKET_QUEUE_SIZE=2), patch.object(
+            MultiplexConsumer, "send_frame", autospec=True, side_effect=send_frame
+        ):
+            communicator = WebsocketCommunicator(ws_asgi_app, "ws")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected, "The websocket should be connected")
+            await communicator.send_json_to(
+                {"action": "subscribe", "channel": "stacking/31337"}
+            )
+            self.assertTrue(await communicator.receive_nothing())
+
+            for i in range(4):
+                await channel_layer.group_send(  # type: ignore
+                    "31337", frame("31337", {WStypes.NEW_STACKING: {"amount": str(i)}})
+                )
+            self.assertDictEqual(
+                await communicator.receive_output(),
+                {"type": "websocket.close", "code": MultiplexConsumer.RESYNC_CODE},
+            )
+
+    async def test_websocket_failing_client_closed(self):
+        """Checks a client whose frames cannot be sent is closed"""
+
+        chain_id = 31337
+        key = book_key(chain_id, self.data["base_token"], self.data["quote_token"])
+
+        with patch.object(
+            WebsocketConsumer, "send_frame", side_effect=ValueError("failing")
+        ), self.assertLogs("api.consumers.websocket", "ERROR"):
+            communicator = WebsocketCommunicator(
+                ws_asgi_app,
+                f"ws/trade/{chain_id}/{self.data['base_token']}/{self.data['quote_token']}",
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected, "The websocket should be connected")
+
+            await order_book.asend(key, {WStypes.DEL_MAKERS: ["0xhash1"]})
+            self.assertDictEqual(
+                await communicator.receive_output(),
+                {"type": "websocket.close", "code": WebsocketConsumer.ERROR_CODE},
+            )
+
+    async def test_websocket_multiplexed_subscriptions(self):
+        """Checks one connection receives the frames of all its channels, tagged"""
+
+        pair = f"trade/31337/{self.data['base_token']}/{self.data['quote_token']}"
+        communicator = WebsocketCommunicator(ws_asgi_app, "ws")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        await communicator.send_json_to({"action": "subscribe", "channel": pair})
+        await communicator.send_json_to(
+            {"action": "subscribe", "channel": "stacking/31337"}
+        )
+        self.assertTrue(await communicator.receive_nothing())
+
+        key = book_key(31337, self.data["base_token"], self.data["quote_token"])
+        await order_book.asend(key, {WStypes.DEL_MAKERS: ["0xhash1"]})
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {
+                "channel": pair,
+                "data": {WStypes.DEL_MAKERS: ["0xhash1"], WStypes.SEQUENCE: 1},
+            },
+            "The pair frames should be tagged with the pair channel",
+        )
+
+        await channel_layer.group_send(  # type: ignore
+            "31337", frame("31337", {WStypes.NEW_STACKING: {"amount": "1"}})
+        )
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {
+                "channel": "stacking/31337",
+                "data": {WStypes.NEW_STACKING: {"amount": "1"}},
+            },
+            "The stacking frames should be tagged with the stacking channel",
+        )
+
+        await communicator.send_json_to({"action": "unsubscribe", "channel": pair})
+        await communicator.send_json_to(
+            {"action": "subscribe", "channel": "stacking/31337", "sequence": 0}
+        )
+        await order_book.asend(key, {WStypes.DEL_MAKERS: ["0xhash2"]})
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to(
+            {"action": "subscribe", "channel": pair, "sequence": 1}
+        )
+        self.assertDictEqual(
+            loads(await communicator.receive_from()),
+            {
+                "channel": pair,
+                "data": {WStypes.DEL_MAKERS: ["0xhash2"], WStypes.SEQUENCE: 2},
+            },
+            "The missed deltas should be replayed on subscription",
+        )
+        await communicator.disconnect()
+
+    async def test_websocket_multiplexed_subscriptions_errors(self):
+        """Checks the wrong subscriptions and the subscriptions limit are reported"""
+
+        communicator = WebsocketCommunicator(ws_asgi_app, "ws")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, "The websocket should be connected on test startup")
+
+        await communicator.send_json_to({"action": "join", "channel": "stacking/1"})
+        self.assertDictEqual(
+            await communicator.receive_json_from(),
+            {"channel": "stacking/1", "error": [errors.Websocket.WRONG_ACTION]},
+        )
+
+        await communicator.send_json_to({"action": "subscribe", "channel": "orders/1"})
+        self.assertDictEqual(
+            await communicator.receive_json_from(),
+            {
+                "channel": "orders/1",
+                "error": [errors.Websocket.WRONG_CHANNEL.format("orders/1")],
+            },
+        )
+
+        with self.settings(WEBSOCKET_MAX_SUBSCRIPTIONS=1):
+            await communicator.send_json_to(
+                {"action": "subscribe", "channel": "stacking/1"}
+            )
+            await communicator.send_json_to(
+                {"action": "subscribe", "channel": "stacking/2"}
+            )
+            self.assertDictEqual(
+                await communicator.receive_json_from(),
+                {
+                    "channel": "stacking/2",
+                    "error": [errors.Websocket.SUBSCRIPTIONS_LIMIT.format(1)],
+                },
+            )
+        await communicator.disconnect()
+
     async def test_websocket_frame_maker_update(self):
         """Checks the websocket frame is sent well on order update"""
 
         taker_address = Address("0xf17f52151EbEF6C7334FAD080c5704D77216b733")
-        maker = await Maker.objects.select_related("bot").aget(price=Decimal("5e17"))
+        maker = await sync_to_async(materialize_level)(
+            self.bot_instance, Decimal("5e17")
+        )
         block = 19
         prev_fees = Decimal("100e18")
         chain_id = 31337
@@ -445,7 +887,9 @@ class WebsocketFramesTestCase(APITestCase):
             },
         }
 
-        maker = await Maker.objects.select_related("bot").aget(price=Decimal("5e17"))
+        maker = await sync_to_async(materialize_level)(
+            self.bot_instance, Decimal("5e17")
+        )
         with patch("api.views.watch_tower.WatchTowerView.permission_classes", []):
             response = await self.async_client.post(  # type: ignore
                 reverse("api:wt"),
@@ -573,6 +1017,8 @@ class WebsocketFramesTestCase(APITestCase):
             ],
         }
 
+        data[WStypes.SEQUENCE] = 1
+        bot_data[WStypes.SEQUENCE] = 2
         message = loads(message)
         bot_message = loads(bot_message)
 
@@ -612,11 +1058,11 @@ class WebsocketFramesTestCase(APITestCase):
         """Checks the websocket frame is sent well on order update"""
 
         taker_address = Address("0xf17f52151EbEF6C7334FAD080c5704D77216b733")
-        buy_maker = await Maker.objects.select_related("bot").aget(
-            price=Decimal("9e17")
+        buy_maker = await sync_to_async(materialize_level)(
+            self.bot_instance, Decimal("9e17")
         )
-        sell_maker = await Maker.objects.select_related("bot").aget(
-            price=Decimal("11e17")
+        sell_maker = await sync_to_async(materialize_level)(
+            self.bot_instance, Decimal("11e17")
         )
         block = 19
         chain_id = 31337
@@ -720,7 +1166,7 @@ class WebsocketFramesTestCase(APITestCase):
         message = await communicator.receive_from()
         self.assertDictEqual(
             loads(message),
-            {WStypes.DEL_MAKERS: [self.maker.order_hash]},
+            {WStypes.DEL_MAKERS: [self.maker.order_hash], WStypes.SEQUENCE: 1},
             "The websocket should sent the order as deleted",
         )
 
@@ -737,9 +1183,11 @@ class WebsocketFramesTestCase(APITestCase):
         base_token = Address(self.bot.get("base_token"))
         quote_token = Address(self.bot.get("quote_token"))
 
-        makers = []
-        async for maker in Maker.objects.filter(bot=self.bot_instance):
-            makers.append(maker)
+        makers = await sync_to_async(
+            lambda: expand(
+                Bot.objects.select_related("user").get(id=self.bot_instance.id)
+            )
+        )()
 
         communicator = WebsocketCommunicator(
             ws_asgi_app, f"/ws/trade/{chain_id}/{base_token}/{quote_token}"
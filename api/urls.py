@@ -2,26 +2,39 @@ from django.urls import path
 from api.views.orders import (
     BatchUserOrdersView,
     OrderView,
+    DepthView,
+    SnapshotView,
     MakerView,
+    BatchMakerView,
     BotView,
     TakerView,
 )
-from api.views.watch_tower import WatchTowerVerificationView, WatchTowerView
-from api.views.user import UserCreateView, UserLogInView
+from api.views.watch_tower import (
+    WatchTowerVerificationView,
+    WatchTowerView,
+    WatchTowerQueueView,
+)
+from api.views.user import UserCreateView, UserLogInView, UserTokenView
 from api.views.stacking import (
     StackingView,
     StackingFeesView,
     StackingFeesWithdrawalView,
     GlobalStackingView,
+    StackingRewardsView,
+    StackingBatchView,
 )
 
 app_name = "api"
 urlpatterns = [
     path("account", UserCreateView.as_view(), name="account"),
     path("login", UserLogInView.as_view(), name="login"),
+    path("token", UserTokenView.as_view(), name="token"),
     path("orders", OrderView.as_view(), name="orders"),
+    path("depth", DepthView.as_view(), name="depth"),
+    path("snapshot", SnapshotView.as_view(), name="snapshot"),
     path("batch-orders", BatchUserOrdersView.as_view(), name="batch-orders"),
     path("order", MakerView.as_view(), name="order"),
+    path("order-batch", BatchMakerView.as_view(), name="order-batch"),
     path("taker", TakerView.as_view(), name="taker"),
     path("stacking", StackingView.as_view(), name="stacking"),
     path("bot", BotView.as_view(), name="bot"),
@@ -30,6 +43,9 @@ urlpatterns = [
         "fees-withdrawal", StackingFeesWithdrawalView.as_view(), name="fees-withdrawal"
     ),
     path("global-stacking", GlobalStackingView.as_view(), name="global-stacking"),
+    path("stacking-rewards", StackingRewardsView.as_view(), name="stacking-rewards"),
+    path("stacking-batch", StackingBatchView.as_view(), name="stacking-batch"),
     path("wt", WatchTowerView.as_view(), name="wt"),
+    path("wt-queue", WatchTowerQueueView.as_view(), name="wt-queue"),
     path("wt-verification", WatchTowerVerificationView.as_view(), name="wt-verification"),
 ]
@@ -7,6 +7,7 @@ from rest_framework.validators import ValidationError
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.response import Response
 from web3 import Web3
+from eth_hash.auto import keccak
 from rest_framework.request import Request
 from eth_account import Account, messages
 import api.errors as errors
@@ -63,6 +64,19 @@ def validate_decimal_integer(value: str, name: str):
     return value
 
 
+def validate_positive_integer(value: str, name: str) -> int:
+    """Function used to validate the user supplied counts, like page sizes,
+    negative values pass `validate_decimal_integer` and are rejected here
+
+    Arguments: \n
+    `value:` the user supplied number
+    `name:` name of the field
+    """
+    if (integer := int(Decimal(validate_decimal_integer(value, name)))) < 0:
+        raise ValidationError(errors.Order.ORDER_POSITIVE_VIOLATION)
+    return integer
+
+
 def validate_address(value: str, name: str):
     """Function used to validate the user submitted address like
     field
@@ -161,17 +175,38 @@ def compute_order_hash(order: dict):
 
     encoded_order = encode_order(order)
     return encoded_order, (
-        Web3.to_hex(
-            Web3.solidity_keccak(
-                ["bytes", "uint256"],
-                [Web3.keccak(encoded_order), int(order.get("maker_price", ""))],
-            )
-        )
+        compute_level_hash(keccak(encoded_order), int(order.get("maker_price", "")))
         if order.get("replace_order")
         else str(Web3.to_hex(Web3.keccak(encoded_order)))
     )
 
 
+def compute_level_hash(prefix: bytes, maker_price: int) -> str:
+    """Function used to compute the order hash of one level of a replace order
+
+    Arguments :\n
+    `prefix`        -- the keccak of the encoded replace order, its bot hash\n
+    `maker_price`   -- the price of the level\n
+
+    The hash is the `solidity_keccak(["bytes", "uint256"], ...)` of both values
+    """
+
+    return "0x" + keccak(prefix + int(maker_price).to_bytes(32, "big")).hex()
+
+
+def compute_ladder_hashes(order: dict, prices) -> list:
+    """Function used to compute the order hashes of several levels of a replace
+    order, the order is encoded and hashed only once for all the levels
+
+    Arguments :\n
+    `order`     -- the replace order, as given to `compute_order_hash`\n
+    `prices`    -- the prices of the levels\n
+    """
+
+    prefix = keccak(encode_order(order))
+    return ["0x" + keccak(prefix + price.to_bytes(32, "big")).hex() for price in prices]
+
+
 def validate_chain_id(chain_id):
     """Function used to check the chain_id param,
     the param has to be present and has to be a number"""
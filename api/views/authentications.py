@@ -1,11 +1,23 @@
 from django.conf import settings
 from rest_framework import authentication
 from rest_framework import exceptions
+from api.models import User
+from api.tokens import read_token
 from api.utils import validate_user
+import api.errors as errors
 
 
 class ApiAuthentication(authentication.BaseAuthentication):
+    """Authenticates the api requests with a bearer token issued by the token
+    view, or with a signature of the request for the clients without token"""
+
+    keyword = "Bearer"
+
     def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if header and header[0].lower() == self.keyword.lower().encode():
+            return self.authenticate_token(header)
+
         if not request.query_params.get("signature", ""):
             return None
         success, result = validate_user(
@@ -18,3 +30,19 @@ class ApiAuthentication(authentication.BaseAuthentication):
             raise exceptions.AuthenticationFailed(result)
         result.__setattr__("is_authenticated",True) 
         return result, "awaitable"
+
+    def authenticate_token(self, header: list):
+        """Checks the token MAC, the user is built from the token without query"""
+
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed(errors.User.INVALID_TOKEN)
+        try:
+            bound = read_token(header[1].decode())
+        except UnicodeError:
+            bound = None
+        if bound is None:
+            raise exceptions.AuthenticationFailed(errors.User.INVALID_TOKEN)
+        user_id, address = bound
+        user = User(id=user_id, address=address)
+        user._state.adding = False
+        return user, "token"
@@ -1,4 +1,6 @@
 from asyncio import gather
+from functools import partial
+from datetime import datetime
 from decimal import Decimal
 from asgiref.sync import sync_to_async
 from adrf.views import APIView
@@ -11,7 +13,6 @@ from django.db.models import (
     Sum,
     When,
     Value,
-    ExpressionWrapper,
 )
 from django.db.utils import IntegrityError
 from rest_framework import status
@@ -26,12 +27,20 @@ from api.models.types import Address
 from api.models import User
 import api.errors as errors
 from api.serializers.orders import MakerSerializer, BotSerializer, TakerSerializer
-from api.utils import validate_chain_id
+from api.utils import validate_chain_id, validate_positive_integer
 from api.views.authentications import ApiAuthentication
 from api.messages import WStypes
-from channels.layers import get_channel_layer
+from api.order_book import order_book, book_key
+from api.ladders import amounts, untouched_levels
+from api.pagination import KeysetPagination
+from api.signatures import signature_verifier
 
-channel_layer = get_channel_layer()
+
+async def verify_signatures(signatures: list):
+    """Checks the signatures queued by the orders serializers into the process pool"""
+
+    if not all(await signature_verifier.averify(signatures)):
+        raise ValidationError({"error": [errors.Signature.SIGNATURE_MISMATCH_ERROR]})
 
 
 class OrderView(APIView):
@@ -58,25 +67,109 @@ class OrderView(APIView):
         except ValidationError as e:
             raise ValidationError({"quote_token": e.detail})
 
-        queryset = (
-            Maker.objects.filter(
-                base_token=base_token,
-                quote_token=quote_token,
-                chain_id=validate_chain_id(request.query_params.get("chain_id", None)),
+        chain_id = validate_chain_id(request.query_params.get("chain_id", None))
+        paginator = KeysetPagination(request, ("is_buyer", "price", "order_hash"))
+        if not paginator.enabled:
+            data = await order_book.aget(chain_id, base_token, quote_token)
+            return Response(data, status=status.HTTP_200_OK)
+
+        try:
+            orders = await order_book.apage(
+                chain_id, base_token, quote_token, paginator.after, paginator.limit + 1
             )
-            .select_related("user", "bot", "bot__user")
-            .prefetch_related("takers")
-            .annotate(
-                address=Case(
-                    When(user__isnull=False, then=F("user__address")),
-                    When(bot__isnull=False, then=F("bot__user__address")),
-                    output_field=CharField(),
-                ),
-                base_fees=Value("0"),
-                quote_fees=Value("0"),
+        except (TypeError, ValueError):
+            raise ValidationError({"cursor": [errors.Pagination.WRONG_CURSOR]})
+        data = paginator.paginate_list(
+            orders,
+            lambda order: [order["is_buyer"], order["price"], order["order_hash"]],
+        )
+        return Response(paginator.get_paginated_data(data), status=status.HTTP_200_OK)
+
+
+class SnapshotView(APIView):
+    """View used to retrieve an order book with the sequence of its last delta"""
+
+    async def get(self, request: Request):
+        """Function used to get the orders of a pair along with its sequence number,
+        the websocket deltas following this sequence can then be replayed"""
+
+        if (base_token := request.query_params.get("base_token", "0")) == "0" or (
+            quote_token := request.query_params.get("quote_token", "0")
+        ) == "0":
+            return Response(
+                {"detail": errors.Order.BASE_QUOTE_NEEDED},
+                status=status.HTTP_400_BAD_REQUEST,
             )
+
+        try:
+            base_token = Address(base_token, "base_token")
+        except ValidationError as e:
+            raise ValidationError({"base_token": e.detail})
+
+        try:
+            quote_token = Address(quote_token, "quote_token")
+        except ValidationError as e:
+            raise ValidationError({"quote_token": e.detail})
+
+        data = await order_book.asnapshot(
+            validate_chain_id(request.query_params.get("chain_id", None)),
+            base_token,
+            quote_token,
+        )
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class DepthView(APIView):
+    """View used to retrieve the aggregated price levels of an order book"""
+
+    DEFAULT_DEPTH = 50
+    MAX_DEPTH = 500
+
+    async def get(self, request: Request):
+        """Function used to get the best price levels of both sides of a pair
+
+        Arguments :\n
+        `depth` -- the number of levels returned per side\n
+        `tick`  -- optional price increment the levels are grouped by\n
+        """
+
+        if (base_token := request.query_params.get("base_token", "0")) == "0" or (
+            quote_token := request.query_params.get("quote_token", "0")
+        ) == "0":
+            return Response(
+                {"detail": errors.Order.BASE_QUOTE_NEEDED},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            base_token = Address(base_token, "base_token")
+        except ValidationError as e:
+            raise ValidationError({"base_token": e.detail})
+
+        try:
+            quote_token = Address(quote_token, "quote_token")
+        except ValidationError as e:
+            raise ValidationError({"quote_token": e.detail})
+
+        chain_id = validate_chain_id(request.query_params.get("chain_id", None))
+
+        try:
+            depth = validate_positive_integer(
+                request.query_params.get("depth", str(self.DEFAULT_DEPTH)), "depth"
+            )
+        except ValidationError as e:
+            raise ValidationError({"depth": e.detail})
+
+        try:
+            tick = validate_positive_integer(
+                request.query_params.get("tick", "1"), "tick"
+            )
+        except ValidationError as e:
+            raise ValidationError({"tick": e.detail})
+
+        data = await order_book.adepth(
+            chain_id, base_token, quote_token, min(depth, self.MAX_DEPTH), tick
         )
-        data = await sync_to_async(lambda: MakerSerializer(queryset, many=True).data)()
         return Response(data, status=status.HTTP_200_OK)
 
 
@@ -102,6 +195,7 @@ class MakerView(APIView):
 
         if request.query_params.get("all", None):
             queryset = Maker.objects.filter(chain_id=chain_id)
+            bots = Bot.objects.filter(chain_id=chain_id)
         else:
             if (base_token := request.query_params.get("base_token", "0")) == "0" or (
                 quote_token := request.query_params.get("quote_token", "0")
@@ -125,6 +219,11 @@ class MakerView(APIView):
                 quote_token=quote_token,
                 chain_id=chain_id,
             )
+            bots = Bot.objects.filter(
+                base_token=base_token,
+                quote_token=quote_token,
+                chain_id=chain_id,
+            )
 
         queryset = (
             queryset.filter(
@@ -155,14 +254,74 @@ class MakerView(APIView):
                 ),
             )
         )
-        data = await sync_to_async(lambda: MakerSerializer(queryset, many=True).data)()
-        return Response(data, status=status.HTTP_200_OK)
+        paginator = KeysetPagination(request, ("-timestamp", "-price", "-order_hash"))
+        data = await sync_to_async(self.list_makers)(
+            paginator,
+            queryset,
+            bots.filter(user=request.user)
+            .select_related("user")
+            .prefetch_related("orders"),
+        )
+        return Response(paginator.get_paginated_data(data), status=status.HTTP_200_OK)
+
+    @staticmethod
+    def list_makers(paginator: KeysetPagination, queryset, bots) -> list:
+        """Returns the serialized stored makers and untouched bot levels of the
+        requested page, or all of them when the pagination is disabled
+
+        Both are sorted by the paginator ordering, the untouched levels of a
+        bot share its timestamp and are generated from the cursor price"""
+
+        if not paginator.enabled:
+            makers = list(queryset)
+            for bot in bots:
+                makers += untouched_levels(bot)
+        else:
+            makers = paginator.following(queryset)
+            after = None
+            if paginator.after is not None:
+                try:
+                    after = (
+                        datetime.fromisoformat(paginator.after[0]),
+                        Decimal(paginator.after[1]),
+                        str(paginator.after[2]),
+                    )
+                except (TypeError, ValueError, ArithmeticError):
+                    raise ValidationError({"cursor": [errors.Pagination.WRONG_CURSOR]})
+
+            for bot in bots:
+                if after is None or bot.timestamp < after[0]:
+                    makers += untouched_levels(bot, limit=paginator.limit + 1)
+                elif bot.timestamp == after[0]:
+                    makers += [
+                        level
+                        for level in untouched_levels(
+                            bot, below=after[1] + 1, limit=paginator.limit + 2
+                        )
+                        if (level.price, level.order_hash) < after[1:]
+                    ]
+
+        makers.sort(
+            key=lambda maker: (maker.timestamp, maker.price, maker.order_hash),
+            reverse=True,
+        )
+        if paginator.enabled:
+            makers = paginator.paginate_list(
+                makers[: paginator.limit + 1], paginator.values
+            )
+        for maker in makers:
+            if maker.pk is None:
+                maker.address = maker.bot.user.address
+                maker.base_fees = Decimal("0")
+                maker.quote_fees = Decimal("0")
+        return MakerSerializer(makers, many=True).data
 
     async def post(self, request):
         """The method used to create a maker order"""
 
-        maker = MakerSerializer(data=request.data)
+        maker = MakerSerializer(data=request.data, context={"signatures": []})
         await sync_to_async(maker.is_valid)(raise_exception=True)
+        await verify_signatures(maker.context["signatures"])
         maker.save(filled=Decimal("0"))
 
         if maker.instance is not None:
@@ -174,14 +333,128 @@ class MakerView(APIView):
 
         data = await sync_to_async(lambda: maker.data)()
 
-        await channel_layer.group_send(  # type: ignore
-            f"{str(data['chain_id']).lower()}{str(data['base_token']).lower()}{data['quote_token'].lower()}",
-            {"type": "send.json", "data": {WStypes.NEW_MAKER: data}},
+        await order_book.abroadcast(
+            book_key(data["chain_id"], data["base_token"], data["quote_token"]),
+            {WStypes.NEW_MAKER: data},
         )
 
         return Response(data, status=status.HTTP_200_OK)
 
 
+def add_entries(book, entries: list):
+    """Adds the public representations of makers to a book"""
+
+    for entry in entries:
+        book.add(entry)
+
+
+class BatchMakerView(APIView):
+    """View used to create several maker orders at once"""
+
+    MAX_BATCH_SIZE = 500
+
+    async def post(self, request):
+        """Function used to create a batch of maker orders\n
+
+        The orders are validated one by one, the valid ones are created even
+        if some others are rejected. The response lists the created makers
+        and the errors of each submitted order, `{}` for the accepted ones:\n
+        ```python
+        request.data = {"orders": [{...maker order...}, ...]}
+        response.data = {"makers": [{...}, ...], "errors": [{}, {...}, ...]}
+        ```"""
+
+        if (
+            not isinstance(orders := request.data.get("orders", None), list)
+            or not orders
+        ):
+            return Response(
+                {"orders": [errors.Order.BATCH_FORMAT_ERROR]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(orders) > self.MAX_BATCH_SIZE:
+            return Response(
+                {"orders": [errors.Order.BATCH_SIZE_ERROR.format(self.MAX_BATCH_SIZE)]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        def validate():
+            serializers = []
+            for order in orders:
+                serializer = MakerSerializer(
+                    data=order, context={"batch": True, "signatures": []}
+                )
+                serializer.is_valid()
+                serializers.append(serializer)
+            return serializers
+
+        serializers = await sync_to_async(validate)()
+        valid = [serializer for serializer in serializers if not serializer.errors]
+        results = iter(
+            await signature_verifier.averify(
+                [serializer.context["signatures"][0] for serializer in valid]
+            )
+        )
+
+        batch_errors = [serializer.errors for serializer in serializers]
+        # the orders already stored are reported like the ones submitted twice
+        submitted = set(
+            await sync_to_async(list)(
+                Maker.objects.filter(
+                    order_hash__in=[
+                        serializer.validated_data["order_hash"] for serializer in valid
+                    ]
+                ).values_list("order_hash", flat=True)
+            )
+        )
+        validated_data = []
+        for index, serializer in enumerate(serializers):
+            if serializer.errors:
+                continue
+            if not next(results):
+                batch_errors[index] = {
+                    "error": [errors.Signature.SIGNATURE_MISMATCH_ERROR]
+                }
+            elif serializer.validated_data["order_hash"] in submitted:
+                batch_errors[index] = {"error": [errors.Order.BATCH_DUPLICATE_ORDER]}
+            else:
+                submitted.add(serializer.validated_data["order_hash"])
+                validated_data.append(serializer.validated_data)
+
+        try:
+            makers = (
+                await MakerSerializer(many=True).create(validated_data)
+                if validated_data
+                else []
+            )
+        except IntegrityError:
+            return Response(
+                {"error": [errors.Order.BATCH_DUPLICATE_ORDER]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        for maker in makers:
+            maker.address = maker.user.address  # type: ignore
+            maker.base_fees = Decimal("0")  # type: ignore
+            maker.quote_fees = Decimal("0")  # type: ignore
+        data = await sync_to_async(lambda: MakerSerializer(makers, many=True).data)()
+
+        pairs = {}
+        for maker in data:
+            key = book_key(maker["chain_id"], maker["base_token"], maker["quote_token"])
+            pairs.setdefault(key, []).append(maker)
+        for key, pair_makers in pairs.items():
+            await order_book.aapply(
+                key,
+                partial(add_entries, entries=[dict(maker) for maker in pair_makers]),
+            )
+            await order_book.abroadcast(key, {WStypes.NEW_MAKERS: pair_makers})
+
+        return Response(
+            {"makers": data, "errors": batch_errors}, status=status.HTTP_200_OK
+        )
+
+
 class TakerView(APIView):
     """View used to retrieve the logged in users taker orders"""
 
@@ -225,8 +498,13 @@ class TakerView(APIView):
                 "maker", "maker__bot"
             )
 
-        data = await sync_to_async(lambda: TakerSerializer(queryset, many=True).data)()
-        return Response(data, status=status.HTTP_200_OK)
+        paginator = KeysetPagination(request, ("-timestamp", "-id"))
+        data = await sync_to_async(
+            lambda: TakerSerializer(
+                paginator.paginate_queryset(queryset), many=True
+            ).data
+        )()
+        return Response(paginator.get_paginated_data(data), status=status.HTTP_200_OK)
 
 
 class BatchUserOrdersView(APIView):
@@ -282,38 +560,13 @@ class BotView(APIView):
             request.user = (await User.objects.aget_or_create(address=request.user))[0]
         chain_id = validate_chain_id(request.query_params.get("chain_id", None))
 
-        bots = (
+        bots = await sync_to_async(list)(
             Bot.objects.filter(user=request.user, chain_id=chain_id)
             .select_related("user")
             .prefetch_related("orders")
-            .annotate(
-                quote_token_amount=Sum(
-                    Case(
-                        When(
-                            orders__is_buyer=True,
-                            then=ExpressionWrapper(
-                                (F("orders__amount") - F("orders__filled"))
-                                * F("orders__price")
-                                / Decimal("1e18"),
-                                output_field=DecimalField(),
-                            ),
-                        ),
-                        default=0,
-                        output_field=DecimalField(),
-                    )
-                ),
-                base_token_amount=Sum(
-                    Case(
-                        When(
-                            orders__is_buyer=False,
-                            then=F("orders__amount") - F("orders__filled"),
-                        ),
-                    ),
-                    default=0,
-                    output_field=DecimalField(),
-                ),
-            )
         )
+        for bot in bots:
+            bot.base_token_amount, bot.quote_token_amount = amounts(bot)
 
         data = await sync_to_async(
             lambda: BotSerializer(bots, many=True, context={"bot": True}).data
@@ -323,8 +576,9 @@ class BotView(APIView):
     async def post(self, request):
         """View used to create a new bot"""
 
-        bot = BotSerializer(data=request.data, context={"bot": True})
+        bot = BotSerializer(data=request.data, context={"bot": True, "signatures": []})
         await sync_to_async(bot.is_valid)(raise_exception=True)
+        await verify_signatures(bot.context["signatures"])
         bot.save()
 
         try:
@@ -337,36 +591,33 @@ class BotView(APIView):
             )
 
         data = await sync_to_async(lambda: bot.data)()
+        await order_book.aadd_bots(
+            book_key(
+                data["chain_id"],
+                request.data["base_token"],
+                request.data["quote_token"],
+            ),
+            Bot.objects.filter(id=bot.instance.id),  # type: ignore
+        )
 
-        base_token_amount = Decimal("0")
-        quote_token_amount = Decimal("0")
-
-        for price in range(
-            int(request.data["lower_bound"]),
-            (int(request.data["upper_bound"])) + 1,
-            int(request.data["step"]),
-        ):
-            if price <= Decimal(request.data["price"]):
-                quote_token_amount += Decimal(
-                    int(request.data["amount"]) * price
-                ) / Decimal("1e18")
-            else:
-                base_token_amount += Decimal(request.data["amount"])
+        base_token_amount, quote_token_amount = await sync_to_async(amounts)(
+            bot.instance
+        )
         data.update(
             {
                 "signature": request.data["signature"],
-                "quote_token_amount": "{0:f}".format(
-                    quote_token_amount.quantize(Decimal("1."))
-                ),
-                "base_token_amount": "{0:f}".format(
-                    base_token_amount.quantize(Decimal("1."))
-                ),
+                "quote_token_amount": str(quote_token_amount),
+                "base_token_amount": str(base_token_amount),
             }
         )
 
-        await channel_layer.group_send(  # type: ignore
-            f"{str(data['chain_id']).lower()}{request.data['base_token'].lower()}{request.data['quote_token'].lower()}",
-            {"type": "send.json", "data": {WStypes.NEW_BOT: data}},
+        await order_book.abroadcast(
+            book_key(
+                data["chain_id"],
+                request.data["base_token"],
+                request.data["quote_token"],
+            ),
+            {WStypes.NEW_BOT: data},
         )
 
         return Response(data, status=status.HTTP_200_OK)
@@ -1,7 +1,5 @@
-from asgiref.sync import sync_to_async, async_to_sync
-from django.db.models import F, Sum
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.request import Request
@@ -10,17 +8,27 @@ from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 from adrf.views import APIView
 from api.models import User
-from api.models.stacking import Stacking, StackingFees, StackingFeesWithdrawal
+from api.models.stacking import (
+    Stacking,
+    StackingFees,
+    StackingFeesWithdrawal,
+    GlobalStacking,
+    StackingReward,
+)
 from api.utils import validate_chain_id
+from api import stacking_series, rewards
+from api.chain_cache import stacking_fees_cache, global_stacking_cache
 from api.views.permissions import WatchTowerPermission
 from api.serializers.stacking import (
     StackingSerializer,
     StackingFeesSerializer,
     StackingFeesWithdrawalSerializer,
+    StackingRewardSerializer,
 )
-from api.messages import WStypes
+from api.messages import WStypes, frame
 from api.consumers.websocket import WebsocketConsumer
 from api.views.authentications import ApiAuthentication
+import api.errors as errors
 from channels.layers import get_channel_layer
 
 from django.db.models import F, Value, CharField
@@ -84,24 +92,20 @@ class StackingView(APIView):
                 address=stacking.validated_data["address"]
             )
         )[0]
-        stacking.save(user=user)
+        amount = stacking.validated_data["amount"] * (
+            -1 if stacking.validated_data["withdraw"] else 1
+        )
+        await sync_to_async(self.save_stacking)(stacking, user, amount)
 
         if stacking.instance:
-            stacking.instance = await stacking.instance
-            amount = stacking.validated_data["amount"] * (
-                -1 if stacking.validated_data["withdraw"] else 1
-            )
-
-            stacking.instance.amount = F("amount") + amount
-            await stacking.instance.asave(update_fields=["amount"])
             stacking.validated_data["amount"] = "{0:f}".format(amount)
 
             await channel_layer.group_send(  # type: ignore
                 f"{request.data['chain_id']}",
-                {
-                    "type": "send.json",
-                    "data": {WStypes.NEW_STACKING: stacking.validated_data},
-                },
+                frame(
+                    f"{request.data['chain_id']}",
+                    {WStypes.NEW_STACKING: stacking.validated_data},
+                ),
             )
 
             return Response(
@@ -111,6 +115,15 @@ class StackingView(APIView):
         else:
             return Response({}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    @transaction.atomic
+    def save_stacking(stacking: StackingSerializer, user: User, amount):
+        """Saves a stacking entry along with the global series of its chain"""
+
+        instance = stacking.save(user=user, amount=amount)
+        stacking_series.record(instance.chain_id, instance.slot, amount)
+        rewards.stake(instance.chain_id, instance.slot)
+
 
 class StackingFeesView(APIView):
     """View used to update the fees entries per token per slot"""
@@ -119,17 +132,15 @@ class StackingFeesView(APIView):
         data = super().get_permissions()
         return data + [permission() for permission in getattr(getattr(self, self.request.method.lower(), self.http_method_not_allowed), "permission_classes", [])]  # type: ignore
 
-    @sync_to_async
-    @method_decorator(cache_page(60 * 60 * 24))
-    @async_to_sync
     async def get(self, request):
         """Used to get the fees entries for all the slots since the creation of the app"""
 
         chain_id = validate_chain_id(request.query_params.get("chain_id", None))
         queryset = StackingFees.objects.filter(chain_id=chain_id).order_by("slot")
-        data = await sync_to_async(
-            lambda: StackingFeesSerializer(queryset, many=True).data
-        )()
+        data = await stacking_fees_cache.aget(
+            chain_id,
+            sync_to_async(lambda: StackingFeesSerializer(queryset, many=True).data),
+        )
         return Response(data, status=status.HTTP_200_OK)
 
     @permission_classes([WatchTowerPermission])
@@ -153,25 +164,20 @@ class StackingFeesView(APIView):
         if not isinstance(stacking_fees.validated_data, dict):
             # never happens
             return Response({}, status=status.HTTP_400_BAD_REQUEST)
-        stacking_fees.save()
+        await sync_to_async(self.save_fees)(stacking_fees)
 
         if stacking_fees.instance:
-            stacking_fees.instance = await stacking_fees.instance
-            amount = "{0:f}".format(
-                stacking_fees.validated_data["amount"] + stacking_fees.instance.amount
+            await stacking_fees_cache.abump(stacking_fees.instance.chain_id)
+            stacking_fees.validated_data["amount"] = "{0:f}".format(
+                stacking_fees.instance.amount
             )
-            stacking_fees.instance.amount = (
-                F("amount") + stacking_fees.validated_data["amount"]
-            )
-            await stacking_fees.instance.asave(update_fields=["amount"])
-            stacking_fees.validated_data["amount"] = amount
 
             await channel_layer.group_send(  # type: ignore
                 f"{request.data['chain_id']}",
-                {
-                    "type": "send.json",
-                    "data": {WStypes.NEW_FEES: stacking_fees.validated_data},
-                },
+                frame(
+                    f"{request.data['chain_id']}",
+                    {WStypes.NEW_FEES: stacking_fees.validated_data},
+                ),
             )
 
             return Response(
@@ -181,6 +187,20 @@ class StackingFeesView(APIView):
         else:
             return Response({}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    @transaction.atomic
+    def save_fees(stacking_fees: StackingFeesSerializer):
+        """Saves a fees entry and shares the added amount between the stackers"""
+
+        instance = stacking_fees.save()
+        rewards.accrue(
+            instance.chain_id,
+            instance.token,
+            instance.slot,
+            instance.amount - stacking_fees.validated_data["amount"],
+            instance.amount,
+        )
+
 
 class StackingFeesWithdrawalView(APIView):
     """View used to update the fees withdrawal entries per token per slot"""
@@ -238,19 +258,17 @@ class StackingFeesWithdrawalView(APIView):
                 address=stacking_fees_withdrawal.validated_data["address"]
             )
         )[0]
-        stacking_fees_withdrawal.save(user=user)
+        await sync_to_async(self.save_withdrawal)(stacking_fees_withdrawal, user)
 
         if stacking_fees_withdrawal.instance:
-            stacking_fees_withdrawal.instance = await stacking_fees_withdrawal.instance
-
             await channel_layer.group_send(  # type: ignore
                 f"{request.data['chain_id']}",
-                {
-                    "type": "send.json",
-                    "data": {
+                frame(
+                    f"{request.data['chain_id']}",
+                    {
                         WStypes.NEW_FSA_WITHDRAWAL: stacking_fees_withdrawal.validated_data
                     },
-                },
+                ),
             )
 
             return Response(
@@ -260,20 +278,181 @@ class StackingFeesWithdrawalView(APIView):
         else:
             return Response({}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    @transaction.atomic
+    def save_withdrawal(
+        stacking_fees_withdrawal: StackingFeesWithdrawalSerializer, user
+    ):
+        """Saves a fees withdrawal along with the rewards of the user"""
+
+        instance = stacking_fees_withdrawal.save(user=user)
+        rewards.withdraw(instance.chain_id, user.id, instance.token)
+
 
 class GlobalStackingView(APIView):
     """View used to retrieve the global staking amount for all the users"""
 
-    @sync_to_async
-    @method_decorator(cache_page(60 * 60 * 24))
-    @async_to_sync
     async def get(self, request):
-        """Retrieves the global stacking amount"""
+        """Retrieves the global stacking amount per slot, or the running total
+        with the `cumulative` param"""
+
         chain_id = validate_chain_id(request.query_params.get("chain_id", None))
-        stacks = (
-            Stacking.objects.filter(chain_id=chain_id)
-            .values_list("slot")
-            .annotate(amount=Sum("amount"))
+        field = "amount"
+        if request.query_params.get("cumulative", None):
+            field = "cumulative"
+        queryset = (
+            GlobalStacking.objects.filter(chain_id=chain_id)
+            .values_list("slot", field)
             .order_by("slot")
         )
+        stacks = await global_stacking_cache.aget(
+            chain_id, sync_to_async(lambda: list(queryset)), field
+        )
         return Response(stacks, status=status.HTTP_200_OK)
+
+
+class StackingRewardsView(APIView):
+    """View used to retrieve the fees claimable by the user per token"""
+
+    authentication_classes = [ApiAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        """Retrieves the fees accrued, withdrawn and claimable by the user"""
+
+        if request.auth == "awaitable":
+            request.user = (await User.objects.aget_or_create(address=request.user))[0]
+
+        chain_id = validate_chain_id(request.query_params.get("chain_id", None))
+        queryset = StackingReward.objects.filter(
+            user=request.user, chain_id=chain_id
+        ).order_by("token")
+        data = await sync_to_async(
+            lambda: StackingRewardSerializer(queryset, many=True).data
+        )()
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class StackingBatchView(APIView):
+    """View used by the watch tower to publish several stacking events at once"""
+
+    permission_classes = [WatchTowerPermission]
+
+    MAX_BATCH_SIZE = 5000
+    SERIALIZERS = {
+        "stacking": StackingSerializer,
+        "fees": StackingFeesSerializer,
+        "withdrawal": StackingFeesWithdrawalSerializer,
+    }
+
+    async def post(self, request):
+        """Allows the watch tower to publish stacking, fees and withdrawal entries
+        in a single transaction
+
+        The events hold the data of `StackingView`, `StackingFeesView` and
+        `StackingFeesWithdrawalView` along with their type. They are applied
+        in order and broadcast as one message per chain. No event is applied
+        when one is rejected, the response then lists the errors of each
+        event, `{}` for the valid ones:\n
+        ```python
+        request.data = {
+            "events": [
+                {"type": "stacking", "address": "0x123...", "withdraw": bool, ...},
+                {"type": "fees", "token": "0x123...", "amount": int, ...},
+                {"type": "withdrawal", "token": "0x123...", "address": "0x123...", ...},
+            ],
+        }
+        response.data = {"events": [{}, {...}, ...]}
+        ```"""
+
+        if (
+            not isinstance(events := request.data.get("events", None), list)
+            or not events
+        ):
+            return Response(
+                {"events": [errors.Stacking.BATCH_FORMAT_ERROR]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(events) > self.MAX_BATCH_SIZE:
+            return Response(
+                {
+                    "events": [
+                        errors.Stacking.BATCH_SIZE_ERROR.format(self.MAX_BATCH_SIZE)
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializers, batch_errors = await sync_to_async(self.validate)(events)
+        if any(batch_errors):
+            return Response(
+                {"events": batch_errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        messages = await sync_to_async(self.apply)(serializers)
+        for chain_id, chain_messages in messages.items():
+            if any(WStypes.NEW_FEES in message for message in chain_messages):
+                await stacking_fees_cache.abump(chain_id)
+            await channel_layer.group_send(  # type: ignore
+                f"{chain_id}",
+                frame(f"{chain_id}", {WStypes.STACKING_EVENTS: chain_messages}),
+            )
+
+        return Response({}, status=status.HTTP_200_OK)
+
+    def validate(self, events: list) -> tuple[list, list]:
+        """Returns the serializers of the events along with their errors"""
+
+        serializers, batch_errors = [], []
+        for event in events:
+            serializer_class = (
+                self.SERIALIZERS.get(event.get("type", None), None)
+                if isinstance(event, dict)
+                else None
+            )
+            if serializer_class is None:
+                serializers.append(None)
+                batch_errors.append({"type": [errors.Stacking.WRONG_EVENT_TYPE]})
+                continue
+            serializer = serializer_class(data=event)
+            serializer.is_valid()
+            serializers.append(serializer)
+            batch_errors.append(serializer.errors)
+        return serializers, batch_errors
+
+    @staticmethod
+    @transaction.atomic
+    def apply(serializers: list) -> dict:
+        """Saves the events in order, returns their websocket messages per chain"""
+
+        addresses = {
+            serializer.validated_data["address"]
+            for serializer in serializers
+            if "address" in serializer.validated_data
+        }
+        User.objects.bulk_create(
+            [User(address=address) for address in addresses], ignore_conflicts=True
+        )
+        users = {
+            user.address: user for user in User.objects.filter(address__in=addresses)
+        }
+
+        messages = {}
+        for serializer in serializers:
+            data = serializer.validated_data
+            if isinstance(serializer, StackingSerializer):
+                amount = data["amount"] * (-1 if data["withdraw"] else 1)
+                StackingView.save_stacking(serializer, users[data["address"]], amount)
+                data["amount"] = "{0:f}".format(amount)
+                message = {WStypes.NEW_STACKING: data}
+            elif isinstance(serializer, StackingFeesSerializer):
+                StackingFeesView.save_fees(serializer)
+                data["amount"] = "{0:f}".format(serializer.instance.amount)
+                message = {WStypes.NEW_FEES: data}
+            else:
+                StackingFeesWithdrawalView.save_withdrawal(
+                    serializer, users[data["address"]]
+                )
+                message = {WStypes.NEW_FSA_WITHDRAWAL: data}
+            messages.setdefault(data["chain_id"], []).append(message)
+        return messages
@@ -16,6 +16,7 @@ from api.utils import (
 )
 from api.models.types import Address, Signature
 from api.serializers.user import UserSerializer
+from api.tokens import issue_token
 import api.errors as errors
 
 
@@ -72,3 +73,19 @@ class UserLogInView(APIView):
         user = (await User.objects.aget_or_create(address=result))[0]
         await sync_to_async(login)(request=request, user=user)
         return Response({}, status=HTTP_200_OK)
+
+
+class UserTokenView(APIView):
+    """Class used to issue the api tokens"""
+
+    async def post(self, request):
+        """Method used to get a short lived api token from a signed message,
+        the token is then sent as `Authorization: Bearer <token>`"""
+
+        success, result = validate_user(request.data, settings.API_TOKEN_MESSAGE)
+
+        if not success:
+            return Response(result, status=HTTP_400_BAD_REQUEST)
+        user = (await User.objects.aget_or_create(address=result))[0]
+        token, expiry = issue_token(user)
+        return Response({"token": token, "expiry": expiry}, status=HTTP_200_OK)
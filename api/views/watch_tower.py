@@ -1,10 +1,16 @@
+import json
+from itertools import groupby
+from hashlib import sha256
 from decimal import Decimal
 from time import time
 from typing import Any
 from django.db.models.expressions import CombinedExpression
 from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import F, Q, Case, CharField, DecimalField, Sum, Value, When
+from django.db import connection, transaction
 from django.db.utils import IntegrityError
 from rest_framework import status
 from rest_framework.response import Response
@@ -15,13 +21,27 @@ import api.errors as errors
 from api.models.types import Address, KeccakHash
 from api.utils import validate_decimal_integer
 from api.views.permissions import WatchTowerPermission
-from api.models.orders import Maker, Bot, Taker
+from api.models.orders import Maker, Bot, Taker, BlockCommit, QueuedCommit
 from api.serializers.orders import TakerSerializer, MakerSerializer
 from api.messages import WStypes
+from api.order_book import order_book, book_key
+from api.ladders import amaterialize, expand
+from api.fixed_point import level_trade, truncate
 from api.consumers.websocket import WebsocketConsumer
-from channels.layers import get_channel_layer
 
-channel_layer = get_channel_layer()
+
+def commit_digest(block, taker, trades: dict) -> str:
+    """Returns the digest identifying a watch tower commit
+
+    The order hashes of the trades are chain specific, the digest thus
+    identifies a commit across chains"""
+
+    payload = json.dumps(
+        {"block": str(block), "taker": taker, "trades": trades},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return sha256(payload.encode()).hexdigest()
 
 
 class WatchTowerView(APIView):
@@ -29,38 +49,105 @@ class WatchTowerView(APIView):
 
     permission_classes = [WatchTowerPermission]
 
-    async def post(self, request):
-        """Function used to update several orders at once\n
+    @staticmethod
+    def load_makers(order_hashes) -> tuple[list, list]:
+        """Returns the traded makers along with their serialized data
 
-        The data sent by the watch tower to the view is like this: \n
-        ```python
-        request.data = {
-            "taker": "0xaddress...",
-            "block": int,
-            "trades":{
-                "0xorderHash1...": {
-                    "amount": int
-                    "base_fees": bool
-                    "fees": int
-                    "is_buyer": bool
-                }
-            }
-        }
-        ```"""
+        The makers are fetched with a single query and serialized at once"""
+
+        makers = list(
+            Maker.objects.filter(order_hash__in=order_hashes)
+            .select_related("bot", "user", "bot__user")
+            .annotate(
+                address=Case(
+                    When(user__isnull=False, then=F("user__address")),
+                    When(bot__isnull=False, then=F("bot__user__address")),
+                    output_field=CharField(),
+                ),
+                base_fees=Value("0"),
+                quote_fees=Value("0"),
+            )
+        )
+        return makers, MakerSerializer(makers, many=True).data
+
+    @staticmethod
+    def commit_key(digest: str) -> str:
+        return f"block_commit_{digest}"
+
+    async def committed(self, digest: str) -> bool:
+        """Returns whether the commit of `digest` has already been applied"""
+
+        return bool(await cache.aget(self.commit_key(digest))) or (
+            await BlockCommit.objects.filter(digest=digest).aexists()
+        )
+
+    @staticmethod
+    def apply_trades(
+        commits: list,
+        fills: list,
+        fees_earned: dict,
+        takers: list,
+        queued: list | None = None,
+    ) -> bool:
+        """Writes the trades of a block into a single transaction
+
+        The maker fills, the bot fees and the takers are each written by one
+        set based statement, nothing is written if one of them fails. Returns
+        `False` when a commit has already been applied by a concurrent request
+
+        Arguments :\n
+        `commits`     -- the unsaved ledger entries of the commits\n
+        `fills`       -- `(maker_id, filled_increment, status)` of the traded makers\n
+        `fees_earned` -- the fees increment of each traded bot id\n
+        `takers`      -- the unsaved takers of the block\n
+        `queued`      -- the ids of the queued commits to remove once applied\n
+        """
+
+        quote = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            try:
+                with transaction.atomic():
+                    BlockCommit.objects.bulk_create(commits)
+            except IntegrityError:
+                return False
+            cursor.execute(
+                f"UPDATE {quote(Maker._meta.db_table)} AS m "
+                "SET filled = m.filled + v.increment, status = v.status "
+                "FROM (VALUES "
+                + ", ".join(["(%s::bigint, %s::numeric, %s::varchar)"] * len(fills))
+                + ") AS v (id, increment, status) WHERE m.id = v.id",
+                [value for fill in fills for value in fill],
+            )
+            if fees_earned:
+                cursor.execute(
+                    f"UPDATE {quote(Bot._meta.db_table)} AS b "
+                    "SET fees_earned = b.fees_earned + v.increment "
+                    "FROM (VALUES "
+                    + ", ".join(["(%s::bigint, %s::numeric)"] * len(fees_earned))
+                    + ") AS v (id, increment) WHERE b.id = v.id",
+                    [value for fees in fees_earned.items() for value in fees],
+                )
+            Taker.objects.bulk_create(takers)
+            if queued:
+                QueuedCommit.objects.filter(id__in=queued).delete()
+        return True
+
+    def parse_commit(self, data) -> Response | tuple:
+        """Returns the `(block, taker, trades)` of a commit or the error response"""
 
-        if (trades := request.data.get("trades", {})) == {}:
+        if (trades := data.get("trades", {})) == {}:
             return Response(
                 {"trades": [errors.General.MISSING_FIELD.format("trade")]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if not (block := request.data.get("block", False)):
+        if not (block := data.get("block", False)):
             return Response(
                 {"block": [errors.General.MISSING_FIELD.format("block")]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if not (taker := request.data.get("taker", False)):
+        if not (taker := data.get("taker", False)):
             return Response(
                 {"taker": [errors.General.MISSING_FIELD.format("taker")]},
                 status=status.HTTP_400_BAD_REQUEST,
@@ -71,6 +158,10 @@ class WatchTowerView(APIView):
                 {"trades": [errors.Order.TRADE_FIELD_FORMAT_ERROR]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        return block, taker, trades
+
+    def validate_commit(self, block, taker, trades: dict) -> Response | None:
+        """Returns the error response of a malformed commit"""
 
         try:
             checksum_address = Address(taker)
@@ -82,200 +173,112 @@ class WatchTowerView(APIView):
             return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            makers_hash_list = [KeccakHash(maker_hash) for maker_hash in trades.keys()]
+            [KeccakHash(maker_hash) for maker_hash in trades.keys()]
         except (KeyError, ValidationError):
             return Response(
                 {"error": [errors.Order.TRADE_DATA_ERROR]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        takers: Any = {}
-        user = (await User.objects.aget_or_create(address=checksum_address))[0]
-        makers = (
-            Maker.objects.filter(order_hash__in=makers_hash_list)
-            .select_related("bot", "user", "bot__user")
-            .prefetch_related("takers")
-            .annotate(
-                address=Case(
-                    When(user__isnull=False, then=F("user__address")),
-                    When(bot__isnull=False, then=F("bot__user__address")),
-                    output_field=CharField(),
-                ),
-                base_fees=Value("0"),
-                quote_fees=Value("0"),
-            )
+    async def commit(self, commits: list, queued: list | None = None) -> Response:
+        """Applies the trades of one or several commits of the same block at once
+
+        Arguments :\n
+        `commits` -- `(ledger_entry, taker_user, trades)` of each commit\n
+        `queued`  -- the ids of the queued commits applied\n
+        """
+
+        order_hashes = list(
+            {order_hash: None for _, _, trades in commits for order_hash in trades}
         )
-        bot_update = []
+        await amaterialize(order_hashes)
+        makers, makers_data = await sync_to_async(self.load_makers)(order_hashes)
+        if len(makers) != len(order_hashes):
+            # the commit is not recorded, its retries apply it once all its makers are found
+            return Response(
+                {"error": [errors.Order.NO_MAKER_FOUND]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        traded = {maker.order_hash: (maker, data) for maker, data in zip(makers, makers_data)}
+        loaded = {maker.id: maker.filled for maker in makers}
+        takers: Any = {}
+        taker_users = {}
         maker_ws = {}
-        taker_price = ""
+        fees_earned = {}
+
+        for commit, user, trades in commits:
+            for order_hash, trade in trades.items():
+                maker, maker_data = traded[order_hash]
+                channel = book_key(maker.chain_id, maker.base_token, maker.quote_token)
+                try:
+                    amount = int(Decimal(trade["amount"]))
+                    trade_fees = Decimal(trade["fees"])
+                    is_buyer = trade["is_buyer"]
+                    base_fees = trade["base_fees"]
+                    reverse = maker.bot is not None and maker.is_buyer == is_buyer
+                except (KeyError, TypeError, ValueError, ArithmeticError):
+                    return Response(
+                        {"error": [errors.Order.TRADE_DATA_ERROR]},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
 
-        async for maker in makers:
-            channel = f"{str(maker.chain_id).lower()}{str(maker.base_token).lower()}{str(maker.quote_token.lower())}"
-            amount = Decimal(trades[maker.order_hash]["amount"])
-            try:
-                temp_maker_ws = await sync_to_async(
-                    lambda: MakerSerializer(maker, context={"private": True}).data
-                )()
-                if channel not in takers:
-                    takers[channel] = []
-                if channel not in maker_ws:
-                    maker_ws[channel] = []
+                # the fills of a maker traded several times into the block add up
+                if reverse:
+                    maker.filled -= amount
+                else:
+                    maker.filled += amount
+                    if maker.filled == maker.amount:
+                        maker.status = Maker.FILLED
+                maker_data["filled"] = "{0:f}".format(maker.filled)
+                maker_data["status"] = maker.get_status_display()
+                temp_maker_ws = dict(maker_data)
 
                 if maker.bot is not None:
-                    if maker.is_buyer == trades[maker.order_hash]["is_buyer"]:
-                        maker.filled = F("filled") - trades[maker.order_hash]["amount"]
-                        temp_maker_ws["filled"] = "{0:f}".format(
-                            Decimal(temp_maker_ws["filled"])
-                            - Decimal(trades[maker.order_hash]["amount"])
-                        )
-                        if maker.is_buyer:
-                            taker_price = "{0:f}".format(
-                                Decimal(maker.price * (maker.bot.maker_fees + 1000) / 1000).quantize(Decimal("1."))
-                            )
-
-                            if maker.bot.maker_fees > Decimal("2000"):
-                                fees = maker.bot.maker_fees * amount / Decimal("1e18")
-                            else:
-                                fees = (
-                                    (
-                                        (
-                                            maker.price * maker.bot.maker_fees
-                                            + Decimal("1000")
-                                        )
-                                        / (Decimal("1000"))
-                                        - maker.price
-                                    )
-                                    * amount
-                                    / Decimal("1e18")
-                                )
-                        else:
-                            taker_price = "{0:f}".format(
-                                Decimal(maker.price * 1000 / (maker.bot.maker_fees + 1000)).quantize(Decimal("1."))
-                            )
-
-                            if maker.bot.maker_fees > Decimal("2000"):
-                                fees = maker.bot.maker_fees * amount / Decimal("1e18")
-                            else:
-                                fees = (
-                                    (
-                                        maker.price
-                                        - (maker.price * Decimal("1000"))
-                                        / (maker.bot.maker_fees + Decimal("1000"))
-                                    )
-                                    * amount
-                                    / Decimal("1e18")
-                                )
-                    else:
-                        if (
-                            maker.filled + Decimal(trades[maker.order_hash]["amount"])
-                            == maker.amount
-                        ):
-                            maker.filled = maker.amount
-                            maker.status = Maker.FILLED
-                            temp_maker_ws["filled"] = temp_maker_ws["amount"]
-                            temp_maker_ws["status"] = "FILLED"
-                        else:
-                            maker.filled = (
-                                F("filled") + trades[maker.order_hash]["amount"]
-                            )
-                            temp_maker_ws["filled"] = "{0:f}".format(
-                                Decimal(temp_maker_ws["filled"])
-                                + Decimal(trades[maker.order_hash]["amount"])
-                            )
-                        if maker.is_buyer:
-                            taker_price = "{0:f}".format(
-                                Decimal(maker.price * 1000 / (maker.bot.maker_fees + 1000)).quantize(Decimal("1."))
-                            )
-                            if maker.bot.maker_fees > Decimal("2000"):
-                                fees = maker.bot.maker_fees * amount / Decimal("1e18")
-                            else:
-                                fees = (
-                                    (
-                                        maker.price
-                                        - (maker.price * Decimal("1000"))
-                                        / (maker.bot.maker_fees + Decimal("1000"))
-                                    )
-                                    * amount
-                                    / Decimal("1e18")
-                                )
-                        else:
-                            taker_price = "{0:f}".format(
-                                Decimal(maker.price * (maker.bot.maker_fees + 1000) / 1000).quantize(Decimal("1."))
-                            )
-                            if maker.bot.maker_fees > Decimal("2000"):
-                                fees = maker.bot.maker_fees * amount / Decimal("1e18")
-                            else:
-                                fees = (
-                                    (
-                                        (
-                                            maker.price
-                                            * (maker.bot.maker_fees + Decimal("1000"))
-                                        )
-                                        / (Decimal("1000"))
-                                        - maker.price
-                                    )
-                                    * amount
-                                    / Decimal("1e18")
-                                )
-                    temp_maker_ws["bot"]["fees_earned"] = "{0:f}".format(
-                        (Decimal(maker.bot.fees_earned) + Decimal(fees)).quantize(
-                            Decimal("1.")
-                        )
-                    )
-                    maker.bot.fees_earned = F("fees_earned") + fees.quantize(
-                        Decimal("1.")
+                    price, numerator, denominator = level_trade(
+                        int(maker.price),
+                        int(maker.bot.maker_fees),
+                        amount,
+                        maker.is_buyer,
+                        reverse,
                     )
-                    bot_update.append(maker.bot)
+                    taker_price = str(price)
+                    # several levels of a bot can be traded into the same block
+                    earned = int(maker.bot.fees_earned) + fees_earned.get(maker.bot_id, 0)
+                    temp_maker_ws["bot"] = {
+                        **maker_data["bot"],
+                        "fees_earned": str(
+                            truncate(earned * denominator + numerator, denominator)
+                        ),
+                    }
+                    fees_earned[maker.bot_id] = fees_earned.get(
+                        maker.bot_id, 0
+                    ) + truncate(numerator, denominator)
                 else:
                     taker_price = "{0:f}".format(maker.price)
-                    if (
-                        maker.filled + Decimal(trades[maker.order_hash]["amount"])
-                        == maker.amount
-                    ):
-                        maker.filled = maker.amount
-                        maker.status = Maker.FILLED
-                        temp_maker_ws["filled"] = temp_maker_ws["amount"]
-                        temp_maker_ws["status"] = "FILLED"
-                    else:
-                        maker.filled = F("filled") + trades[maker.order_hash]["amount"]
-                        temp_maker_ws["filled"] = "{0:f}".format(
-                            Decimal(temp_maker_ws["filled"])
-                            + Decimal(trades[maker.order_hash]["amount"])
-                        )
 
                 # The base fees and the quote fees field represents the fees increment
                 # Computing the exact fees amount gathered so far would be uselessly costly
-                if trades[maker.order_hash]["base_fees"]:
-                    temp_maker_ws["base_fees"] = "{0:f}".format(
-                        Decimal(trades[maker.order_hash]["fees"])
-                    )
+                if base_fees:
+                    temp_maker_ws["base_fees"] = "{0:f}".format(trade_fees)
                 else:
-                    temp_maker_ws["quote_fees"] = "{0:f}".format(
-                        Decimal(trades[maker.order_hash]["fees"])
-                    )
+                    temp_maker_ws["quote_fees"] = "{0:f}".format(trade_fees)
 
-                maker_ws[channel].append(temp_maker_ws)
-                takers[channel].append(
+                maker_ws.setdefault(channel, []).append(temp_maker_ws)
+                taker_users[user.address] = user
+                takers.setdefault(channel, []).append(
                     {
                         "maker_id": maker.id,
-                        "block": block,
-                        "amount": trades[maker.order_hash]["amount"],
+                        "block": commit.block,
+                        "amount": trade["amount"],
                         "price": taker_price,
-                        "fees": "{0:f}".format(
-                            Decimal(trades[maker.order_hash]["fees"]) * 2
-                        ),
-                        "is_buyer": trades[maker.order_hash]["is_buyer"],
-                        "base_fees": trades[maker.order_hash]["base_fees"],
+                        "fees": "{0:f}".format(trade_fees * 2),
+                        "is_buyer": is_buyer,
+                        "base_fees": base_fees,
                         "address": user.address,
                         "maker_hash": maker.order_hash,
                         "chain_id": maker.chain_id,
                     }
                 )
-            except KeyError as e:
-                return Response(
-                    {"error": [errors.Order.TRADE_DATA_ERROR]},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
 
         if not takers:
             return Response(
@@ -283,41 +286,111 @@ class WatchTowerView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        takers_serializer = TakerSerializer(data=[taker for taker_array in takers.values() for taker in taker_array], many=True)  # type: ignore
+        takers_data = [taker for taker_array in takers.values() for taker in taker_array]
+        takers_serializer = TakerSerializer(data=takers_data, many=True)  # type: ignore
         await sync_to_async(takers_serializer.is_valid)(raise_exception=True)
-        takers_serializer.save(user=user)
-        if takers_serializer.instance:
-            takers_serializer.instance = await takers_serializer.instance
-
         try:
-            await Maker.objects.abulk_update(makers, ["filled", "status"])  # type: ignore
+            applied = await sync_to_async(self.apply_trades)(
+                [commit for commit, _, _ in commits],
+                [
+                    (maker.id, maker.filled - loaded[maker.id], maker.status)
+                    for maker, _ in traded.values()
+                ],
+                fees_earned,
+                [
+                    Taker(**taker, user=taker_users[data["address"]])
+                    for taker, data in zip(
+                        takers_serializer.validated_data, takers_data  # type: ignore
+                    )
+                ],
+                queued,
+            )
         except IntegrityError as e:
             return Response(
                 {"error": [errors.Order.ORDER_POSITIVE_VIOLATION]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if bot_update:
-            await Bot.objects.abulk_update(bot_update, ["fees_earned"])  # type: ignore
+        digests = [commit.digest for commit, _, _ in commits]
+        if not applied:
+            # only the commits recorded by the concurrent request are replays
+            digests = await sync_to_async(list)(
+                BlockCommit.objects.filter(digest__in=digests).values_list(
+                    "digest", flat=True
+                )
+            )
+        await cache.aset_many(
+            {self.commit_key(digest): True for digest in digests},
+            timeout=settings.WATCH_TOWER_REPLAY_WINDOW,
+        )
+        if not applied:
+            return Response({}, status=status.HTTP_200_OK)
+
         for channel_name in maker_ws:
+            await order_book.aapply(
+                channel_name,
+                lambda book: book.update_makers(maker_ws[channel_name]),
+            )
             for data in takers[channel_name]:
                 del data["maker_id"]
                 data["timestamp"] = int(time())
-            await channel_layer.group_send(  # type: ignore
+            await order_book.abroadcast(
                 channel_name,
                 {
-                    "type": "send.json",
-                    "data": {
-                        WStypes.MAKERS_UPDATE: maker_ws[channel_name],
-                        WStypes.NEW_TAKERS: takers[channel_name],
-                    },
+                    WStypes.MAKERS_UPDATE: maker_ws[channel_name],
+                    WStypes.NEW_TAKERS: takers[channel_name],
                 },
             )
 
         return Response({}, status=status.HTTP_200_OK)
 
+    async def post(self, request):
+        """Function used to update several orders at once\n
+
+        The data sent by the watch tower to the view is like this: \n
+        ```python
+        request.data = {
+            "taker": "0xaddress...",
+            "block": int,
+            "trades":{
+                "0xorderHash1...": {
+                    "amount": int
+                    "base_fees": bool
+                    "fees": int
+                    "is_buyer": bool
+                }
+            }
+        }
+        ```"""
+
+        if isinstance(parsed := self.parse_commit(request.data), Response):
+            return parsed
+        block, taker, trades = parsed
+
+        # the watch tower retries its commits, a commit already applied is not replayed
+        digest = commit_digest(block, taker, trades)
+        if await self.committed(digest):
+            return Response({}, status=status.HTTP_200_OK)
+
+        if (error := self.validate_commit(block, taker, trades)) is not None:
+            return error
+
+        user = (await User.objects.aget_or_create(address=taker))[0]
+        return await self.commit(
+            [(BlockCommit(digest=digest, block=int(block), taker=taker), user, trades)]
+        )
+
     async def delete(self, request):
-        """Function used for maker order or bot cancellation"""
+        """Function used for maker order or bot cancellation\n
+
+        Several orders, possibly from different pairs, can be cancelled at once
+        by sending their hashes as a list:\n
+        ```python
+        request.data = {"orderHashes": ["0xorderHash1...", "0xbotHash1...", ...]}
+        ```"""
+
+        if "orderHashes" in request.data:
+            return await self.delete_batch(request.data["orderHashes"])
 
         chain_id = ""
         if not (base_token := request.data.get("baseToken", None)):
@@ -370,20 +443,108 @@ class WatchTowerView(APIView):
 
             maker.status = Maker.CANCELLED
             await maker.asave()
-            await channel_layer.group_send(  # type: ignore
-                f"{str(chain_id).lower()}{str(base_token).lower()}{str(quote_token.lower())}",
-                {"type": "send.json", "data": {WStypes.DEL_MAKERS: [maker.order_hash]}},
+            await order_book.abroadcast(
+                book_key(chain_id, base_token, quote_token),
+                {WStypes.DEL_MAKERS: [maker.order_hash]},
             )
         elif bot:
-            await bot.adelete()  # type: ignore
-            await channel_layer.group_send(  # type: ignore
-                f"{str(chain_id).lower()}{str(base_token).lower()}{str(quote_token.lower())}",
-                {"type": "send.json", "data": {WStypes.DEL_BOTS: [bot.bot_hash]}},
+            async with order_book.batch():
+                await bot.adelete()  # type: ignore
+            await order_book.abroadcast(
+                book_key(chain_id, base_token, quote_token),
+                {WStypes.DEL_BOTS: [bot.bot_hash]},
+            )
+
+        return Response({}, status=status.HTTP_200_OK)
+
+    async def delete_batch(self, order_hashes):
+        """Cancels the makers and deletes the bots matching a list of hashes,
+        one numbered frame is sent per pair"""
+
+        if (
+            not isinstance(order_hashes, list)
+            or not order_hashes
+            or not all(isinstance(order_hash, str) for order_hash in order_hashes)
+        ):
+            return Response(
+                {"orderHashes": [errors.Order.ORDER_HASHES_FORMAT_ERROR]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        makers = await sync_to_async(list)(
+            Maker.objects.filter(order_hash__in=order_hashes)
+            .exclude(status=Maker.CANCELLED)
+            .order_by("id")
+        )
+        bots = await sync_to_async(list)(
+            Bot.objects.filter(bot_hash__in=order_hashes).order_by("id")
+        )
+        if not makers and not bots:
+            return Response(
+                {"order_hash": [errors.Order.NO_MAKER_FOUND]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        channels = {}
+        for maker in makers:
+            key = book_key(maker.chain_id, maker.base_token, maker.quote_token)
+            channels.setdefault(key, {}).setdefault(WStypes.DEL_MAKERS, [])
+            channels[key][WStypes.DEL_MAKERS].append(maker.order_hash)
+        for bot in bots:
+            key = book_key(bot.chain_id, bot.base_token, bot.quote_token)
+            channels.setdefault(key, {}).setdefault(WStypes.DEL_BOTS, [])
+            channels[key][WStypes.DEL_BOTS].append(bot.bot_hash)
+
+        if makers:
+            await Maker.objects.filter(id__in=[maker.id for maker in makers]).aupdate(
+                status=Maker.CANCELLED
             )
+            for key, data in channels.items():
+                if WStypes.DEL_MAKERS in data:
+                    await order_book.aapply(
+                        key, lambda book: book.cancel(*data[WStypes.DEL_MAKERS])
+                    )
+        if bots:
+            async with order_book.batch():
+                await Bot.objects.filter(id__in=[bot.id for bot in bots]).adelete()
+
+        for key, data in channels.items():
+            await order_book.abroadcast(key, data)
 
         return Response({}, status=status.HTTP_200_OK)
 
 
+class WatchTowerQueueView(WatchTowerView):
+    """The view for the watch tower to queue its commits
+
+    The commits are acknowledged once stored, the queue worker applies the
+    commits of a same block at once, see `drain_commits`"""
+
+    http_method_names = ["post", "options"]
+
+    async def post(self, request):
+        """Function used to queue the update of several orders\n
+
+        The data sent is the one of the `WatchTowerView` commits"""
+
+        if isinstance(parsed := self.parse_commit(request.data), Response):
+            return parsed
+        block, taker, trades = parsed
+
+        digest = commit_digest(block, taker, trades)
+        if await self.committed(digest):
+            return Response({}, status=status.HTTP_200_OK)
+
+        if (error := self.validate_commit(block, taker, trades)) is not None:
+            return error
+
+        await QueuedCommit.objects.aget_or_create(
+            digest=digest,
+            defaults={"block": int(block), "taker": taker, "trades": trades},
+        )
+        return Response({}, status=status.HTTP_202_ACCEPTED)
+
+
 class WatchTowerVerificationView(APIView):
     """The view for the watch tower to send order that can possibly be deleted"""
 
@@ -415,13 +576,30 @@ class WatchTowerVerificationView(APIView):
         delete_makers_ws = []
         delete_bots = {}
 
-        makers = Maker.objects.select_related("user", "bot", "bot__user").filter(
-            Q(base_token=checksum_token) | Q(quote_token=checksum_token),
-            Q(user__address__in=addresses) | Q(bot__user__address__in=addresses),
-            chain_id=chain_id,
+        makers = await sync_to_async(list)(
+            Maker.objects.select_related("user")
+            .filter(
+                Q(base_token=checksum_token) | Q(quote_token=checksum_token),
+                user__address__in=addresses,
+                chain_id=chain_id,
+            )
+            .order_by("id")
+        )
+        bots = (
+            Bot.objects.select_related("user")
+            .prefetch_related("orders")
+            .filter(
+                Q(base_token=checksum_token) | Q(quote_token=checksum_token),
+                user__address__in=addresses,
+                chain_id=chain_id,
+            )
+            .order_by("id")
         )
+        makers += await sync_to_async(
+            lambda: [maker for bot in bots for maker in expand(bot)]
+        )()
 
-        async for maker in makers:
+        for maker in makers:
             if maker.base_token == checksum_token:
                 if maker.amount - maker.filled > Decimal(
                     faulty_orders[
@@ -459,9 +637,17 @@ class WatchTowerVerificationView(APIView):
         await Maker.objects.filter(id__in=[i.id for i in delete_makers]).aupdate(
             status=Maker.CANCELLED
         )
-        await Bot.objects.filter(
-            id__in=[i["bot"].id for i in delete_bots.values()]
-        ).adelete()
+        cancelled_makers = {}
+        for maker in delete_makers:
+            key = book_key(maker.chain_id, maker.base_token, maker.quote_token)
+            cancelled_makers.setdefault(key, []).append(maker.order_hash)
+        for key, order_hashes in cancelled_makers.items():
+            await order_book.aapply(key, lambda book: book.remove(*order_hashes))
+
+        async with order_book.batch():
+            await Bot.objects.filter(
+                id__in=[i["bot"].id for i in delete_bots.values()]
+            ).adelete()
 
         makers_ordered = dict()
         for maker in delete_makers_ws:
@@ -481,12 +667,71 @@ class WatchTowerVerificationView(APIView):
             data = {WStypes.DEL_MAKERS: makers_ordered[channel]}
             if channel in bots_ordered:
                 data.update({WStypes.DEL_BOTS: bots_ordered[channel]})
-            await channel_layer.group_send(  # type: ignore
-                channel,
-                {
-                    "type": "send.json",
-                    "data": data,
-                },
-            )
+            await order_book.abroadcast(channel, data)
 
         return Response({}, status=status.HTTP_200_OK)
+
+
+async def drain_commits(limit: int | None = None) -> int:
+    """Applies the queued watch tower commits, lowest block first
+
+    The commits of a same block are merged and applied at once, when the
+    merged batch fails its commits are applied one by one and the failing
+    ones are kept with their error. Returns the number of commits processed
+
+    Arguments :\n
+    `limit` -- the maximum number of commits processed, `WATCH_TOWER_QUEUE_BATCH` by default\n
+    """
+
+    queued = await sync_to_async(list)(
+        QueuedCommit.objects.filter(error__isnull=True).order_by("block", "id")[
+            : limit or settings.WATCH_TOWER_QUEUE_BATCH
+        ]
+    )
+    committed = set(
+        await sync_to_async(list)(
+            BlockCommit.objects.filter(
+                digest__in=[entry.digest for entry in queued]
+            ).values_list("digest", flat=True)
+        )
+    )
+    if committed:
+        await QueuedCommit.objects.filter(digest__in=committed).adelete()
+
+    view = WatchTowerView()
+    users = {}
+    for _, block_entries in groupby(
+        [entry for entry in queued if entry.digest not in committed],
+        key=lambda entry: entry.block,
+    ):
+        entries = list(block_entries)
+        for entry in entries:
+            if entry.taker not in users:
+                users[entry.taker] = (
+                    await User.objects.aget_or_create(address=entry.taker)
+                )[0]
+
+        batches = [entries] if len(entries) == 1 else [entries, *([e] for e in entries)]
+        for batch in batches:
+            try:
+                response = await view.commit(
+                    [
+                        (
+                            BlockCommit(
+                                digest=entry.digest, block=entry.block, taker=entry.taker
+                            ),
+                            users[entry.taker],
+                            entry.trades,
+                        )
+                        for entry in batch
+                    ],
+                    [entry.id for entry in batch],
+                )
+                error = None if response.status_code == 200 else response.data
+            except ValidationError as e:
+                error = e.detail
+            if error is None and len(batch) > 1:
+                break
+            if error is not None and len(batch) == 1:
+                await QueuedCommit.objects.filter(id=batch[0].id).aupdate(error=error)
+    return len(queued)
@@ -12,12 +12,17 @@ import os
 from django.core.asgi import get_asgi_application
 from django.urls import re_path
 from channels.routing import ProtocolTypeRouter, URLRouter
-from api.consumers.websocket import WebsocketConsumer, TestWebsocketConsumer
+from api.consumers.websocket import (
+    WebsocketConsumer,
+    MultiplexConsumer,
+    TestWebsocketConsumer,
+)
 from backend import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 routes = [
+    re_path(r"^ws$", MultiplexConsumer.as_asgi()),
     re_path(r"^ws/stacking/(?P<chain_id>\w+)$", WebsocketConsumer.as_asgi()),
     re_path(
         r"^ws/trade/(?P<chain_id>\w+)/(?P<base>\w+)/(?P<quote>\w+)$",
@@ -1,8 +1,25 @@
-from api.models.orders import Maker
-from datetime import datetime
+from api.models.orders import Maker, Bot, BlockCommit
+from api.order_book import order_book, book_key
+from datetime import datetime, timedelta
+from django.conf import settings
 
 def deleting_expired_orders():
     """Cron job function to delete the expired orders from the database"""
     queryset = Maker.objects.filter(expiry__lte=datetime.now())
+    pairs = set(queryset.values_list("chain_id", "base_token", "quote_token"))
     queryset._raw_delete(queryset.db) #type: ignore
 
+    # the bots levels share the bot expiry, their makers are already deleted
+    bots = Bot.objects.filter(expiry__lte=datetime.now())
+    pairs |= set(bots.values_list("chain_id", "base_token", "quote_token"))
+    bots._raw_delete(bots.db) #type: ignore
+    for pair in pairs:
+        order_book.apply(book_key(*pair))
+
+
+def deleting_old_block_commits():
+    """Cron job function to delete the commits too old to be retried"""
+    BlockCommit.objects.filter(
+        timestamp__lte=datetime.now()
+        - timedelta(seconds=settings.WATCH_TOWER_REPLAY_WINDOW)
+    ).delete()
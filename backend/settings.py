@@ -62,7 +62,10 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-CRONJOBS = [("0 3 * * *", "backend.cron.deleting_expired_orders")]
+CRONJOBS = [
+    ("0 3 * * *", "backend.cron.deleting_expired_orders"),
+    ("0 3 * * *", "backend.cron.deleting_old_block_commits"),
+]
 
 CSRF_COOKIE_NAME = "XSRF-TOKEN"
 CSRF_HEADER_NAME = "HTTP_X_XSRF_TOKEN"
@@ -172,9 +175,26 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+# processes recovering the orders signers, None uses one per cpu, 0 none
+SIGNATURE_VERIFICATION_WORKERS = None
 LOG_IN_MESSAGE = "log in into coss3.io as {address} at {timestamp}"
 API_LOG_IN_MESSAGE = (
     "api request into coss3.io as {{address}} at {{timestamp}} {method}{path}"
 )
+API_TOKEN_MESSAGE = "api token for coss3.io as {address} at {timestamp}"
+API_TOKEN_LIFETIME = 3600
+# seconds during which a retried watch tower commit is recognized
+WATCH_TOWER_REPLAY_WINDOW = 60 * 60 * 24
+# commits drained at once by the watch tower queue worker, and its idle delay
+WATCH_TOWER_QUEUE_BATCH = 1000
+WATCH_TOWER_QUEUE_INTERVAL = 0.5
+# seconds during which the websocket deltas of a pair are merged, 0 sends them at once
+WEBSOCKET_COALESCING_WINDOW = 0.02
+# channels a multiplexed websocket connection can subscribe to
+WEBSOCKET_MAX_SUBSCRIPTIONS = 50
+# frames waiting to be written to a websocket client before its pairs are conflated
+WEBSOCKET_QUEUE_SIZE = 256
+# lifetime of the cached stacking data, the entries are invalidated by the writes
+STACKING_CACHE_TIMEOUT = 60 * 60
 
 from .local_settings import *